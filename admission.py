@@ -0,0 +1,233 @@
+import logging
+import math
+import os
+import threading
+import time
+from flask import g, jsonify, request
+from auth import current_identity
+from fanout import SUBREQUEST_KEY
+
+logger = logging.getLogger(__name__)
+
+# 准入控制配置
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', '1') not in ('0', 'false')
+# 限流状态存储：memory为进程内（每个worker各自计数），redis://host:port/db 为多个worker、多台服务器共享
+RATE_LIMIT_STORAGE = os.getenv('RATE_LIMIT_STORAGE', 'memory')
+ADMISSION_WAIT_SECONDS = float(os.getenv('ADMISSION_WAIT_SECONDS', '2'))  # 排队等待执行的最长秒数
+MEMORY_STORE_MAX_KEYS = 100000
+
+def _limits(name, rate, burst, concurrency=None, queue=0, per_endpoint=False):
+    """路由类别的限制，可用环境变量 ADMISSION_<类别>="每秒令牌数,桶容量,并发数,排队数" 覆盖，并发数0为不限
+
+    per_endpoint为True时每个接口各有一个令牌桶，否则同一类别的接口共用一个。
+    """
+    override = os.getenv(f'ADMISSION_{name.upper()}')
+    if override:
+        values = [value.strip() for value in override.split(',')]
+        rate, burst = float(values[0]), int(values[1])
+        if len(values) > 2:
+            concurrency = int(values[2]) or None
+        if len(values) > 3:
+            queue = int(values[3])
+    return {'rate': rate, 'burst': burst, 'concurrency': concurrency, 'queue': queue, 'per_endpoint': per_endpoint}
+
+# 路由类别：令牌桶按 (类别, 用户或IP) 计数；并发数限制每个进程同时执行的请求，超出的最多排队queue个
+ROUTE_CLASSES = {
+    'default': _limits('default', 20, 60),
+    'login': _limits('login', 1, 10),
+    'recommendations': _limits('recommendations', 2, 10, concurrency=4, queue=8),
+    'stats': _limits('stats', 1, 10, concurrency=2, queue=4),
+    # 歌曲、专辑等页面一次加载几个不同的完整列表，按接口分别计数，正常翻页浏览不会触发限流
+    'full_list': _limits('full_list', 0.5, 10, concurrency=4, queue=16, per_endpoint=True),
+    'import': _limits('import', 0.05, 2, concurrency=1),
+}
+
+ENDPOINT_CLASSES = {
+    'api.login': 'login',
+    'api.get_recommendations': 'recommendations',
+    'api.get_popular_recommendations': 'recommendations',
+    'api.get_similar_songs': 'recommendations',
+    'api.get_stats_overview': 'stats',
+    'api.get_top_singers': 'stats',
+    'api.get_top_songs': 'stats',
+    'api.get_genre_distribution': 'stats',
+    'api.get_user_activity': 'stats',
+    'api.get_singer_nationality': 'stats',
+    'api.get_dashboard': 'stats',
+    'api.bulk_import': 'import',
+}
+
+# 不带limit/cursor参数时返回整张表的列表接口
+FULL_LIST_ENDPOINTS = {
+    'api.get_users', 'api.get_singers', 'api.get_albums', 'api.get_songs',
+    'api.get_favorites', 'api.get_playlists',
+}
+
+def route_class(endpoint, args):
+    if endpoint in ENDPOINT_CLASSES:
+        return ENDPOINT_CLASSES[endpoint]
+    if endpoint in FULL_LIST_ENDPOINTS and 'limit' not in args and 'cursor' not in args:
+        return 'full_list'
+    return 'default'
+
+# ---------- 令牌桶存储 ----------
+class MemoryStore:
+    """进程内令牌桶，{键: (剩余令牌, 更新时间, 回满所需秒数)}"""
+
+    def __init__(self, max_keys=MEMORY_STORE_MAX_KEYS):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self.max_keys = max_keys
+
+    def take(self, key, rate, burst):
+        """取一个令牌，返回0表示允许，否则返回需要等待的秒数"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (burst, now, 0))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now, (burst - tokens) / rate)
+            if len(self._buckets) > self.max_keys:
+                self._evict(now)
+        return wait
+
+    def _evict(self, now):
+        """删除已经回满的桶，它们与不存在的桶等价"""
+        for key in [key for key, (_, updated, refill) in self._buckets.items() if now - updated >= refill]:
+            del self._buckets[key]
+
+class RedisStore:
+    """Redis（或兼容协议的服务）中的令牌桶，多个进程共享计数；用Lua脚本保证取令牌是原子的"""
+
+    SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens, updated = tonumber(state[1]) or burst, tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, url):
+        import redis  # 可选依赖，只在配置了redis存储时需要
+        self._client = redis.Redis.from_url(url, socket_timeout=0.2)
+        self._script = self._client.register_script(self.SCRIPT)
+        self._errors = redis.RedisError
+
+    def take(self, key, rate, burst):
+        try:
+            return float(self._script(keys=[f'ratelimit:{key}'], args=[rate, burst, time.time()]))
+        except self._errors as e:
+            # 存储不可用时放行，限流失效好过全部接口不可用
+            logger.warning('限流存储不可用，放行请求: %s', e)
+            return 0.0
+
+def create_store(url=RATE_LIMIT_STORAGE):
+    if url == 'memory':
+        return MemoryStore()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore(url)
+    raise ValueError(f'不支持的RATE_LIMIT_STORAGE: {url}')
+
+# ---------- 并发限制 ----------
+class Gate:
+    """限制同时执行的请求数，超出时最多queue个请求等待空位，其余立即拒绝"""
+
+    def __init__(self, concurrency, queue, wait=ADMISSION_WAIT_SECONDS):
+        self.concurrency = concurrency
+        self.queue = queue
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+
+    def enter(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self.waiting >= self.queue:
+                    return False
+                self.waiting += 1
+            try:
+                if not self._slots.acquire(timeout=self.wait):
+                    return False
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+        with self._lock:
+            self.active += 1
+        return True
+
+    def leave(self):
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+class AdmissionControl:
+    """api蓝图的准入控制：请求进入视图、访问数据库之前按令牌桶限流（429），
+    昂贵接口再受并发数和排队长度限制（503）
+
+    组合接口转发的子请求已在外层请求处计数，不再重复检查。
+    """
+
+    def __init__(self, classes=ROUTE_CLASSES, store=None):
+        self.classes = classes
+        self.store = store or create_store()
+        self.gates = {name: Gate(limits['concurrency'], limits['queue'])
+                      for name, limits in classes.items() if limits['concurrency']}
+        self._lock = threading.Lock()
+        self.counts = {name: {'admitted': 0, 'throttled': 0, 'shed': 0} for name in classes}
+
+    def _count(self, name, outcome):
+        with self._lock:
+            self.counts[name][outcome] += 1
+
+    def _reject(self, name, outcome, status, message, retry_after):
+        self._count(name, outcome)
+        response = jsonify({'error': message})
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def admit(self):
+        """before_request：超出限制时直接返回429/503响应"""
+        if not ADMISSION_ENABLED or request.method == 'OPTIONS' or request.environ.get(SUBREQUEST_KEY):
+            return None
+        name = route_class(request.endpoint, request.args)
+        limits = self.classes[name]
+        identity = current_identity()
+        client = f'user:{identity["id"]}' if identity else f'ip:{request.remote_addr}'
+        bucket = f'{name}:{request.endpoint}' if limits['per_endpoint'] else name
+        wait = self.store.take(f'{bucket}:{client}', limits['rate'], limits['burst'])
+        if wait > 0:
+            return self._reject(name, 'throttled', 429, '请求过于频繁，请稍后重试', wait)
+        gate = self.gates.get(name)
+        if gate is not None:
+            if not gate.enter():
+                return self._reject(name, 'shed', 503, '服务繁忙，请稍后重试', 1)
+            g.admission_gate = gate
+        self._count(name, 'admitted')
+        return None
+
+    def release(self, exc=None):
+        """teardown_request：归还并发名额（流式响应在输出结束后才归还）"""
+        gate = g.pop('admission_gate', None)
+        if gate is not None:
+            gate.leave()
+
+    def stats(self):
+        with self._lock:
+            counts = {name: dict(values) for name, values in self.counts.items()}
+        for name, gate in self.gates.items():
+            counts[name].update(active=gate.active, waiting=gate.waiting,
+                                concurrency=gate.concurrency, queue=gate.queue)
+        return {'storage': type(self.store).__name__, 'classes': counts}
+
+admission = AdmissionControl()
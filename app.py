@@ -1,4 +1,5 @@
 from flask import Flask, jsonify
+import click
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
@@ -14,28 +15,232 @@ pymysql.install_as_MySQLdb()
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
 
+# JSON编码：安装了orjson时使用orjson，否则使用标准库
+from json_provider import json_provider_class
+app.json = json_provider_class()(app)
+
+# 会话令牌的签名密钥，多个worker、多台服务器必须使用同一个值；
+# 未配置时每个进程随机生成，重启后已签发的令牌失效
+app.config['SECRET_KEY'] = os.getenv('SECRET_KEY') or os.urandom(32).hex()
+
 # 从环境变量获取配置
 DB_HOST = os.getenv('DB_HOST', 'localhost')
 DB_PORT = os.getenv('DB_PORT', '3306')
 DB_USERNAME = os.getenv('DB_USERNAME', 'root')
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'password')
 DB_NAME = os.getenv('DB_NAME', 'musicdb')
+# 只读副本：逗号分隔的 host[:port]，账号默认与主库相同，库名相同
+DB_REPLICAS = os.getenv('DB_REPLICAS', '')
+DB_REPLICA_USERNAME = os.getenv('DB_REPLICA_USERNAME', DB_USERNAME)
+DB_REPLICA_PASSWORD = os.getenv('DB_REPLICA_PASSWORD', DB_PASSWORD)
+
+# 连接池配置：每个进程一个连接池，pool_size默认等于每个worker的线程数，
+# 所有进程的 (pool_size + max_overflow) 之和应小于MySQL的max_connections
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', os.getenv('WEB_THREADS', '4')))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '2'))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '10'))      # 等待空闲连接的最长秒数
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '3600'))    # 连接使用多久后重建，应小于MySQL的wait_timeout
 
 # 构建数据库连接字符串
 app.config['SQLALCHEMY_DATABASE_URI'] = f'mysql://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+from replicas import replica_binds
+app.config['SQLALCHEMY_BINDS'] = replica_binds(DB_REPLICAS, DB_REPLICA_USERNAME, DB_REPLICA_PASSWORD, DB_PORT, DB_NAME)
+from db_pool import InstrumentedQueuePool
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'poolclass': InstrumentedQueuePool,
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': DB_MAX_OVERFLOW,
+    'pool_timeout': DB_POOL_TIMEOUT,
+    'pool_recycle': DB_POOL_RECYCLE,
+    'pool_pre_ping': True,  # 借出前检查连接是否已被MySQL断开
+}
 
 # 导入并初始化数据库
 from models import db
+import counters  # 注册计数列的维护事件
+import rollups  # 注册统计汇总表的维护事件
+import cache  # 注册响应缓存的失效事件
+import versions  # 注册数据版本的维护事件
+import sync  # 注册变更日志的记录事件
+import metrics  # 注册SQL计时事件
 db.init_app(app)
 
+# 请求指标：每个请求的耗时、SQL语句数和耗时、读取行数、序列化耗时，慢请求记录日志
+metrics.init_app(app)
+
 # 导入路由
 from routes import api
 app.register_blueprint(api, url_prefix='/api')
 
-# 创建数据库表
-with app.app_context():
-    db.create_all()
+# 命令行工具
+@app.cli.command('init-db')
+def init_db_command():
+    """创建全部数据表并记录迁移版本（新库部署时执行一次，之后用 db-upgrade）"""
+    from migrations import upgrade
+    db.create_all(bind_key=None)  # 只在主库建表，副本通过复制同步
+    upgrade(log=lambda message: None)
+    print('数据库已初始化')
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index():
+    """全量重建搜索索引并写入快照文件，供各进程启动时加载"""
+    from search import search_index, SEARCH_INDEX_PATH
+    search_index.build()
+    search_index.save()
+    print(f'搜索索引已重建：{len(search_index.docs)} 个文档，{len(search_index.postings)} 个词项 -> {SEARCH_INDEX_PATH}')
+
+@app.cli.command('build-similar-songs')
+@click.option('--top-k', default=50, show_default=True, help='每首歌曲保留的相似歌曲数')
+@click.option('--chunk-size', default=100000, show_default=True, help='每批读取的收藏记录数')
+def build_similar_songs(top_k, chunk_size):
+    """根据收藏表离线计算相似歌曲表"""
+    from similar import build_neighbors, SIMILAR_SONGS_PATH
+    songs, pairs = build_neighbors(top_k=top_k, chunk_size=chunk_size)
+    print(f'相似歌曲表已生成：{songs} 首歌曲，{pairs} 条相似关系 -> {SIMILAR_SONGS_PATH}')
+
+@app.cli.command('reconcile-counters')
+@click.option('--dry-run', is_flag=True, help='只检查不修复')
+def reconcile_counters_command(dry_run):
+    """核对并修复收藏数、歌曲数、专辑数等计数列"""
+    report = counters.reconcile_counters(repair=not dry_run)
+    for column, drifted in report.items():
+        print(f'{column}: {drifted} 行不一致' + ('' if dry_run or not drifted else '，已修复'))
+
+@app.cli.command('backfill-rollups')
+def backfill_rollups_command():
+    """从业务表重新计算按小时/天的统计汇总数据"""
+    for metric, total in rollups.backfill_rollups().items():
+        print(f'{metric}: {total} 条记录已汇总')
+
+@app.cli.command('prune-change-log')
+def prune_change_log_command():
+    """删除超过保留期限的增量同步变更日志"""
+    deleted = sync.prune_change_log()
+    print(f'已删除 {deleted} 条变更日志（保留 {sync.SYNC_RETENTION_DAYS} 天）')
+
+@app.cli.command('rebalance-playlists')
+@click.option('--min-gap', default=None, type=int, help='相邻排序值间隔小于此值的播放列表重新编号，默认PLAYLIST_RANK_MIN_GAP')
+@click.option('--all', 'rebalance_all', is_flag=True, help='重新编号全部播放列表（旧数据迁移为稀疏排序值时使用）')
+def rebalance_playlists_command(min_gap, rebalance_all):
+    """把播放列表歌曲的排序值重新编号为等间隔，为之后的插入和移动留出空隙（可定时执行）"""
+    import playlist_order
+    from models import PlaylistSong
+    if rebalance_all:
+        playlist_ids = [playlist_id for playlist_id, in db.session.query(PlaylistSong.playlist_id).distinct()]
+    else:
+        playlist_ids = playlist_order.crowded_playlists(min_gap or playlist_order.RANK_MIN_GAP)
+    for playlist_id in playlist_ids:
+        count = playlist_order.rebalance(playlist_id)
+        db.session.commit()
+        print(f'播放列表 {playlist_id}：{count} 首歌曲已重新编号')
+    print(f'共重新编号 {len(playlist_ids)} 个播放列表')
+
+@app.cli.command('import-catalogue')
+@click.argument('kind', type=click.Choice(['singers', 'albums', 'genres', 'songs']))
+@click.argument('file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), help='文件格式，默认按扩展名判断')
+@click.option('--batch-size', default=1000, show_default=True, help='每个事务写入的记录数')
+def import_catalogue_command(kind, file, fmt, batch_size):
+    """从NDJSON/CSV文件批量导入歌手、专辑、流派或歌曲（已存在的记录会被更新）"""
+    from bulk_import import import_catalogue
+    fmt = fmt or ('csv' if file.name.endswith('.csv') else 'ndjson')
+
+    def progress(report):
+        print(f'已处理 {report["processed"]} 行：新增 {report["inserted"]}，更新 {report["updated"]}，'
+              f'失败 {report["failed"]}，{report["rows_per_second"]} 行/秒')
+
+    report = import_catalogue(kind, file, fmt, batch_size=batch_size, progress=progress)
+    for error in report['errors']:
+        print(f'第 {error["line"]} 行：{error["error"]}')
+    print(f'导入完成：共 {report["processed"]} 行，新增 {report["inserted"]}，更新 {report["updated"]}，'
+          f'失败 {report["failed"]}，耗时 {report["elapsed"]} 秒')
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """执行尚未执行的数据库迁移（MySQL下在线加列、加索引）"""
+    from migrations import upgrade
+    versions = upgrade()
+    print(f'已执行迁移：{versions}' if versions else '数据库已是最新版本')
+
+@app.cli.command('explain-check')
+def explain_check_command():
+    """对各接口执行的查询做EXPLAIN，发现全表扫描时以非零状态退出"""
+    from explain_check import run_explain_check
+    violations = run_explain_check(app)
+    for url, table, statement in violations:
+        print(f'{url}: 全表扫描 {table}\n    {" ".join(statement.split())}')
+    if violations:
+        raise SystemExit(1)
+    print('未发现全表扫描')
+
+@app.cli.command('query-count-check')
+def query_count_check_command():
+    """检查列表接口的SQL语句数不随返回行数增加，发现N+1查询时以非零状态退出"""
+    from query_count_check import run_query_count_check
+    failed, skipped = 0, 0
+    for url, (small_count, small_rows), (large_count, large_rows) in run_query_count_check(app):
+        if large_rows <= small_rows:
+            skipped += 1
+            status = '数据不足，未比较'
+        elif large_count > small_count:
+            failed += 1
+            status = 'SQL语句数随行数增加'
+        else:
+            status = 'OK'
+        print(f'{url}: {small_rows}行 {small_count}条SQL / {large_rows}行 {large_count}条SQL  {status}')
+    if failed:
+        raise SystemExit(1)
+    print(f'列表接口的SQL语句数与行数无关（{skipped}个接口数据不足未比较）')
+
+@app.cli.command('payload-report')
+@click.option('--limit', default=200, show_default=True, help='每个列表接口请求的行数')
+@click.option('--repeat', default=5, show_default=True, help='每个接口请求的次数')
+def payload_report_command(limit, repeat):
+    """对比列表接口默认字段与包含歌词、简介等大字段时的响应大小和耗时"""
+    from payload_report import run_payload_report
+    for url, size, elapsed, full_size, full_elapsed in run_payload_report(app, limit, repeat):
+        saved = 1 - size / full_size if full_size else 0
+        print(f'{url}: {size} 字节 / {elapsed:.1f} 毫秒，包含大字段时 {full_size} 字节 / {full_elapsed:.1f} 毫秒，'
+              f'减少 {saved:.0%}')
+
+@app.cli.command('login-benchmark')
+@click.option('--seconds', default=5.0, show_default=True, help='每项测试的持续时间')
+@click.option('--threads', default=None, type=int, help='并发请求线程数，默认AUTH_WORKERS的2倍')
+def login_benchmark_command(seconds, threads):
+    """测量登录（scrypt校验）和令牌校验的吞吐量，使用临时创建的测试用户"""
+    from login_benchmark import run_login_benchmark
+    for name, result in run_login_benchmark(app, seconds=seconds, threads=threads).items():
+        print(f'{name}: {result["requests"]} 次 / {result["seconds"]:.1f} 秒，{result["per_second"]:.1f} 次/秒，'
+              f'每核 {result["per_core"]:.1f} 次/秒，平均 {result["avg_ms"]:.1f} 毫秒，'
+              f'限流 {result["throttled"]} 次，失败 {result["failed"]} 次')
+
+@app.cli.command('compress-lyrics')
+@click.option('--batch-size', default=1000, show_default=True, help='每个事务改写的歌曲数')
+def compress_lyrics_command(batch_size):
+    """按LYRICS_COMPRESSION设置改写已有歌词：开启时压缩，关闭时还原为原文"""
+    from sqlalchemy import bindparam, select, type_coerce
+    from models import Song
+    table = Song.__table__
+    lyrics_type = table.c.lyrics.type
+    last_id, rewritten = 0, 0
+    while True:
+        rows = db.session.execute(
+            select(table.c.id, table.c.lyrics, type_coerce(table.c.lyrics, db.Text).label('stored'))
+            .where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        changed = [{'b_id': row.id, 'v_lyrics': row.lyrics} for row in rows
+                   if lyrics_type.process_bind_param(row.lyrics, None) != row.stored]
+        if changed:
+            db.session.execute(table.update().where(table.c.id == bindparam('b_id'))
+                               .values(lyrics=bindparam('v_lyrics', type_=lyrics_type),
+                                       updated_at=table.c.updated_at), changed)
+        db.session.commit()
+        rewritten += len(changed)
+    print(f'已改写 {rewritten} 首歌曲的歌词（压缩{"开启" if lyrics_type.enabled else "关闭"}）')
 
 # 根路由
 @app.route('/')
@@ -48,9 +253,18 @@ def index():
             'singers': '/api/singers',
             'albums': '/api/albums',
             'songs': '/api/songs',
-            'favorites': '/api/favorites'
+            'favorites': '/api/favorites',
+            'search': '/api/search'
         }
     })
 
+# Prometheus指标，按进程统计
+@app.route('/metrics')
+def metrics_endpoint():
+    return app.response_class(metrics.render(db.engines), content_type=metrics.CONTENT_TYPE)
+
 if __name__ == '__main__':
+    # 开发服务器；生产环境使用 gunicorn -c gunicorn.conf.py
+    with app.app_context():
+        db.create_all(bind_key=None)
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from flask import current_app, g, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+# 密码哈希配置：scrypt（标准库，内存密集型），每次计算约占用 128 × N × r 字节内存
+SCRYPT_N = int(os.getenv('PASSWORD_SCRYPT_N', str(2 ** 14)))
+SCRYPT_R = int(os.getenv('PASSWORD_SCRYPT_R', '8'))
+SCRYPT_P = int(os.getenv('PASSWORD_SCRYPT_P', '1'))
+SALT_BYTES = 16
+HASH_PREFIX = 'scrypt'
+
+# 哈希计算线程池：同时计算的数量不超过CPU核数，排队超过AUTH_MAX_PENDING个时直接拒绝
+AUTH_WORKERS = int(os.getenv('AUTH_WORKERS', str(os.cpu_count() or 1)))
+AUTH_MAX_PENDING = int(os.getenv('AUTH_MAX_PENDING', str(AUTH_WORKERS * 8)))
+AUTH_WAIT_SECONDS = float(os.getenv('AUTH_WAIT_SECONDS', '5'))
+
+# 会话令牌配置
+TOKEN_MAX_AGE = int(os.getenv('AUTH_TOKEN_MAX_AGE', str(7 * 24 * 3600)))  # 秒
+TOKEN_SALT = 'auth-token'
+
+class AuthBusy(Exception):
+    """哈希计算排队已满或等待超时"""
+
+def _b64(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r + 1024 * 1024, dklen=32)
+
+def _hash(password):
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f'{HASH_PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}'
+
+def _verify(stored, password):
+    """返回(密码是否正确, 是否需要按当前参数重新哈希)
+
+    旧数据是不加盐的MD5十六进制串，校验通过后需要重新哈希。用户不存在（stored为空）时
+    同样计算一次哈希，响应时间不会暴露用户名是否存在。
+    """
+    if not stored:
+        _scrypt(password, bytes(SALT_BYTES), SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return False, False
+    if not stored.startswith(HASH_PREFIX + '$'):
+        legacy = hashlib.md5(password.encode()).hexdigest()
+        return hmac.compare_digest(stored, legacy), True
+    try:
+        _, n, r, p, salt, digest = stored.split('$')
+        n, r, p = int(n), int(r), int(p)
+        salt, digest = _unb64(salt), _unb64(digest)
+    except ValueError:
+        return False, False
+    ok = hmac.compare_digest(_scrypt(password, salt, n, r, p), digest)
+    return ok, ok and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+class KdfPool:
+    """在有界线程池中计算密码哈希
+
+    hashlib.scrypt计算期间释放GIL，放到线程池中可以利用多核；线程数等于核数，
+    避免登录高峰时每个请求线程都在计算哈希、占满CPU和内存，拖慢其他接口。
+    等待中的任务超过max_pending时立即抛出AuthBusy，接口返回503而不是长时间排队。
+    """
+
+    def __init__(self, workers=AUTH_WORKERS, max_pending=AUTH_MAX_PENDING):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='kdf')
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise AuthBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=AUTH_WAIT_SECONDS)
+        except FutureTimeout:
+            future.cancel()
+            raise AuthBusy()
+
+kdf_pool = KdfPool()
+
+def hash_password(password):
+    """用scrypt加盐哈希密码，返回 scrypt$N$r$p$盐$哈希 格式的字符串"""
+    return kdf_pool.run(_hash, password)
+
+def verify_password(stored, password):
+    """校验密码，返回(是否正确, 是否需要重新哈希)"""
+    return kdf_pool.run(_verify, stored, password)
+
+# ---------- 会话令牌 ----------
+def _serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt=TOKEN_SALT)
+
+def issue_token(user):
+    """签发会话令牌，令牌中带有用户id、用户名和角色，校验时不需要查询数据库"""
+    return _serializer().dumps({'id': user.id, 'username': user.username, 'role': user.role or 'user'})
+
+def read_token(token):
+    """校验令牌签名和有效期，返回令牌中的用户信息，无效时返回None"""
+    try:
+        return _serializer().loads(token, max_age=TOKEN_MAX_AGE)
+    except BadSignature:
+        return None
+
+def current_identity():
+    """请求头 Authorization: Bearer <令牌> 对应的用户信息，没有或无效时返回None"""
+    if 'identity' not in g:
+        header = request.headers.get('Authorization', '')
+        scheme, _, token = header.partition(' ')
+        g.identity = read_token(token.strip()) if scheme.lower() == 'bearer' and token else None
+    return g.identity
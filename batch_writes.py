@@ -0,0 +1,166 @@
+import os
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from sqlalchemy import and_, select
+from sqlalchemy.exc import IntegrityError
+from models import db, User, Song, Favorite, Playlist, PlaylistSong
+import counters
+from cache import defer_invalidation
+import playlist_order
+import rollups
+import sync
+import versions
+
+# 批量收藏、批量添加播放列表歌曲的配置
+MAX_BATCH_ITEMS = int(os.getenv('MAX_BATCH_ITEMS', '5000'))  # 每个请求最多包含的歌曲数
+
+class InvalidBatch(ValueError):
+    """请求中的歌曲id列表格式不正确"""
+
+def parse_song_ids(value):
+    """校验请求中的song_ids，返回去重后保持原顺序的id列表和格式错误的条目"""
+    if not isinstance(value, list) or not value:
+        raise InvalidBatch('song_ids应为非空列表')
+    if len(value) > MAX_BATCH_ITEMS:
+        raise InvalidBatch(f'每次最多提交{MAX_BATCH_ITEMS}首歌曲')
+    song_ids, invalid = [], []
+    for item in value:
+        if isinstance(item, bool) or not isinstance(item, int):
+            invalid.append(item)
+        elif item not in song_ids:
+            song_ids.append(item)
+    return song_ids, invalid
+
+class ConcurrentBatch(Exception):
+    """写入时唯一键冲突：有不经过批量接口的并发写入抢先添加了同一首歌曲"""
+
+def _lock_parent(model, parent_id):
+    """锁住用户/播放列表记录（SELECT ... FOR UPDATE），同一用户、同一播放列表的批量写入依次执行"""
+    db.session.execute(select(model.id).where(model.id == parent_id).with_for_update())
+
+def _classify(song_ids, member_column, condition):
+    """一次查询得到song_ids中不存在的歌曲和已关联的歌曲，member_column为关联表中的id列
+
+    使用加锁读（LOCK IN SHARE MODE）：读到的是已提交的最新数据而不是事务开始时的快照，
+    并锁住未关联歌曲在唯一索引上的间隙，提交前其他事务不能插入同一首歌曲。
+    """
+    if not song_ids:
+        return [], {}
+    rows = db.session.execute(
+        select(Song.id, member_column)
+        .outerjoin(member_column.table, and_(member_column.table.c.song_id == Song.id, condition))
+        .where(Song.id.in_(song_ids))
+        .with_for_update(read=True)
+    ).all()
+    found = {song_id for song_id, _ in rows}
+    linked = {song_id: member_id for song_id, member_id in rows if member_id is not None}
+    return [song_id for song_id in song_ids if song_id not in found], linked
+
+def _finish(connection, table, counter_deltas, rollup_deltas, tags=()):
+    """与批量导入相同：绕过ORM的写入在同一事务中更新计数列、汇总和变更日志，表版本号在提交前递增；
+    响应缓存失效的标签与ORM写入相同（表、计数列所在的父记录），提交后失效"""
+    counters.apply_deltas(connection, counter_deltas)
+    rollups.apply_deltas(connection, rollup_deltas)
+    versions.defer_bump(db.session, {table.name} | {parent.__tablename__ for parent, _, _ in counter_deltas})
+    changed_parents = defaultdict(set)
+    for parent, _, parent_id in counter_deltas:
+        changed_parents[parent.__tablename__].add(parent_id)
+    for parent_name, parent_ids in changed_parents.items():
+        sync.record(connection, parent_name, parent_ids)
+    defer_invalidation(db.session, {f'table:{table.name}', *tags} | {
+        f'counts:{parent.__tablename__}:{parent_id}' for parent, _, parent_id in counter_deltas
+    })
+
+def _results(song_ids, invalid, missing, existing, added, extra=None):
+    """生成每首歌曲的处理结果，格式错误的条目在前，其余按请求顺序"""
+    results = [{'song_id': item, 'status': 'invalid'} for item in invalid]
+    missing = set(missing)
+    for song_id in song_ids:
+        if song_id in missing:
+            results.append({'song_id': song_id, 'status': 'not_found'})
+        elif song_id in added:
+            results.append(dict({'song_id': song_id, 'status': 'added', 'id': added[song_id]},
+                                **(extra(song_id) if extra else {})))
+        else:
+            results.append({'song_id': song_id, 'status': 'exists', 'id': existing.get(song_id)})
+    return results
+
+def _insert(connection, table, rows):
+    """多行INSERT；_classify的加锁读保证这些行不会已经存在，仍然冲突时抛出ConcurrentBatch"""
+    try:
+        connection.execute(table.insert(), rows)
+    except IntegrityError as e:
+        raise ConcurrentBatch() from e
+
+def add_favorites(user_id, song_ids, invalid=()):
+    """为用户批量收藏歌曲，在一个事务中完成，返回(每首歌曲的结果, 新收藏的歌曲id列表, 收藏时间)
+
+    先锁住用户记录，同一用户的批量收藏依次执行；一次加锁查询校验歌曲是否存在、是否已收藏，
+    新收藏用一条多行INSERT写入，写入的每一行都是本次请求新增的，计数列据此增加。
+    """
+    table = Favorite.__table__
+    _lock_parent(User, user_id)
+    missing, existing = _classify(song_ids, Favorite.id, Favorite.user_id == user_id)
+    wanted = [song_id for song_id in song_ids if song_id not in existing and song_id not in missing]
+    # DATETIME列不保存微秒，与数据库中保存的值一致
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    added = {}
+    if wanted:
+        connection = db.session.connection()
+        _insert(connection, table, [
+            {'user_id': user_id, 'song_id': song_id, 'created_at': now} for song_id in wanted
+        ])
+        added = dict(connection.execute(
+            select(table.c.song_id, table.c.id)
+            .where(table.c.user_id == user_id, table.c.song_id.in_(wanted))
+        ).all())
+
+        counter_deltas = defaultdict(int)
+        rollup_deltas = Counter()
+        for song_id in added:
+            counter_deltas[Song, 'favorite_count', song_id] += 1
+        if added:
+            counter_deltas[User, 'favorites_count', user_id] += len(added)
+            rollups.add_delta(rollup_deltas, 'favorites', now, len(added))
+        _finish(connection, table, counter_deltas, rollup_deltas)
+    db.session.commit()
+    new_ids = [song_id for song_id in song_ids if song_id in added]
+    return _results(song_ids, invalid, missing, existing, added), new_ids, now
+
+def add_playlist_songs(playlist_id, song_ids, invalid=()):
+    """批量添加歌曲到播放列表末尾，在一个事务中完成，返回每首歌曲的结果
+
+    先锁住播放列表记录，同一播放列表的批量添加依次执行，不会取到相同的排序值；
+    一次加锁查询校验歌曲是否存在、是否已在播放列表中，新歌曲按请求顺序在当前最大
+    排序值之后依次取得间隔为RANK_GAP的排序值，用一条多行INSERT写入。
+    """
+    table = PlaylistSong.__table__
+    _lock_parent(Playlist, playlist_id)
+    missing, existing = _classify(song_ids, PlaylistSong.id, PlaylistSong.playlist_id == playlist_id)
+    wanted = [song_id for song_id in song_ids if song_id not in existing and song_id not in missing]
+    orders = {}
+    added = {}
+    if wanted:
+        connection = db.session.connection()
+        max_order = connection.execute(
+            select(db.func.max(table.c.order)).where(table.c.playlist_id == playlist_id)
+            .with_for_update(read=True)
+        ).scalar() or 0
+        orders = {song_id: max_order + i * playlist_order.RANK_GAP for i, song_id in enumerate(wanted, 1)}
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        _insert(connection, table, [
+            {'playlist_id': playlist_id, 'song_id': song_id, 'order': orders[song_id], 'added_at': now}
+            for song_id in wanted
+        ])
+        added = dict(connection.execute(
+            select(table.c.song_id, table.c.id)
+            .where(table.c.playlist_id == playlist_id, table.c.song_id.in_(wanted))
+        ).all())
+
+        counter_deltas = defaultdict(int)
+        if added:
+            counter_deltas[Playlist, 'songs_count', playlist_id] += len(added)
+        _finish(connection, table, counter_deltas, Counter(), tags={f'playlists:{playlist_id}'})
+    db.session.commit()
+    return _results(song_ids, invalid, missing, existing, added,
+                    extra=lambda song_id: {'order': orders[song_id]})
@@ -0,0 +1,410 @@
+import csv
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from sqlalchemy import bindparam, select, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, Singer, Album, Song, Genre, SongGenre
+import counters
+import rollups
+import sync
+import versions
+
+# 批量导入配置
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))  # 每个事务写入的记录数
+MAX_REPORTED_ERRORS = 100  # 报告中最多列出的错误数，超出部分只计数
+LIST_SEPARATOR = '|'  # CSV中多值字段（genres、genre_ids）的分隔符
+
+# 各类型的模型、唯一键、可导入字段及新建时的默认值（与单条创建接口一致）
+KINDS = {
+    'singers': {
+        'model': Singer,
+        'key': ('name',),
+        'defaults': {'avatar': '', 'description': '', 'birth_date': None, 'nationality': ''},
+    },
+    'genres': {
+        'model': Genre,
+        'key': ('name',),
+        'defaults': {'description': ''},
+    },
+    'albums': {
+        'model': Album,
+        'key': ('singer_id', 'name'),
+        'defaults': {'cover': '', 'description': '', 'release_date': None},
+    },
+    'songs': {
+        'model': Song,
+        'key': ('singer_id', 'name'),
+        'defaults': {'album_id': None, 'duration': None, 'lyrics': '', 'release_date': None},
+    },
+}
+
+# 导入某类数据前需要加载的查找表
+REQUIRED_LOOKUPS = {
+    'singers': ('singers',),
+    'genres': ('genres',),
+    'albums': ('singers', 'albums'),
+    'songs': ('singers', 'albums', 'genres', 'songs'),
+}
+
+_METRIC_OF = {model: metric for metric, model in rollups.METRICS.items()}
+
+def read_records(stream, fmt):
+    """逐行读取NDJSON或CSV文本流，产出(行号, 记录, 错误信息)"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record, None
+        return
+    for line_no, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_no, None, 'JSON格式错误'
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, '每行应为一个JSON对象'
+            continue
+        yield line_no, record, None
+
+def _value(record, field):
+    """取字段值，空字符串视为未提供"""
+    value = record.get(field)
+    if isinstance(value, str):
+        value = value.strip()
+        if not value:
+            return None
+    return value
+
+def _text(record, field, model, required=False):
+    value = _value(record, field)
+    if value is None:
+        if required:
+            raise ValueError(f'{field}是必需的')
+        return None
+    value = str(value)
+    length = model.__table__.c[field].type.length
+    if length and len(value) > length:
+        raise ValueError(f'{field}长度不能超过{length}')
+    return value
+
+def _date(record, field):
+    value = _value(record, field)
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(str(value), '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'{field}日期格式应为YYYY-MM-DD')
+
+def _int(record, field):
+    value = _value(record, field)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field}应为整数')
+
+def _list(record, field):
+    value = _value(record, field)
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(LIST_SEPARATOR) if item.strip()]
+    if isinstance(value, list):
+        return value
+    raise ValueError(f'{field}应为列表')
+
+class CatalogueImporter:
+    """歌手、专辑、流派、歌曲的批量导入
+
+    导入开始时把已有数据的唯一键加载为内存查找表（歌手、流派按名称，专辑、
+    歌曲按(歌手id, 名称)），逐批校验记录、解析引用，再用多行INSERT和批量UPDATE
+    在一个事务中写入。唯一键已存在的记录按提供的字段更新，因此同一份数据重复
+    导入结果不变。Core写入不经过ORM事件，计数列和统计汇总在同一事务中直接更新。
+    """
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress  # 每批写入后以当前报告调用
+        self.lookups = {}  # 类型 -> {唯一键: id}
+        self.ids = {}      # 类型 -> 已存在的id集合
+
+    def _load(self, kind):
+        if kind in self.lookups:
+            return
+        spec = KINDS[kind]
+        model = spec['model']
+        columns = [model.__table__.c[name] for name in spec['key']]
+        lookup = {}
+        # 按id倒序读取，名称重复时保留id最小的记录
+        rows = db.session.execute(
+            select(model.id, *columns).order_by(model.id.desc()).execution_options(yield_per=10000)
+        )
+        for row in rows:
+            lookup[tuple(row[1:])] = row[0]
+        self.lookups[kind] = lookup
+        self.ids[kind] = set(lookup.values())
+
+    # ---------- 校验与引用解析 ----------
+    def _singer_ref(self, record):
+        singer_id = _int(record, 'singer_id')
+        if singer_id is not None:
+            if singer_id not in self.ids['singers']:
+                raise ValueError(f'歌手不存在: {singer_id}')
+            return singer_id
+        name = _value(record, 'singer')
+        if name is None:
+            raise ValueError('singer_id或singer是必需的')
+        singer_id = self.lookups['singers'].get((str(name),))
+        if singer_id is None:
+            raise ValueError(f'歌手不存在: {name}')
+        return singer_id
+
+    def _album_ref(self, record, singer_id):
+        album_id = _int(record, 'album_id')
+        if album_id is not None:
+            if album_id not in self.ids['albums']:
+                raise ValueError(f'专辑不存在: {album_id}')
+            return album_id
+        name = _value(record, 'album')
+        if name is None:
+            return None
+        album_id = self.lookups['albums'].get((singer_id, str(name)))
+        if album_id is None:
+            raise ValueError(f'该歌手下不存在专辑: {name}')
+        return album_id
+
+    def _genre_refs(self, record):
+        genre_ids = _list(record, 'genre_ids')
+        if genre_ids is not None:
+            try:
+                genre_ids = [int(genre_id) for genre_id in genre_ids]
+            except (TypeError, ValueError):
+                raise ValueError('genre_ids应为整数列表')
+            missing = [genre_id for genre_id in genre_ids if genre_id not in self.ids['genres']]
+            if missing:
+                raise ValueError(f'流派不存在: {missing}')
+            return genre_ids
+        names = _list(record, 'genres')
+        if names is None:
+            return None
+        genre_ids = []
+        for name in names:
+            genre_id = self.lookups['genres'].get((str(name),))
+            if genre_id is None:
+                raise ValueError(f'流派不存在: {name}')
+            genre_ids.append(genre_id)
+        return genre_ids
+
+    def _parse(self, kind, record):
+        """校验一条记录，返回(写入的字段, 歌曲的流派id列表)，字段中只包含记录提供的值"""
+        model = KINDS[kind]['model']
+        values = {'name': _text(record, 'name', model, required=True)}
+        genre_ids = None
+        if kind == 'singers':
+            values.update(
+                avatar=_text(record, 'avatar', model),
+                description=_value(record, 'description'),
+                birth_date=_date(record, 'birth_date'),
+                nationality=_text(record, 'nationality', model)
+            )
+        elif kind == 'genres':
+            values['description'] = _value(record, 'description')
+        elif kind == 'albums':
+            values.update(
+                singer_id=self._singer_ref(record),
+                cover=_text(record, 'cover', model),
+                description=_value(record, 'description'),
+                release_date=_date(record, 'release_date')
+            )
+        else:
+            singer_id = self._singer_ref(record)
+            values.update(
+                singer_id=singer_id,
+                album_id=self._album_ref(record, singer_id),
+                duration=_int(record, 'duration'),
+                lyrics=_value(record, 'lyrics'),
+                release_date=_date(record, 'release_date')
+            )
+            genre_ids = self._genre_refs(record)
+        key_fields = KINDS[kind]['key']
+        return {k: v for k, v in values.items() if v is not None or k in key_fields}, genre_ids
+
+    # ---------- 写入 ----------
+    def _write(self, kind, batch):
+        """在一个事务中写入一批已校验的记录，返回(新增数, 更新数, 本批新增的{唯一键: id})"""
+        spec = KINDS[kind]
+        model = spec['model']
+        table = model.__table__
+        lookup = self.lookups[kind]
+
+        # 同一批中唯一键相同的记录合并，后出现的字段覆盖先出现的
+        merged = {}
+        song_genres = {}
+        for values, genre_ids in batch:
+            key = tuple(values[name] for name in spec['key'])
+            merged.setdefault(key, {}).update(values)
+            if genre_ids is not None:
+                song_genres[key] = genre_ids
+
+        now = datetime.now(timezone.utc)
+        counter_deltas = defaultdict(int)
+        rollup_deltas = Counter()
+        child_counters = [(fk, parent, column) for child, fk, parent, column in counters.COUNTERS if child is model]
+        timestamps = {'created_at': now}
+        if 'updated_at' in table.c:
+            timestamps['updated_at'] = now
+
+        # 新记录：executemany方式INSERT，PyMySQL会把它改写为多行INSERT，
+        # 语句编译结果也可以缓存；之后按唯一键取回生成的id
+        inserts = [dict(spec['defaults'], **values, **timestamps)
+                   for key, values in merged.items() if key not in lookup]
+        created = {}
+        if inserts:
+            db.session.execute(table.insert(), inserts)
+            key_columns = [table.c[name] for name in spec['key']]
+            keys = [key for key in merged if key not in lookup]
+            condition = key_columns[0].in_([key[0] for key in keys]) if len(keys[0]) == 1 \
+                else tuple_(*key_columns).in_(keys)
+            for row in db.session.execute(select(table.c.id, *key_columns).where(condition)):
+                created.setdefault(tuple(row[1:]), row[0])
+            for values in inserts:
+                for fk, parent, column in child_counters:
+                    if values.get(fk) is not None:
+                        counter_deltas[parent, column, values[fk]] += 1
+            if model in _METRIC_OF:
+                rollups.add_delta(rollup_deltas, _METRIC_OF[model], now, len(inserts))
+
+        # 已存在的记录：按提供的字段组合分组，每组一条executemany的UPDATE
+        updates = [(lookup[key], values) for key, values in merged.items() if key in lookup]
+        if updates:
+            changed_fks = [item for item in child_counters if any(item[0] in values for _, values in updates)]
+            if changed_fks:
+                fk_columns = [table.c[fk] for fk, _, _ in changed_fks]
+                old_rows = db.session.execute(
+                    select(table.c.id, *fk_columns).where(table.c.id.in_([row_id for row_id, _ in updates]))
+                ).all()
+                old = {row[0]: row[1:] for row in old_rows}
+                for row_id, values in updates:
+                    for i, (fk, parent, column) in enumerate(changed_fks):
+                        if fk in values and values[fk] != old[row_id][i]:
+                            if old[row_id][i] is not None:
+                                counter_deltas[parent, column, old[row_id][i]] -= 1
+                            if values[fk] is not None:
+                                counter_deltas[parent, column, values[fk]] += 1
+
+            groups = defaultdict(list)
+            for row_id, values in updates:
+                fields = tuple(sorted(name for name in values if name not in spec['key']))
+                groups[fields].append(dict({f'v_{name}': values[name] for name in fields}, b_id=row_id))
+            for fields, params in groups.items():
+                assignments = {name: bindparam(f'v_{name}', type_=table.c[name].type) for name in fields}
+                if 'updated_at' in table.c:
+                    assignments['updated_at'] = now
+                if assignments:
+                    db.session.execute(
+                        table.update().where(table.c.id == bindparam('b_id')).values(assignments), params)
+
+        if song_genres:
+            song_ids = {key: created[key] if key in created else lookup[key] for key in song_genres}
+            self._write_song_genres(song_genres, song_ids, counter_deltas, now)
+
+        connection = db.session.connection()
+        counters.apply_deltas(connection, counter_deltas)
+        rollups.apply_deltas(connection, rollup_deltas)
+        versions.defer_bump(db.session, {table.name} | {parent.__tablename__ for parent, _, _ in counter_deltas}
+                            | ({SongGenre.__tablename__} if song_genres else set()))
+        sync.record(connection, table.name, set(created.values()) | {row_id for row_id, _ in updates})
+        changed_parents = defaultdict(set)
+        for parent, _, parent_id in counter_deltas:
+            changed_parents[parent.__tablename__].add(parent_id)
+        for parent_name, parent_ids in changed_parents.items():
+            sync.record(connection, parent_name, parent_ids)
+        return len(inserts), len(updates), created
+
+    def _write_song_genres(self, song_genres, song_ids, counter_deltas, now):
+        """把歌曲的流派关联替换为导入数据中给出的流派"""
+        wanted = {song_ids[key]: set(genre_ids) for key, genre_ids in song_genres.items()}
+        existing = defaultdict(set)
+        for song_id, genre_id in db.session.execute(
+                select(SongGenre.song_id, SongGenre.genre_id).where(SongGenre.song_id.in_(list(wanted)))):
+            existing[song_id].add(genre_id)
+
+        removed = [(song_id, genre_id) for song_id, genre_ids in wanted.items()
+                   for genre_id in existing[song_id] - genre_ids]
+        added = [{'song_id': song_id, 'genre_id': genre_id, 'created_at': now}
+                 for song_id, genre_ids in wanted.items() for genre_id in sorted(genre_ids - existing[song_id])]
+        table = SongGenre.__table__
+        if removed:
+            db.session.execute(table.delete().where(tuple_(table.c.song_id, table.c.genre_id).in_(removed)))
+            for _, genre_id in removed:
+                counter_deltas[Genre, 'songs_count', genre_id] -= 1
+        if added:
+            db.session.execute(table.insert(), added)
+            for row in added:
+                counter_deltas[Genre, 'songs_count', row['genre_id']] += 1
+
+    # ---------- 入口 ----------
+    def run(self, kind, records):
+        """导入一个(行号, 记录, 错误信息)序列，返回导入报告"""
+        for required in REQUIRED_LOOKUPS[kind]:
+            self._load(required)
+        report = {'kind': kind, 'processed': 0, 'inserted': 0, 'updated': 0, 'failed': 0, 'errors': []}
+        started = time.time()
+
+        def fail(line, message):
+            report['failed'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'line': line, 'error': message})
+
+        def flush(batch, lines):
+            if not batch:
+                return
+            try:
+                inserted, updated, created = self._write(kind, batch)
+                db.session.commit()
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                for line in lines:
+                    fail(line, f'写入失败: {e.orig if getattr(e, "orig", None) else e}')
+                return
+            report['inserted'] += inserted
+            report['updated'] += updated
+            self.lookups[kind].update(created)
+            self.ids[kind].update(created.values())
+            if self.progress:
+                self.progress(self._summary(report, started))
+
+        batch, lines = [], []
+        for line, record, error in records:
+            report['processed'] += 1
+            if error:
+                fail(line, error)
+                continue
+            try:
+                batch.append(self._parse(kind, record))
+                lines.append(line)
+            except ValueError as e:
+                fail(line, str(e))
+                continue
+            if len(batch) >= self.batch_size:
+                flush(batch, lines)
+                batch, lines = [], []
+        flush(batch, lines)
+        return self._summary(report, started)
+
+    @staticmethod
+    def _summary(report, started):
+        elapsed = time.time() - started
+        return dict(report, elapsed=round(elapsed, 3),
+                    rows_per_second=round(report['processed'] / elapsed) if elapsed > 0 else None)
+
+def import_catalogue(kind, stream, fmt='ndjson', batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """从NDJSON/CSV文本流导入一种类型的数据，返回导入报告"""
+    return CatalogueImporter(batch_size, progress).run(kind, read_records(stream, fmt))
@@ -0,0 +1,255 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, g, jsonify
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from replicas import may_be_stale
+
+# 响应缓存配置
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')          # memory / redis / none
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+CACHE_TTL = int(os.getenv('CACHE_TTL', '300'))                 # 秒
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '10000'))
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+class MemoryBackend:
+    """进程内缓存：按最近使用顺序淘汰（LRU），同时限制条数和总字节数，条目到期后失效
+
+    多进程部署时各进程的缓存互不可见、标签失效也只作用于本进程；
+    缓存键中包含共享版本表生成的校验值，其他进程写入后版本号变化，旧条目不再命中，
+    之后按LRU或TTL淘汰。需要跨进程共享缓存内容时使用RedisBackend。
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # 键 -> (过期时间, 响应体, 标签)
+        self._tags = {}                # 标签 -> 键集合
+        self.bytes = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._delete(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, body, tags, ttl):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            self._delete(key)
+            self._entries[key] = (time.time() + ttl, body, tags)
+            self.bytes += len(body)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._delete(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= len(entry[1])
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self.bytes = 0
+
+    def info(self):
+        return {'entries': len(self._entries), 'bytes': self.bytes, 'evictions': self.evictions}
+
+class RedisBackend:
+    """Redis（或兼容Redis协议的服务）缓存，多进程共享，淘汰策略由服务端maxmemory-policy决定
+
+    标签 -> 键 的对应关系保存在集合 tag:<标签> 中。
+    """
+
+    def __init__(self, url=CACHE_REDIS_URL, prefix='musicdb:cache:'):
+        import redis  # 可选依赖，只有启用Redis缓存时才需要安装
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, body, tags, ttl):
+        pipe = self.client.pipeline()
+        pipe.set(self.prefix + key, body, ex=ttl)
+        for tag in tags:
+            pipe.sadd(f'{self.prefix}tag:{tag}', key)
+            pipe.expire(f'{self.prefix}tag:{tag}', ttl)
+        pipe.execute()
+
+    def invalidate(self, tags):
+        tag_keys = [f'{self.prefix}tag:{tag}' for tag in tags]
+        pipe = self.client.pipeline()
+        for tag_key in tag_keys:
+            pipe.smembers(tag_key)
+        keys = {self.prefix + key.decode() for members in pipe.execute() for key in members}
+        if keys or tag_keys:
+            self.client.delete(*keys, *tag_keys)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def info(self):
+        return {'entries': sum(1 for _ in self.client.scan_iter(match=self.prefix + '*'))}
+
+def _make_backend():
+    if CACHE_BACKEND == 'redis':
+        return RedisBackend()
+    if CACHE_BACKEND == 'none':
+        return None
+    return MemoryBackend()
+
+class ResponseCache:
+    """读穿式JSON响应缓存
+
+    缓存的是序列化后的响应体，命中时直接返回，不查询数据库也不调用to_dict()。
+    每个条目带有一组标签，数据变化时按标签精确失效：
+      <表名>:<id>         该记录本身，被修改或删除时失效
+      counts:<表名>:<id>  该记录的计数列，子记录增删（如收藏歌曲、新增歌曲）时失效
+      table:<表名>        该表任意记录变化时失效，用于列表和统计接口
+    标签由Session事件根据本次事务实际写入的对象生成，事务提交后才失效，回滚则丢弃。
+    接口带有versions.conditional时，缓存键还加入其校验值（g.cache_validator），
+    保证返回的响应体与同时下发的ETag一致。
+    """
+
+    def __init__(self):
+        self._backend = None
+        self._configured = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self):
+        if not self._configured:
+            self._backend = _make_backend()
+            self._configured = True
+        return self._backend
+
+    def response(self, key, build, ttl=CACHE_TTL):
+        """返回key对应的缓存响应；未命中时调用build()得到(数据, 标签)，生成响应并写入缓存"""
+        backend = self.backend
+        validator = g.get('cache_validator')
+        if validator:
+            key = f'{key}@{validator}'
+        if backend is not None:
+            body = backend.get(key)
+            if body is not None:
+                with self._lock:
+                    self.hits += 1
+                return current_app.response_class(body, mimetype=current_app.json.mimetype)
+        with self._lock:
+            self.misses += 1
+        data, tags = build()
+        response = jsonify(data)
+        # 刚有写入时从副本读到的数据可能是旧的，不写入缓存，以免在TTL内一直返回旧数据
+        if backend is not None and not may_be_stale():
+            backend.set(key, response.get_data(), set(tags), ttl)
+        return response
+
+    def invalidate(self, tags):
+        if self.backend is not None and tags:
+            self.backend.invalidate(tags)
+
+    def clear(self):
+        """绕过ORM的批量写入后清空全部缓存"""
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        result = {
+            'backend': CACHE_BACKEND,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else None
+        }
+        if self.backend is not None:
+            result.update(self.backend.info())
+        return result
+
+# 进程内的全局响应缓存
+response_cache = ResponseCache()
+
+def entity_tags(obj):
+    """缓存obj.to_dict()结果时使用的标签：记录本身、计数列及其中嵌入名称的关联记录"""
+    table = obj.__table__
+    tags = {f'{table.name}:{obj.id}', f'counts:{table.name}:{obj.id}'}
+    for column in table.columns:
+        for fk in column.foreign_keys:
+            value = getattr(obj, column.key)
+            if value is not None:
+                tags.add(f'{fk.column.table.name}:{value}')
+    return tags
+
+def _changed_tags(obj, state):
+    """写入obj时需要失效的标签，state为new/dirty/deleted"""
+    table = obj.__table__
+    tags = {f'table:{table.name}'}
+    if obj.id is not None:
+        tags.add(f'{table.name}:{obj.id}')
+    attrs = inspect(obj).attrs
+    for column in table.columns:
+        for fk in column.foreign_keys:
+            parent = fk.column.table.name
+            if state == 'dirty':
+                history = attrs[column.key].history
+                if not history.has_changes():
+                    continue
+                values = list(history.deleted) + list(history.added)
+            else:
+                values = [getattr(obj, column.key)]
+            tags.update(f'counts:{parent}:{value}' for value in values if value is not None)
+    return tags
+
+def defer_invalidation(session, tags):
+    """绕过ORM的写入登记需要失效的标签，与ORM写入一样在事务提交后失效、回滚时丢弃"""
+    session.info.setdefault('cache_tags', set()).update(tags)
+
+@event.listens_for(Session, 'after_flush')
+def collect_cache_tags(session, flush_context):
+    """记录本次flush写入的对象对应的缓存标签，提交后统一失效"""
+    tags = session.info.setdefault('cache_tags', set())
+    for state, objects in (('new', session.new), ('dirty', session.dirty), ('deleted', session.deleted)):
+        for obj in objects:
+            if hasattr(obj, '__table__'):
+                tags.update(_changed_tags(obj, state))
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_cache(session):
+    response_cache.invalidate(session.info.pop('cache_tags', None))
+
+@event.listens_for(Session, 'after_rollback')
+def discard_cache_tags(session):
+    session.info.pop('cache_tags', None)
@@ -0,0 +1,100 @@
+from collections import defaultdict
+from sqlalchemy import bindparam, event, func, inspect, select
+from sqlalchemy.orm import Session
+from models import db, User, Singer, Album, Song, Favorite, Genre, SongGenre, Playlist, PlaylistSong
+
+# 计数列定义：(子表模型, 外键属性, 父表模型, 计数列)
+COUNTERS = [
+    (Favorite, 'song_id', Song, 'favorite_count'),
+    (Favorite, 'user_id', User, 'favorites_count'),
+    (Song, 'singer_id', Singer, 'songs_count'),
+    (Song, 'album_id', Album, 'songs_count'),
+    (Album, 'singer_id', Singer, 'albums_count'),
+    (SongGenre, 'genre_id', Genre, 'songs_count'),
+    (PlaylistSong, 'playlist_id', Playlist, 'songs_count'),
+]
+
+RECONCILE_BATCH_SIZE = 1000
+
+@event.listens_for(Session, 'after_flush')
+def apply_counter_deltas(session, flush_context):
+    """在同一事务中按本次flush新增、删除、改动外键的子记录更新父表计数列
+
+    级联删除的子记录同样出现在session.deleted中，因此删除歌手、歌曲、用户时
+    相关的计数也会一并扣减；父记录本身被删除时UPDATE不会命中任何行。
+    """
+    deltas = defaultdict(int)  # (父表模型, 计数列, 父记录id) -> 增量
+    for child, fk, parent, column in COUNTERS:
+        for obj in session.new:
+            if isinstance(obj, child) and getattr(obj, fk) is not None:
+                deltas[parent, column, getattr(obj, fk)] += 1
+        for obj in session.deleted:
+            if isinstance(obj, child) and getattr(obj, fk) is not None:
+                deltas[parent, column, getattr(obj, fk)] -= 1
+        for obj in session.dirty:
+            if not isinstance(obj, child):
+                continue
+            history = inspect(obj).attrs[fk].history
+            if not history.has_changes():
+                continue
+            for old in history.deleted:
+                if old is not None:
+                    deltas[parent, column, old] -= 1
+            for new in history.added:
+                if new is not None:
+                    deltas[parent, column, new] += 1
+
+    apply_deltas(session.connection(), deltas)
+
+def _keep_updated_at(table, values):
+    """UPDATE的赋值中加上 updated_at = updated_at，表没有updated_at列时原样返回"""
+    if 'updated_at' in table.c:
+        values['updated_at'] = table.c.updated_at
+    return values
+
+def apply_deltas(connection, deltas):
+    """按{(父表模型, 计数列, 父记录id): 增量}更新计数列，批量导入等绕过ORM的写入也使用此函数
+
+    计数列不算记录本身的修改：UPDATE中把updated_at设为原值，不触发它的onupdate。
+    """
+    # 同一计数列、同一增量的父记录合并为一条UPDATE，按id排序以减少死锁
+    grouped = defaultdict(list)
+    for (parent, column, parent_id), delta in deltas.items():
+        if delta:
+            grouped[parent, column, delta].append(parent_id)
+    for (parent, column, delta), ids in sorted(grouped.items(), key=lambda item: (item[0][0].__tablename__, item[0][1], item[0][2])):
+        table = parent.__table__
+        connection.execute(
+            table.update()
+            .where(table.c.id.in_(sorted(ids)))
+            .values(_keep_updated_at(table, {column: table.c[column] + delta}))
+        )
+
+def reconcile_counters(repair=True):
+    """核对所有计数列与实际行数，返回{计数列: 不一致的行数}，repair为True时修复
+
+    用一条LEFT JOIN GROUP BY查询找出不一致的父记录，再按批更新为实际值。
+    """
+    report = {}
+    for child, fk, parent, column in COUNTERS:
+        fk_column = getattr(child, fk)
+        actual = select(fk_column.label('parent_id'), func.count().label('cnt'))\
+            .group_by(fk_column).subquery()
+        drifted = db.session.execute(
+            select(parent.id, func.coalesce(actual.c.cnt, 0))
+            .outerjoin(actual, actual.c.parent_id == parent.id)
+            .where(getattr(parent, column) != func.coalesce(actual.c.cnt, 0))
+            .order_by(parent.id)
+        ).all()
+        report[f'{parent.__tablename__}.{column}'] = len(drifted)
+
+        if repair and drifted:
+            table = parent.__table__
+            statement = table.update()\
+                .where(table.c.id == bindparam('b_id'))\
+                .values(_keep_updated_at(table, {column: bindparam('b_value')}))
+            for start in range(0, len(drifted), RECONCILE_BATCH_SIZE):
+                batch = drifted[start:start + RECONCILE_BATCH_SIZE]
+                db.session.execute(statement, [{'b_id': row[0], 'b_value': row[1]} for row in batch])
+                db.session.commit()
+    return report
@@ -0,0 +1,66 @@
+import threading
+import time
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+class InstrumentedQueuePool(QueuePool):
+    """记录借出次数、等待时间和超时次数的QueuePool
+
+    借出时连接已全部被占用（checked_out达到pool_size + max_overflow）记为一次饱和，
+    这时请求线程要等其他线程归还连接，最多等待pool_timeout秒，超时抛出TimeoutError。
+    指标按进程统计，多worker部署时每个进程各有一个连接池。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.saturated = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        saturated = self.checkedout() >= self.size() + self._max_overflow
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.saturated += saturated
+                self.timeouts += timed_out
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def stats(self):
+        capacity = self.size() + self._max_overflow
+        checked_out = self.checkedout()
+        with self._stats_lock:
+            return {
+                'pool_size': self.size(),
+                'max_overflow': self._max_overflow,
+                'capacity': capacity,
+                'checked_out': checked_out,
+                'checked_in': self.checkedin(),
+                'overflow': max(self.overflow(), 0),
+                'utilization': round(checked_out / capacity, 4) if capacity else None,
+                'checkouts': self.checkouts,
+                'saturated_checkouts': self.saturated,
+                'timeouts': self.timeouts,
+                'wait_ms_avg': round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else None,
+                'wait_ms_max': round(self.wait_max * 1000, 3),
+            }
+
+def pool_stats(engine):
+    """engine连接池的当前状态和累计指标；未使用InstrumentedQueuePool时只返回连接池类型"""
+    pool = engine.pool
+    result = {'pool': type(pool).__name__}
+    if isinstance(pool, InstrumentedQueuePool):
+        result.update(pool.stats())
+    return result
@@ -0,0 +1,125 @@
+from sqlalchemy import event
+from models import db, User, Singer, Album, Song, Playlist
+
+# 需要检查的GET接口。{user}/{singer}/... 会替换为库中实际存在的id。
+# 返回整表的接口本来就要扫描全表，这里检查它们的分页、过滤形式。
+ROUTES = [
+    '/api/users/{user}',
+    '/api/users/{user}/favorites',
+    '/api/users/{user}/playlists',
+    '/api/singers?limit=20',
+    '/api/singers?limit=20&sort=name',
+    '/api/singers/{singer}',
+    '/api/albums?limit=20&sort=created_at&order=desc',
+    '/api/albums?singer_id={singer}&limit=20',
+    '/api/albums/{album}',
+    '/api/songs?limit=20',
+    '/api/songs?limit=20&sort=name',
+    '/api/songs?limit=20&sort=created_at&order=desc',
+    '/api/songs?singer_id={singer}&limit=20',
+    '/api/songs?album_id={album}&limit=20',
+    '/api/songs/{song}',
+    '/api/songs/{song}/lyrics',
+    '/api/songs/{song}/genres',
+    '/api/songs/{song}/similar',
+    '/api/favorites?limit=20',
+    '/api/favorites?user_id={user}&limit=20',
+    '/api/favorites?song_id={song}&limit=20',
+    '/api/playlists/{playlist}',
+    '/api/playlists/{playlist}/songs',
+    '/api/playlists/{playlist}/songs?limit=20',
+    '/api/stats/overview',
+    '/api/stats/user-activity?days=30',
+    '/api/stats/top-songs',
+    '/api/stats/top-singers',
+    '/api/popular-singers',
+    '/api/recommendations?user_id={user}',
+    '/api/recommendations/popular',
+]
+
+# 数据量很小、全表扫描无妨的表
+SMALL_TABLES = {'genres'}
+
+def _sample_ids():
+    ids = {}
+    for name, model in (('user', User), ('singer', Singer), ('album', Album), ('song', Song), ('playlist', Playlist)):
+        ids[name] = db.session.query(db.func.min(model.id)).scalar() or 1
+    return ids
+
+def _capture(client, url):
+    """请求url并记录期间执行的SELECT语句及参数"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return statements
+
+def _outer_keywords(statement):
+    """语句最外层（括号之外）出现的单词，嵌入的标量子查询中的WHERE不计入"""
+    depth = 0
+    outer = []
+    for char in statement:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif depth == 0:
+            outer.append(char)
+    return set(''.join(outer).split())
+
+def _full_scans(connection, statement, parameters):
+    """返回语句执行计划中做全表扫描的表名
+
+    只统计业务表，子查询产生的临时表不计。不带过滤条件、带LIMIT并按主键顺序
+    读取的查询只读取前几行，不计入；MySQL显示为type=index，SQLite显示为SCAN。
+    带过滤条件的索引全扫描（MySQL的type=index加Using where）同样算作全表扫描。
+    """
+    dialect = connection.dialect.name
+    prefix = 'EXPLAIN ' if dialect == 'mysql' else 'EXPLAIN QUERY PLAN '
+    rows = connection.exec_driver_sql(prefix + statement, parameters).mappings().all()
+    tables = set(db.metadata.tables) - SMALL_TABLES
+    scans = []
+    if dialect == 'mysql':
+        for row in rows:
+            filtered = row['type'] == 'index' and 'Using where' in (row['Extra'] or '')
+            if (row['type'] == 'ALL' or filtered) and row['table'] in tables:
+                scans.append(row['table'])
+        return scans
+
+    # 同一层查询（parent相同）中出现临时排序，说明不是按主键顺序读取
+    sorted_scopes = {row['parent'] for row in rows if 'TEMP B-TREE' in row['detail']}
+    keywords = _outer_keywords(statement)
+    for row in rows:
+        words = row['detail'].split()
+        if words[:1] != ['SCAN'] or 'INDEX' in words or words[1] not in tables:
+            continue
+        if 'LIMIT' in keywords and 'WHERE' not in keywords and row['parent'] not in sorted_scopes:
+            continue
+        scans.append(words[1])
+    return scans
+
+def run_explain_check(app):
+    """逐个请求ROUTES并对期间执行的每条SELECT做EXPLAIN，返回[(url, 表名, SQL), ...]
+
+    每个接口先请求一次预热（内存索引、排行榜等的首次构建会扫描全表），
+    第二次请求时才记录语句。
+    """
+    violations = []
+    client = app.test_client()
+    with app.app_context():
+        ids = _sample_ids()
+        for template in ROUTES:
+            url = template.format(**ids)
+            client.get(url)
+            for statement, parameters in _capture(client, url):
+                with db.engine.connect() as connection:
+                    for table in _full_scans(connection, statement, parameters):
+                        violations.append((url, table, statement))
+    return violations
@@ -0,0 +1,34 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, request
+from werkzeug.test import EnvironBuilder
+
+# 组合接口并发执行子请求的线程数（每个进程共用），每个子请求占用一个数据库连接
+FANOUT_WORKERS = int(os.getenv('FANOUT_WORKERS', '6'))
+
+# 不转发给子请求的请求头：子请求各自计算校验值，组合结果不做304
+_SKIPPED_HEADERS = {'content-length', 'content-type', 'if-none-match', 'if-modified-since'}
+
+# 子请求environ中的标记，准入控制据此跳过已在外层请求计数的子请求
+SUBREQUEST_KEY = 'music.subrequest'
+
+_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='fanout')
+
+def _dispatch(app, path, headers):
+    """在独立的请求上下文中执行一个GET子请求，经过与普通请求相同的钩子、缓存和校验"""
+    environ = EnvironBuilder(path=path, method='GET', headers=headers,
+                             environ_overrides={SUBREQUEST_KEY: True}).get_environ()
+    with app.request_context(environ):
+        return app.full_dispatch_request()
+
+def fan_out(paths):
+    """并发执行{名称: 路径}中的GET子请求，返回{名称: 响应}
+
+    每个子请求在线程池中有自己的应用上下文和数据库会话，各自从连接池借用连接，
+    总耗时取决于最慢的子请求而不是各子请求之和。当前请求的Cookie、Authorization等
+    请求头会转发给子请求。
+    """
+    app = current_app._get_current_object()
+    headers = [(name, value) for name, value in request.headers if name.lower() not in _SKIPPED_HEADERS]
+    futures = {name: _executor.submit(_dispatch, app, path, headers) for name, path in paths.items()}
+    return {name: future.result() for name, future in futures.items()}
@@ -1,4 +1,5 @@
 import axios from 'axios'
+import { getToken } from '../utils/auth'
 
 const api = axios.create({
   baseURL: '/api',
@@ -8,6 +9,11 @@ const api = axios.create({
 // 请求拦截器
 api.interceptors.request.use(
   config => {
+    // 登录后带上会话令牌
+    const token = getToken()
+    if (token) {
+      config.headers.Authorization = `Bearer ${token}`
+    }
     return config
   },
   error => {
@@ -37,7 +43,7 @@ export const userApi = {
 
 // 歌手相关API
 export const singerApi = {
-  getSingers: () => api.get('/singers'),
+  getSingers: (params) => api.get('/singers', { params }),
   getSinger: (id) => api.get(`/singers/${id}`),
   createSinger: (data) => api.post('/singers', data),
   updateSinger: (id, data) => api.put(`/singers/${id}`, data),
@@ -46,7 +52,7 @@ export const singerApi = {
 
 // 专辑相关API
 export const albumApi = {
-  getAlbums: () => api.get('/albums'),
+  getAlbums: (params) => api.get('/albums', { params }),
   getAlbum: (id) => api.get(`/albums/${id}`),
   createAlbum: (data) => api.post('/albums', data),
   updateAlbum: (id, data) => api.put(`/albums/${id}`, data),
@@ -55,8 +61,9 @@ export const albumApi = {
 
 // 歌曲相关API
 export const songApi = {
-  getSongs: () => api.get('/songs'),
+  getSongs: (params) => api.get('/songs', { params }),
   getSong: (id) => api.get(`/songs/${id}`),
+  getLyrics: (id) => api.get(`/songs/${id}/lyrics`),
   createSong: (data) => api.post('/songs', data),
   updateSong: (id, data) => api.put(`/songs/${id}`, data),
   deleteSong: (id) => api.delete(`/songs/${id}`)
@@ -64,9 +71,10 @@ export const songApi = {
 
 // 收藏相关API
 export const favoriteApi = {
-  getAllFavorites: () => api.get('/favorites'),
+  getAllFavorites: (params) => api.get('/favorites', { params }),
   getUserFavorites: (userId) => api.get(`/users/${userId}/favorites`),
   createFavorite: (data) => api.post('/favorites', data),
+  createFavorites: (userId, songIds) => api.post('/favorites/batch', { user_id: userId, song_ids: songIds }),
   deleteFavorite: (id) => api.delete(`/favorites/${id}`),
   deleteFavoriteByUserSong: (userId, songId) => api.delete(`/favorites/user/${userId}/song/${songId}`)
 }
@@ -75,11 +83,12 @@ export const favoriteApi = {
 export const statsApi = {
   getPopularSingers: () => api.get('/popular-singers'),
   getStatsOverview: () => api.get('/stats/overview'),
-  getTopSingers: () => api.get('/stats/top-singers'),
-  getTopSongs: () => api.get('/stats/top-songs'),
+  getTopSingers: (params) => api.get('/stats/top-singers', { params }),
+  getTopSongs: (params) => api.get('/stats/top-songs', { params }),
   getGenreDistribution: () => api.get('/stats/genre-distribution'),
-  getUserActivity: () => api.get('/stats/user-activity'),
-  getSingerNationality: () => api.get('/stats/singer-nationality')
+  getUserActivity: (params) => api.get('/stats/user-activity', { params }),
+  getSingerNationality: () => api.get('/stats/singer-nationality'),
+  getDashboard: (params) => api.get('/dashboard', { params })
 }
 
 // 推荐相关API
@@ -96,7 +105,10 @@ export const playlistApi = {
   updatePlaylist: (id, data) => api.put(`/playlists/${id}`, data),
   deletePlaylist: (id) => api.delete(`/playlists/${id}`),
   addSongToPlaylist: (playlistId, songId) => api.post(`/playlists/${playlistId}/songs`, { song_id: songId }),
-  getPlaylistSongs: (playlistId) => api.get(`/playlists/${playlistId}/songs`),
+  addSongsToPlaylist: (playlistId, songIds) => api.post(`/playlists/${playlistId}/songs/batch`, { song_ids: songIds }),
+  getPlaylistSongs: (playlistId, params) => api.get(`/playlists/${playlistId}/songs`, { params }),
+  movePlaylistSong: (playlistId, songId, position) => api.patch(`/playlists/${playlistId}/songs/${songId}`, position),
+  reorderPlaylistSongs: (playlistId, moves) => api.post(`/playlists/${playlistId}/songs/reorder`, { moves }),
   removeSongFromPlaylist: (playlistId, songId) => api.delete(`/playlists/${playlistId}/songs/${songId}`)
 }
 
@@ -115,5 +127,10 @@ export default api
 
 // 认证相关API
 export const authApi = {
-  login: (data) => api.post('/login', data)
-}
\ No newline at end of file
+  login: (data) => api.post('/login', data),
+  getSession: () => api.get('/session')
+}
+// 增量同步API
+export const syncApi = {
+  sync: (since) => api.get('/sync', { params: since ? { since } : {} })
+}
@@ -1,13 +1,15 @@
-export function setAuth({ userId, role, username }) {
+export function setAuth({ userId, role, username, token }) {
   localStorage.setItem('auth_user_id', String(userId || ''))
   localStorage.setItem('auth_role', role || 'user')
   if (username) localStorage.setItem('auth_username', username)
+  if (token) localStorage.setItem('auth_token', token)
 }
 
 export function clearAuth() {
   localStorage.removeItem('auth_user_id')
   localStorage.removeItem('auth_role')
   localStorage.removeItem('auth_username')
+  localStorage.removeItem('auth_token')
 }
 
 export function getRole() {
@@ -27,6 +29,10 @@ export function isAuthed() {
   return !!localStorage.getItem('auth_role')
 }
 
+export function getToken() {
+  return localStorage.getItem('auth_token') || null
+}
+
 export function getUsername() {
   return localStorage.getItem('auth_username') || null
 }
\ No newline at end of file
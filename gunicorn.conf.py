@@ -0,0 +1,31 @@
+# 生产环境启动：gunicorn -c gunicorn.conf.py
+# 多进程 + 每进程多线程（gthread），各项均可用环境变量调整
+import multiprocessing
+import os
+
+wsgi_app = 'app:app'
+bind = os.getenv('WEB_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_WORKERS', str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.getenv('WEB_THREADS', '4'))
+worker_class = 'gthread'
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+keepalive = 5
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '0'))  # 每个worker处理多少请求后重启，0为不重启
+max_requests_jitter = max_requests // 10
+preload_app = os.getenv('WEB_PRELOAD', '0') == '1'
+accesslog = os.getenv('WEB_ACCESS_LOG', '-')
+
+def when_ready(server):
+    """启动时打印所有worker合计可能占用的MySQL连接数，便于对照max_connections"""
+    from app import DB_MAX_OVERFLOW, DB_POOL_SIZE
+    per_worker = DB_POOL_SIZE + DB_MAX_OVERFLOW
+    server.log.info(f'{workers} 个worker × {threads} 线程，每个worker最多 {per_worker} 个数据库连接，'
+                    f'合计最多 {workers * per_worker} 个')
+
+def post_fork(server, worker):
+    """预加载应用时主进程中可能已建立连接，子进程丢弃继承来的连接池，不与其他进程共用连接"""
+    if preload_app:
+        from app import app
+        from models import db
+        with app.app_context():
+            db.engine.dispose(close=False)
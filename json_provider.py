@@ -0,0 +1,53 @@
+from flask.json.provider import DefaultJSONProvider
+from metrics import serializing
+
+try:
+    import orjson  # 可选依赖，安装后JSON编码改用orjson
+except ImportError:
+    orjson = None
+
+class StdlibProvider(DefaultJSONProvider):
+    """Flask默认的标准库实现，生成响应体的耗时计入请求的序列化时间"""
+
+    def response(self, *args, **kwargs):
+        with serializing():
+            return super().response(*args, **kwargs)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """使用orjson编码、解码JSON，输出与标准库实现一致
+
+    日期、Decimal等类型仍交给DefaultJSONProvider.default处理（日期为HTTP日期格式），
+    键同样排序；不同之处只是非ASCII字符直接以UTF-8输出而不转义为\\uXXXX。
+    带有orjson不支持的参数调用时退回标准库实现。
+    """
+
+    def _options(self, indent=False):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def _pretty(self):
+        return (self.compact is None and self._app.debug) or self.compact is False
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        with serializing():
+            body = orjson.dumps(obj, default=self.default, option=self._options(indent=self._pretty()))
+        return self._app.response_class(body + b'\n', mimetype=self.mimetype)
+
+def json_provider_class():
+    """安装了orjson时使用OrjsonProvider，否则使用标准库实现"""
+    return OrjsonProvider if orjson is not None else StdlibProvider
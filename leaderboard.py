@@ -0,0 +1,334 @@
+import calendar
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import islice
+from sortedcontainers import SortedList
+from models import db, Singer, Album, Song, Favorite
+
+# 排行榜配置
+LEADERBOARD_MAX_AGE = int(os.getenv('LEADERBOARD_MAX_AGE', '600'))  # 秒，超过后后台全量重建
+LEADERBOARD_MIN_REBUILD_INTERVAL = int(os.getenv('LEADERBOARD_MIN_REBUILD_INTERVAL', '60'))  # 秒，标记过期后距上次构建至少间隔这么久才重建
+WINDOWS = {'24h': 24, '7d': 24 * 7}  # 时间窗口 -> 小时数
+BUILD_BATCH_SIZE = 10000
+
+def _hour(moment):
+    """把时间折算为整点小时编号，不带时区的时间按UTC处理"""
+    return calendar.timegm(moment.utctimetuple()) // 3600
+
+class Leaderboard:
+    """按分数降序、id升序排列的排行榜，更新O(log n)，读取前N名O(N)"""
+
+    def __init__(self):
+        self._scores = {}
+        self._ranked = SortedList()
+
+    def incr(self, key, delta):
+        score = self._scores.get(key, 0)
+        if key in self._scores:
+            self._ranked.remove((-score, key))
+        self._scores[key] = score + delta
+        self._ranked.add((-(score + delta), key))
+
+    def score(self, key):
+        return self._scores.get(key, 0)
+
+    def set(self, key, score):
+        self.incr(key, score - self._scores.get(key, 0))
+
+    def remove(self, key):
+        score = self._scores.pop(key, None)
+        if score is not None:
+            self._ranked.remove((-score, key))
+
+    def top(self, n, min_score=None):
+        """返回前n名的[(key, score), ...]，min_score限制最低分"""
+        result = []
+        for negative, key in islice(self._ranked, n):
+            if min_score is not None and -negative < min_score:
+                break
+            result.append((key, -negative))
+        return result
+
+class _Window:
+    """最近hours小时内的收藏排行，由小时桶增量维护"""
+
+    def __init__(self, hours):
+        self.hours = hours
+        self.start_hour = None
+        self.songs = Leaderboard()
+        self.singers = Leaderboard()
+
+class Rankings:
+    """热门歌曲、热门歌手排行榜
+
+    全时段排行在重建时从计数列加载；时间窗口排行按小时分桶保存收藏数，
+    时间推进时把滑出窗口的桶从排行中扣除。收藏的增删通过add_favorite/
+    remove_favorite即时更新，展示用的歌曲、歌手信息也缓存在内存中，
+    读取排行榜不访问数据库。每个进程各持有一份，定期全量重建以纠正偏差。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+        self.built_at = None
+        self._stale = False
+        self._rebuilding = False
+
+    def _reset(self):
+        self.songs = Leaderboard()
+        self.singers = Leaderboard()
+        self.windows = {name: _Window(hours) for name, hours in WINDOWS.items()}
+        self.buckets = {}       # 小时编号 -> Counter({('song', id): n, ('singer', id): n})
+        self.song_info = {}     # 歌曲id -> 展示信息
+        self.singer_info = {}   # 歌手id -> 展示信息
+
+    # ---------- 构建 ----------
+    def build(self):
+        """从数据库全量重建"""
+        fresh = Rankings()
+        now = datetime.utcnow()
+        for singer in db.session.query(Singer.id, Singer.name, Singer.avatar, Singer.nationality)\
+                .yield_per(BUILD_BATCH_SIZE):
+            fresh.singer_info[singer.id] = {
+                'id': singer.id,
+                'name': singer.name,
+                'avatar': singer.avatar,
+                'nationality': singer.nationality
+            }
+            fresh.singers.set(singer.id, 0)
+
+        songs = db.session.query(
+            Song.id, Song.name, Song.duration, Song.singer_id, Song.favorite_count,
+            Singer.name.label('singer_name'), Album.name.label('album_name')
+        ).join(Singer, Song.singer_id == Singer.id)\
+         .outerjoin(Album, Song.album_id == Album.id)\
+         .yield_per(BUILD_BATCH_SIZE)
+        for song in songs:
+            fresh.song_info[song.id] = {
+                'id': song.id,
+                'name': song.name,
+                'duration': song.duration,
+                'singer_id': song.singer_id,
+                'singer_name': song.singer_name,
+                'album_name': song.album_name
+            }
+            fresh.songs.set(song.id, song.favorite_count or 0)
+            if song.favorite_count:
+                fresh.singers.incr(song.singer_id, song.favorite_count)
+
+        since = now - timedelta(hours=max(WINDOWS.values()))
+        fresh._advance(now)
+        recent = db.session.query(Favorite.song_id, Favorite.created_at)\
+            .filter(Favorite.created_at >= since)\
+            .yield_per(BUILD_BATCH_SIZE)
+        for song_id, created_at in recent:
+            info = fresh.song_info.get(song_id)
+            if info:
+                fresh._bucket_change(song_id, info['singer_id'], _hour(created_at), 1)
+
+        with self._lock:
+            self.__dict__.update({key: getattr(fresh, key) for key in
+                                  ('songs', 'singers', 'windows', 'buckets', 'song_info', 'singer_info')})
+            self.built_at = time.time()
+            self._stale = False
+
+    def _advance(self, now):
+        """时间推进到now所在的小时，扣除滑出各窗口的小时桶"""
+        current = _hour(now)
+        for window in self.windows.values():
+            start = current - window.hours + 1
+            if window.start_hour is not None and window.start_hour < start:
+                for hour in sorted(h for h in self.buckets if window.start_hour <= h < start):
+                    for (kind, key), count in self.buckets[hour].items():
+                        board = window.songs if kind == 'song' else window.singers
+                        board.incr(key, -count)
+            window.start_hour = start
+        oldest = current - max(WINDOWS.values()) + 1
+        for hour in [h for h in self.buckets if h < oldest]:
+            del self.buckets[hour]
+
+    def _bucket_change(self, song_id, singer_id, hour, delta):
+        """在hour所在的小时桶和覆盖该小时的窗口中更新收藏数"""
+        bucket = self.buckets.get(hour)
+        if bucket is None:
+            if delta < 0 or hour < min(w.start_hour for w in self.windows.values()):
+                return
+            bucket = self.buckets[hour] = Counter()
+        bucket['song', song_id] += delta
+        bucket['singer', singer_id] += delta
+        for window in self.windows.values():
+            if hour >= window.start_hour:
+                window.songs.incr(song_id, delta)
+                window.singers.incr(singer_id, delta)
+
+    # ---------- 增量维护 ----------
+    def _remember(self, song):
+        """缓存歌曲和所属歌手的展示信息"""
+        self.song_info[song.id] = {
+            'id': song.id,
+            'name': song.name,
+            'duration': song.duration,
+            'singer_id': song.singer_id,
+            'singer_name': song.singer.name if song.singer else None,
+            'album_name': song.album.name if song.album else None
+        }
+        if song.singer_id not in self.singer_info and song.singer:
+            self.singer_info[song.singer_id] = {
+                'id': song.singer_id,
+                'name': song.singer.name,
+                'avatar': song.singer.avatar,
+                'nationality': song.singer.nationality
+            }
+
+    def add_favorite(self, song, created_at):
+        """记录一次收藏，song为收藏的歌曲对象"""
+        if not self.ready:
+            return
+        with self._lock:
+            if song.id not in self.song_info:
+                self._remember(song)
+            self.songs.incr(song.id, 1)
+            self.singers.incr(song.singer_id, 1)
+            self._advance(datetime.utcnow())
+            self._bucket_change(song.id, song.singer_id, _hour(created_at or datetime.utcnow()), 1)
+
+    def add_favorites(self, song_ids, created_at):
+        """记录一批同时写入的收藏；有构建之后新增的歌曲时信息不全，标记为过期等待重建"""
+        if not self.ready:
+            return
+        with self._lock:
+            self._advance(datetime.utcnow())
+            hour = _hour(created_at)
+            for song_id in song_ids:
+                info = self.song_info.get(song_id)
+                if not info:
+                    self._stale = True
+                    continue
+                self.songs.incr(song_id, 1)
+                self.singers.incr(info['singer_id'], 1)
+                self._bucket_change(song_id, info['singer_id'], hour, 1)
+
+    def remove_favorite(self, song_id, created_at):
+        """撤销一次收藏"""
+        if not self.ready:
+            return
+        with self._lock:
+            info = self.song_info.get(song_id)
+            if not info:
+                return
+            self.songs.incr(song_id, -1)
+            self.singers.incr(info['singer_id'], -1)
+            self._advance(datetime.utcnow())
+            if created_at:
+                self._bucket_change(song_id, info['singer_id'], _hour(created_at), -1)
+
+    def upsert_song(self, song):
+        """新增或修改歌曲后更新展示信息；换了歌手时把该歌曲的收藏数从原歌手转到新歌手名下"""
+        if not self.ready:
+            return
+        with self._lock:
+            old = self.song_info.get(song.id)
+            self._remember(song)
+            if old is None:
+                count = song.favorite_count or 0
+                self.songs.set(song.id, count)
+                if count:
+                    self.singers.incr(song.singer_id, count)
+            elif old['singer_id'] != song.singer_id:
+                self._advance(datetime.utcnow())
+                self._move(song.id, old['singer_id'], song.singer_id)
+
+    def remove_song(self, song_id):
+        """删除歌曲（及级联删除的收藏）后从各排行中扣除"""
+        if not self.ready:
+            return
+        with self._lock:
+            info = self.song_info.pop(song_id, None)
+            if info is None:
+                return
+            self._advance(datetime.utcnow())
+            self._move(song_id, info['singer_id'], None)
+            self.songs.remove(song_id)
+            for window in self.windows.values():
+                window.songs.remove(song_id)
+            for bucket in self.buckets.values():
+                bucket.pop(('song', song_id), None)
+
+    def _move(self, song_id, old_singer_id, new_singer_id):
+        """把歌曲的全时段和各窗口收藏数从old_singer_id转到new_singer_id（None为直接扣除）"""
+        count = self.songs.score(song_id)
+        if count:
+            self.singers.incr(old_singer_id, -count)
+            if new_singer_id is not None:
+                self.singers.incr(new_singer_id, count)
+        for hour, bucket in self.buckets.items():
+            count = bucket.get(('song', song_id))
+            if not count:
+                continue
+            bucket['singer', old_singer_id] -= count
+            if new_singer_id is not None:
+                bucket['singer', new_singer_id] += count
+            for window in self.windows.values():
+                if hour >= window.start_hour:
+                    window.singers.incr(old_singer_id, -count)
+                    if new_singer_id is not None:
+                        window.singers.incr(new_singer_id, count)
+
+    def invalidate(self):
+        """歌手、专辑信息变化或级联删除收藏后标记为过期，距上次构建满LEADERBOARD_MIN_REBUILD_INTERVAL秒后在后台重建"""
+        self._stale = True
+
+    @property
+    def ready(self):
+        return self.built_at is not None
+
+    def ensure_built(self, app):
+        """首次使用时同步构建；过期后在后台线程重建，重建期间继续使用旧数据"""
+        if not self.ready:
+            with self._lock:
+                if not self.ready:
+                    self.build()
+        age = time.time() - self.built_at
+        expired = (self._stale and age >= LEADERBOARD_MIN_REBUILD_INTERVAL) or age > LEADERBOARD_MAX_AGE
+        if expired and not self._rebuilding:
+            self._rebuilding = True
+            threading.Thread(target=self._background_rebuild, args=(app,), daemon=True).start()
+
+    def _background_rebuild(self, app):
+        try:
+            with app.app_context():
+                self.build()
+                db.session.remove()
+        finally:
+            self._rebuilding = False
+
+    # ---------- 读取 ----------
+    def _boards(self, window):
+        if window is None:
+            return self.songs, self.singers
+        self._advance(datetime.utcnow())
+        return self.windows[window].songs, self.windows[window].singers
+
+    def top_songs(self, n, window=None, min_count=None):
+        """热门歌曲；指定时间窗口时只返回窗口内有收藏的歌曲"""
+        if window and min_count is None:
+            min_count = 1
+        with self._lock:
+            board = self._boards(window)[0]
+            return [dict(self.song_info[song_id], favorite_count=count)
+                    for song_id, count in board.top(n, min_count) if song_id in self.song_info]
+
+    def top_singers(self, n, window=None, min_count=None):
+        """热门歌手；指定时间窗口时只返回窗口内有收藏的歌手"""
+        if window and min_count is None:
+            min_count = 1
+        with self._lock:
+            board = self._boards(window)[1]
+            return [dict(self.singer_info[singer_id], favorite_count=count)
+                    for singer_id, count in board.top(n, min_count) if singer_id in self.singer_info]
+
+# 进程内的全局排行榜
+rankings = Rankings()
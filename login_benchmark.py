@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+from models import db, User
+from auth import AUTH_WORKERS, hash_password
+from fanout import SUBREQUEST_KEY
+
+BENCHMARK_USERNAME = '__login_benchmark__'
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+def _hammer(client_factory, request, seconds, threads):
+    """threads个线程在seconds秒内反复执行request(client)
+
+    返回(成功次数, 被限流(429)次数, 失败次数, 总耗时, 各次耗时之和)。
+    """
+    deadline = time.perf_counter() + seconds
+    lock = threading.Lock()
+    totals = {'ok': 0, 'throttled': 0, 'failed': 0, 'elapsed': 0.0}
+
+    def worker():
+        client = client_factory()
+        ok = throttled = failed = 0
+        elapsed = 0.0
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            status = request(client)
+            elapsed += time.perf_counter() - started
+            if status == 200:
+                ok += 1
+            elif status == 429:
+                throttled += 1
+            else:
+                failed += 1
+        with lock:
+            totals['ok'] += ok
+            totals['throttled'] += throttled
+            totals['failed'] += failed
+            totals['elapsed'] += elapsed
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return totals['ok'], totals['throttled'], totals['failed'], time.perf_counter() - started, totals['elapsed']
+
+def _client_factory(app):
+    """测试客户端的请求都来自同一地址，标记为内部子请求以跳过准入控制，测量的是校验本身的吞吐量"""
+    def factory():
+        client = app.test_client()
+        client.environ_base[SUBREQUEST_KEY] = True
+        return client
+    return factory
+
+def run_login_benchmark(app, seconds=5.0, threads=None):
+    """并发请求/api/login和/api/session，返回{测试项: 结果}
+
+    per_core按参与计算的核数（AUTH_WORKERS与CPU核数中较小者）折算。测试用户在开始时
+    创建、结束后删除。请求不经过准入控制；throttled仍单独统计429，与其他失败区分。
+    """
+    threads = threads or AUTH_WORKERS * 2
+    cores = max(min(AUTH_WORKERS, os.cpu_count() or 1), 1)
+    with app.app_context():
+        user = User(username=BENCHMARK_USERNAME, email=f'{BENCHMARK_USERNAME}@localhost',
+                    password=hash_password(BENCHMARK_PASSWORD))
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+    try:
+        credentials = {'username': BENCHMARK_USERNAME, 'password': BENCHMARK_PASSWORD, 'role': 'user'}
+        client_factory = _client_factory(app)
+        token = client_factory().post('/api/login', json=credentials).get_json()['token']
+        headers = {'Authorization': f'Bearer {token}'}
+        cases = {
+            'login': lambda client: client.post('/api/login', json=credentials).status_code,
+            'session': lambda client: client.get('/api/session', headers=headers).status_code,
+        }
+        report = {}
+        for name, request in cases.items():
+            ok, throttled, failed, wall, elapsed = _hammer(client_factory, request, seconds, threads)
+            count = ok + throttled + failed
+            report[name] = {
+                'requests': ok,
+                'throttled': throttled,
+                'failed': failed,
+                'seconds': wall,
+                'per_second': ok / wall if wall else 0,
+                'per_core': ok / wall / cores if wall else 0,
+                'avg_ms': elapsed / count * 1000 if count else 0,
+            }
+        return report
+    finally:
+        with app.app_context():
+            db.session.delete(User.query.get(user_id))
+            db.session.commit()
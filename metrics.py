@@ -0,0 +1,323 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from admission import admission
+from cache import MemoryBackend, response_cache
+from db_pool import pool_stats
+
+logger = logging.getLogger(__name__)
+
+# 请求指标配置
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') not in ('0', 'false')
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '500'))       # 超过此耗时的请求记录日志及其SQL语句
+SLOW_REQUEST_MAX_STATEMENTS = 20                                    # 慢请求日志中最多列出的语句数（按总耗时）
+STATEMENT_LOG_CHARS = 300                                           # 日志中每条语句保留的字符数
+# cProfile采样：PROFILE_ENDPOINTS为逗号分隔的端点名（如 api.get_songs），按PROFILE_SAMPLE_RATE比例采样；
+# 配置了PROFILE_TOKEN时，请求头 X-Profile: <PROFILE_TOKEN> 的请求一定采样，不受端点和比例限制
+PROFILE_ENDPOINTS = {name.strip() for name in os.getenv('PROFILE_ENDPOINTS', '').split(',') if name.strip()}
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0.01'))
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN', '')
+PROFILE_HEADER = 'X-Profile'
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')                          # 非空时把采样结果保存为.prof文件
+PROFILE_TOP_FUNCTIONS = 30                                          # 日志中列出的函数数（按累计耗时）
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class RequestMetrics:
+    """一个请求期间累计的SQL语句数、SQL耗时、读取行数和序列化耗时，保存在g.request_metrics中"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.status = 500
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.serialize_seconds = 0.0
+        self.statements = defaultdict(lambda: [0, 0.0])  # 语句 -> [执行次数, 总耗时]
+        self.profiler = None
+
+def current():
+    """当前请求的RequestMetrics，不在请求中或未启用时返回None"""
+    return g.get('request_metrics') if has_app_context() else None
+
+# ---------- SQL计时 ----------
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = current()
+    if metrics is None or context is None:
+        return
+    elapsed = time.perf_counter() - getattr(context, 'metrics_started', time.perf_counter())
+    metrics.sql_count += 1
+    metrics.sql_seconds += elapsed
+    # 返回结果的语句：PyMySQL默认的缓冲游标执行后rowcount即读取的行数，不支持的驱动为-1
+    if cursor.description is not None and cursor.rowcount > 0:
+        metrics.rows += cursor.rowcount
+    entry = metrics.statements[statement]
+    entry[0] += 1
+    entry[1] += elapsed
+
+@contextmanager
+def serializing():
+    """把代码块的耗时计入当前请求的序列化时间，其中执行SQL的时间不计入"""
+    metrics = current()
+    if metrics is None:
+        yield
+        return
+    started, sql_before = time.perf_counter(), metrics.sql_seconds
+    try:
+        yield
+    finally:
+        metrics.serialize_seconds += time.perf_counter() - started - (metrics.sql_seconds - sql_before)
+
+# ---------- 按路由汇总 ----------
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+class RouteStats:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.statuses = defaultdict(int)
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.serialize_seconds = 0.0
+        self.slow = 0
+        self.profiled = 0
+
+class Registry:
+    """按(方法, 路由规则)汇总的请求指标，进程内保存，多worker部署时每个进程各自计数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = defaultdict(RouteStats)
+
+    def observe(self, method, route, metrics, seconds, slow):
+        with self._lock:
+            stats = self.routes[method, route]
+            stats.latency.observe(seconds)
+            stats.statements.observe(metrics.sql_count)
+            stats.statuses[metrics.status] += 1
+            stats.sql_seconds += metrics.sql_seconds
+            stats.rows += metrics.rows
+            stats.serialize_seconds += metrics.serialize_seconds
+            stats.slow += slow
+            stats.profiled += metrics.profiler is not None
+
+    def snapshot(self):
+        with self._lock:
+            return [(key, _copy(stats)) for key, stats in sorted(self.routes.items())]
+
+def _copy(stats):
+    copy = RouteStats()
+    for name in ('latency', 'statements'):
+        histogram, source = getattr(copy, name), getattr(stats, name)
+        histogram.counts, histogram.count, histogram.sum = list(source.counts), source.count, source.sum
+    copy.statuses = dict(stats.statuses)
+    for name in ('sql_seconds', 'rows', 'serialize_seconds', 'slow', 'profiled'):
+        setattr(copy, name, getattr(stats, name))
+    return copy
+
+registry = Registry()
+
+# ---------- cProfile采样 ----------
+# 同一时刻每个进程只采样一个请求：采样有额外开销，Python 3.12起同时只能有一个分析器
+_profile_lock = threading.Lock()
+
+def _should_profile():
+    if PROFILE_TOKEN and request.headers.get(PROFILE_HEADER) == PROFILE_TOKEN:
+        return True
+    return request.endpoint in PROFILE_ENDPOINTS and random.random() < PROFILE_SAMPLE_RATE
+
+def _report_profile(profiler, method, path, seconds):
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output)
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+    saved = ''
+    if PROFILE_DIR:
+        name = re.sub(r'[^\w.-]+', '_', f'{request.endpoint}-{int(time.time() * 1000)}') + '.prof'
+        stats.dump_stats(os.path.join(PROFILE_DIR, name))
+        saved = f'，已保存为 {name}'
+    logger.warning('请求采样 %s %s 耗时%.1fms%s\n%s', method, path, seconds * 1000, saved, output.getvalue())
+
+# ---------- 请求钩子 ----------
+def start_request():
+    """before_request：开始计时，命中采样条件时启动cProfile"""
+    if not METRICS_ENABLED:
+        return
+    metrics = g.request_metrics = RequestMetrics()
+    if (PROFILE_ENDPOINTS or PROFILE_TOKEN) and _should_profile() and _profile_lock.acquire(blocking=False):
+        metrics.profiler = cProfile.Profile()
+        metrics.profiler.enable()
+
+def record_status(response):
+    """after_request：记下响应状态码，未执行到这里的请求（抛出异常）按500统计"""
+    metrics = current()
+    if metrics is not None:
+        metrics.status = response.status_code
+    return response
+
+def finish_request(exc=None):
+    """teardown_request：汇总到路由指标，慢请求记录日志"""
+    metrics = g.pop('request_metrics', None)
+    if metrics is None:
+        return
+    seconds = time.perf_counter() - metrics.started
+    if metrics.profiler is not None:
+        metrics.profiler.disable()
+        _profile_lock.release()
+    # 按路由规则而不是实际路径汇总，未匹配到路由的请求（404）归为一类
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    slow = seconds * 1000 >= SLOW_REQUEST_MS
+    registry.observe(request.method, route, metrics, seconds, slow)
+    if slow:
+        _log_slow(metrics, seconds)
+    if metrics.profiler is not None:
+        _report_profile(metrics.profiler, request.method, request.full_path, seconds)
+
+def _log_slow(metrics, seconds):
+    """慢请求日志：按总耗时列出执行过的语句及次数，同一语句执行多次通常是N+1查询"""
+    statements = sorted(metrics.statements.items(), key=lambda item: item[1][1], reverse=True)
+    lines = [f'  {count}次 {total * 1000:.1f}ms  {" ".join(statement.split())[:STATEMENT_LOG_CHARS]}'
+             for statement, (count, total) in statements[:SLOW_REQUEST_MAX_STATEMENTS]]
+    if len(statements) > SLOW_REQUEST_MAX_STATEMENTS:
+        lines.append(f'  ……另有{len(statements) - SLOW_REQUEST_MAX_STATEMENTS}种语句')
+    logger.warning('慢请求 %s %s %d 耗时%.1fms，SQL %d条 %.1fms，读取%d行，序列化%.1fms\n%s',
+                   request.method, request.full_path, metrics.status, seconds * 1000,
+                   metrics.sql_count, metrics.sql_seconds * 1000, metrics.rows,
+                   metrics.serialize_seconds * 1000, '\n'.join(lines))
+
+def init_app(app):
+    app.before_request(start_request)
+    app.after_request(record_status)
+    app.teardown_request(finish_request)
+
+# ---------- Prometheus文本格式 ----------
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(int(value))
+
+class Exposition:
+    """按指标名分组输出，同名指标的HELP、TYPE只出现一次"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name, kind, help_text, labels, value):
+        if value is None:
+            return
+        entry = self.metrics.setdefault(name, (kind, help_text, []))
+        entry[2].append(f'{name}{_labels(**labels) if labels else ""} {_number(value)}')
+
+    def histogram(self, name, help_text, labels, histogram):
+        entry = self.metrics.setdefault(name, ('histogram', help_text, []))
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            entry[2].append(f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+        entry[2].append(f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram.count}')
+        entry[2].append(f'{name}_sum{_labels(**labels)} {_number(float(histogram.sum))}')
+        entry[2].append(f'{name}_count{_labels(**labels)} {histogram.count}')
+
+    def render(self):
+        lines = []
+        for name, (kind, help_text, samples) in self.metrics.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+def _request_metrics(out):
+    for (method, route), stats in registry.snapshot():
+        labels = {'method': method, 'route': route}
+        out.histogram('musicdb_http_request_duration_seconds', '请求处理耗时', labels, stats.latency)
+        out.histogram('musicdb_http_request_sql_statements', '每个请求执行的SQL语句数', labels, stats.statements)
+        for status, count in sorted(stats.statuses.items()):
+            out.add('musicdb_http_requests_total', 'counter', '请求数', dict(labels, status=status), count)
+        out.add('musicdb_http_request_sql_seconds_total', 'counter', 'SQL执行总耗时', labels, stats.sql_seconds)
+        out.add('musicdb_http_request_rows_total', 'counter', 'SQL读取的总行数（驱动报告）', labels, stats.rows)
+        out.add('musicdb_http_request_serialize_seconds_total', 'counter', '序列化总耗时（不含其中的SQL）',
+                labels, stats.serialize_seconds)
+        out.add('musicdb_http_slow_requests_total', 'counter', f'耗时超过{SLOW_REQUEST_MS:g}ms的请求数',
+                labels, stats.slow)
+        out.add('musicdb_http_profiled_requests_total', 'counter', 'cProfile采样的请求数', labels, stats.profiled)
+
+POOL_METRICS = (
+    ('checked_out', 'gauge', 'musicdb_db_pool_checked_out', '已借出的连接数'),
+    ('capacity', 'gauge', 'musicdb_db_pool_capacity', '连接池容量（pool_size + max_overflow）'),
+    ('checkouts', 'counter', 'musicdb_db_pool_checkouts_total', '借出次数'),
+    ('saturated_checkouts', 'counter', 'musicdb_db_pool_saturated_checkouts_total', '连接已全部借出时的借出次数'),
+    ('timeouts', 'counter', 'musicdb_db_pool_timeouts_total', '等待连接超时次数'),
+)
+
+def _pool_metrics(out, engines):
+    for key, engine in engines.items():
+        stats = pool_stats(engine)
+        labels = {'bind': key or 'primary'}
+        for field, kind, name, help_text in POOL_METRICS:
+            out.add(name, kind, help_text, labels, stats.get(field))
+
+def _cache_metrics(out):
+    out.add('musicdb_cache_hits_total', 'counter', '响应缓存命中次数', None, response_cache.hits)
+    out.add('musicdb_cache_misses_total', 'counter', '响应缓存未命中次数', None, response_cache.misses)
+    # Redis后端统计条目数需要扫描全部键，不在这里输出
+    backend = response_cache.backend
+    if isinstance(backend, MemoryBackend):
+        info = backend.info()
+        out.add('musicdb_cache_entries', 'gauge', '响应缓存条目数', None, info['entries'])
+        out.add('musicdb_cache_bytes', 'gauge', '响应缓存占用字节数', None, info['bytes'])
+        out.add('musicdb_cache_evictions_total', 'counter', '响应缓存淘汰次数', None, info['evictions'])
+
+def _admission_metrics(out):
+    for name, counts in admission.stats()['classes'].items():
+        labels = {'route_class': name}
+        for outcome in ('admitted', 'throttled', 'shed'):
+            out.add('musicdb_admission_requests_total', 'counter', '准入控制结果（放行、限流429、拒绝503）',
+                    dict(labels, outcome=outcome), counts[outcome])
+        out.add('musicdb_admission_active', 'gauge', '正在执行的请求数', labels, counts.get('active'))
+        out.add('musicdb_admission_waiting', 'gauge', '排队等待执行的请求数', labels, counts.get('waiting'))
+
+def render(engines):
+    """本进程的全部指标：请求、连接池（engines为{绑定名: engine}）、响应缓存和准入控制"""
+    out = Exposition()
+    _request_metrics(out)
+    _pool_metrics(out, engines)
+    _cache_metrics(out)
+    _admission_metrics(out)
+    return out.render()
@@ -0,0 +1,140 @@
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from models import db, User, Singer, Album, Song, Favorite, Genre, SongGenre, Playlist, PlaylistSong, StatsRollup, DataVersion, ChangeLog
+
+# 已执行的迁移版本记录，与业务表分开定义，不参与db.create_all()
+_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False)
+)
+
+def _online(dialect, statement, separator):
+    """MySQL下追加在线DDL选项：INPLACE算法，不锁表读写"""
+    if dialect.name == 'mysql':
+        return f'{statement}{separator}ALGORITHM=INPLACE{separator}LOCK=NONE'
+    return statement
+
+class AddColumn:
+    """按模型定义给已有表加列"""
+
+    def __init__(self, model, column):
+        self.table = model.__table__
+        self.column = self.table.c[column]
+
+    def __str__(self):
+        return f'ADD COLUMN {self.table.name}.{self.column.name}'
+
+    def applied(self, inspector):
+        return self.column.name in {c['name'] for c in inspector.get_columns(self.table.name)}
+
+    def apply(self, connection):
+        ddl = CreateColumn(self.column).compile(dialect=connection.dialect)
+        connection.exec_driver_sql(_online(
+            connection.dialect, f'ALTER TABLE {self.table.name} ADD COLUMN {ddl}', ', '))
+
+class AddIndex:
+    """按模型定义创建索引"""
+
+    def __init__(self, model, name):
+        self.table = model.__table__
+        self.index = next(index for index in self.table.indexes if index.name == name)
+
+    def __str__(self):
+        return f'CREATE INDEX {self.index.name}'
+
+    def applied(self, inspector):
+        return self.index.name in {i['name'] for i in inspector.get_indexes(self.table.name)}
+
+    def apply(self, connection):
+        ddl = str(CreateIndex(self.index).compile(dialect=connection.dialect))
+        connection.exec_driver_sql(_online(connection.dialect, ddl, ' '))
+
+class CreateTable:
+    """按模型定义建表（含索引）"""
+
+    def __init__(self, model):
+        self.table = model.__table__
+
+    def __str__(self):
+        return f'CREATE TABLE {self.table.name}'
+
+    def applied(self, inspector):
+        return inspector.has_table(self.table.name)
+
+    def apply(self, connection):
+        self.table.create(bind=connection)
+
+# 迁移列表：(版本号, 说明, 操作)。只能在末尾追加，已发布的版本不要修改
+MIGRATIONS = [
+    (1, '计数列（执行后运行 flask reconcile-counters 回填）', [
+        AddColumn(User, 'favorites_count'),
+        AddColumn(Singer, 'albums_count'),
+        AddColumn(Singer, 'songs_count'),
+        AddColumn(Album, 'songs_count'),
+        AddColumn(Song, 'favorite_count'),
+        AddColumn(Genre, 'songs_count'),
+        AddColumn(Playlist, 'songs_count'),
+    ]),
+    (2, '统计汇总表（执行后运行 flask backfill-rollups 回填）', [
+        CreateTable(StatsRollup),
+    ]),
+    (3, '热点查询的二级索引', [
+        AddIndex(Singer, 'ix_singers_name'),
+        AddIndex(Singer, 'ix_singers_nationality'),
+        AddIndex(Singer, 'ix_singers_created_at'),
+        AddIndex(Album, 'ix_albums_name'),
+        AddIndex(Album, 'ix_albums_singer_id'),
+        AddIndex(Album, 'ix_albums_created_at'),
+        AddIndex(Song, 'ix_songs_name'),
+        AddIndex(Song, 'ix_songs_singer_id'),
+        AddIndex(Song, 'ix_songs_album_id'),
+        AddIndex(Song, 'ix_songs_created_at'),
+        AddIndex(Favorite, 'ix_favorites_song_id'),
+        AddIndex(Favorite, 'ix_favorites_created_at'),
+        AddIndex(SongGenre, 'ix_song_genres_genre_song'),
+        AddIndex(Playlist, 'ix_playlists_user_id'),
+        AddIndex(PlaylistSong, 'ix_playlist_songs_playlist_order'),
+    ]),
+    (4, '数据版本表（HTTP缓存校验值）', [
+        CreateTable(DataVersion),
+    ]),
+    (5, '增量同步的变更日志', [
+        CreateTable(ChangeLog),
+    ]),
+]
+
+def applied_versions(connection):
+    schema_migrations.create(bind=connection, checkfirst=True)
+    return set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+def upgrade(log=print):
+    """依次执行尚未执行的迁移，返回本次执行的版本号列表
+
+    每个操作执行前先检查数据库中是否已存在（例如新库由create_all建出），
+    已存在则跳过，因此中途失败后可以直接重新执行。
+    """
+    engine = db.engine
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+
+    upgraded = []
+    for version, description, operations in MIGRATIONS:
+        if version in done:
+            continue
+        log(f'[{version}] {description}')
+        for operation in operations:
+            with engine.begin() as connection:
+                if operation.applied(inspect(connection)):
+                    log(f'    {operation}（已存在，跳过）')
+                    continue
+                log(f'    {operation}')
+                operation.apply(connection)
+        with engine.begin() as connection:
+            connection.execute(schema_migrations.insert().values(
+                version=version, description=description, applied_at=datetime.utcnow()))
+        upgraded.append(version)
+    return upgraded
@@ -1,8 +1,50 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone
+from sqlalchemy.types import Text, TypeDecorator
+import base64
+import os
+import zlib
+from replicas import RoutingSession
 
-# 创建独立的db实例
-db = SQLAlchemy()
+# 创建独立的db实例，会话按请求在主库和只读副本之间选择
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# 歌词压缩存储：开启后超过LYRICS_COMPRESS_MIN_BYTES字节的歌词压缩后写入
+LYRICS_COMPRESSION = os.getenv('LYRICS_COMPRESSION', '0') == '1'
+LYRICS_COMPRESS_MIN_BYTES = int(os.getenv('LYRICS_COMPRESS_MIN_BYTES', '512'))
+COMPRESSED_PREFIX = 'zlib:'
+
+class CompressedText(TypeDecorator):
+    """可压缩存储的长文本
+
+    enabled为True时，不短于min_bytes的文本以zlib压缩、base64编码并加上'zlib:'前缀后
+    写入TEXT列，压缩后反而更长时保持原文；读取时遇到前缀自动解压。未压缩的旧数据
+    照常读取，因此可以随时开启或关闭，已有数据用 flask compress-lyrics 改写。
+    """
+    impl = Text
+    cache_ok = True
+
+    def __init__(self, enabled=False, min_bytes=512):
+        super().__init__()
+        self.enabled = enabled
+        self.min_bytes = min_bytes
+
+    def process_bind_param(self, value, dialect):
+        if value is None or not self.enabled:
+            return value
+        raw = value.encode('utf-8')
+        if len(raw) < self.min_bytes:
+            return value
+        packed = COMPRESSED_PREFIX + base64.b64encode(zlib.compress(raw, 6)).decode('ascii')
+        return packed if len(packed) < len(raw) else value
+
+    def process_result_value(self, value, dialect):
+        if value and value.startswith(COMPRESSED_PREFIX):
+            try:
+                return zlib.decompress(base64.b64decode(value[len(COMPRESSED_PREFIX):], validate=True)).decode('utf-8')
+            except (ValueError, zlib.error):
+                return value  # 恰好以前缀开头的普通文本
+        return value
 
 class User(db.Model):
     """用户表"""
@@ -14,9 +56,10 @@ class User(db.Model):
     password = db.Column(db.String(255), nullable=False)
     avatar = db.Column(db.String(255), nullable=True)
     role = db.Column(db.String(20), default='user')
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=datetime.now(timezone.utc), 
-                           onupdate=datetime.now(timezone.utc))
+    favorites_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 收藏数，由counters模块维护
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), 
+                           onupdate=lambda: datetime.now(timezone.utc))
     
     # 关联关系
     favorites = db.relationship('Favorite', backref='user', lazy=True, cascade='all, delete-orphan')
@@ -29,7 +72,7 @@ class User(db.Model):
             'email': self.email,
             'avatar': self.avatar,
             'role': getattr(self, 'role', None),
-            'favorites_count': len(self.favorites) if self.favorites is not None else 0,
+            'favorites_count': self.favorites_count or 0,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -39,13 +82,15 @@ class Singer(db.Model):
     __tablename__ = 'singers'
     
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
     avatar = db.Column(db.String(255), nullable=True)
-    description = db.Column(db.Text, nullable=True)
+    description = db.deferred(db.Column(db.Text, nullable=True))  # 大字段，列表查询不加载
     birth_date = db.Column(db.Date, nullable=True)
-    nationality = db.Column(db.String(50), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
+    nationality = db.Column(db.String(50), nullable=True, index=True)
+    albums_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 专辑数，由counters模块维护
+    songs_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 歌曲数，由counters模块维护
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     
     # 关联关系
     albums = db.relationship('Album', backref='singer', lazy=True, cascade='all, delete-orphan')
@@ -59,8 +104,8 @@ class Singer(db.Model):
             'description': self.description,
             'birth_date': self.birth_date.isoformat() if self.birth_date else None,
             'nationality': self.nationality,
-            'albums_count': len(self.albums) if self.albums is not None else 0,
-            'songs_count': len(self.songs) if self.songs is not None else 0,
+            'albums_count': self.albums_count or 0,
+            'songs_count': self.songs_count or 0,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -70,14 +115,15 @@ class Album(db.Model):
     __tablename__ = 'albums'
     
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(200), nullable=False)
+    name = db.Column(db.String(200), nullable=False, index=True)
     cover = db.Column(db.String(255), nullable=True)
     description = db.Column(db.Text, nullable=True)
     release_date = db.Column(db.Date, nullable=True)
-    singer_id = db.Column(db.Integer, db.ForeignKey('singers.id'), nullable=False)  # 外键约束
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=datetime.now(timezone.utc), 
-                           onupdate=datetime.now(timezone.utc))
+    singer_id = db.Column(db.Integer, db.ForeignKey('singers.id'), nullable=False, index=True)  # 外键约束
+    songs_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 歌曲数，由counters模块维护
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), 
+                           onupdate=lambda: datetime.now(timezone.utc))
     
     # 关联关系
     songs = db.relationship('Song', backref='album', lazy=True, cascade='all, delete-orphan')
@@ -91,7 +137,7 @@ class Album(db.Model):
             'release_date': self.release_date.isoformat() if self.release_date else None,
             'singer_id': self.singer_id,
             'singer_name': self.singer.name if self.singer else None,
-            'songs_count': len(self.songs) if self.songs is not None else 0,
+            'songs_count': self.songs_count or 0,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -101,14 +147,15 @@ class Song(db.Model):
     __tablename__ = 'songs'
     
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(200), nullable=False)
+    name = db.Column(db.String(200), nullable=False, index=True)
     duration = db.Column(db.Integer, nullable=True)  # 时长（秒）
-    lyrics = db.Column(db.Text, nullable=True)
+    lyrics = db.deferred(db.Column(CompressedText(LYRICS_COMPRESSION, LYRICS_COMPRESS_MIN_BYTES), nullable=True))  # 大字段，列表查询不加载
     release_date = db.Column(db.Date, nullable=True)
-    singer_id = db.Column(db.Integer, db.ForeignKey('singers.id'), nullable=False)
-    album_id = db.Column(db.Integer, db.ForeignKey('albums.id'), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
+    singer_id = db.Column(db.Integer, db.ForeignKey('singers.id'), nullable=False, index=True)
+    album_id = db.Column(db.Integer, db.ForeignKey('albums.id'), nullable=True, index=True)
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 被收藏次数，由counters模块维护
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     
     # 关联关系
     favorites = db.relationship('Favorite', backref='song', lazy=True, cascade='all, delete-orphan')
@@ -129,7 +176,7 @@ class Song(db.Model):
             'singer_name': self.singer.name if self.singer else None,
             'album_id': self.album_id,
             'album_name': self.album.name if self.album else None,
-            'favorite_count': len(self.favorites) if self.favorites is not None else 0,
+            'favorite_count': self.favorite_count or 0,
             'genres': genres,  # 添加流派信息
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
@@ -141,8 +188,8 @@ class Favorite(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    song_id = db.Column(db.Integer, db.ForeignKey('songs.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    song_id = db.Column(db.Integer, db.ForeignKey('songs.id'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     
     # 确保用户和歌曲组合的唯一性
     __table_args__ = (db.UniqueConstraint('user_id', 'song_id', name='unique_user_song'),)
@@ -166,7 +213,8 @@ class Genre(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
     description = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    songs_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 歌曲数，由counters模块维护
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     
     # 关联关系
     songs = db.relationship('SongGenre', backref='genre', lazy=True)
@@ -176,7 +224,7 @@ class Genre(db.Model):
             'id': self.id,
             'name': self.name,
             'description': self.description,
-            'songs_count': len(self.songs) if self.songs is not None else 0,
+            'songs_count': self.songs_count or 0,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
@@ -187,10 +235,13 @@ class SongGenre(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     song_id = db.Column(db.Integer, db.ForeignKey('songs.id'), nullable=False)
     genre_id = db.Column(db.Integer, db.ForeignKey('genres.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     
-    # 确保歌曲和流派组合的唯一性
-    __table_args__ = (db.UniqueConstraint('song_id', 'genre_id', name='unique_song_genre'),)
+    # 确保歌曲和流派组合的唯一性；(genre_id, song_id) 索引用于按流派查歌曲
+    __table_args__ = (
+        db.UniqueConstraint('song_id', 'genre_id', name='unique_song_genre'),
+        db.Index('ix_song_genres_genre_song', 'genre_id', 'song_id'),
+    )
     
     def to_dict(self):
         return {
@@ -210,10 +261,11 @@ class Playlist(db.Model):
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=True)
     cover = db.Column(db.String(255), nullable=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     is_public = db.Column(db.Boolean, default=False)  # 是否公开
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
-    updated_at = db.Column(db.DateTime, default=datetime.now(timezone.utc), onupdate=datetime.now(timezone.utc))
+    songs_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # 歌曲数，由counters模块维护
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     
     # 关联关系
     playlist_songs = db.relationship('PlaylistSong', backref='playlist', lazy=True, cascade='all, delete-orphan')
@@ -227,7 +279,7 @@ class Playlist(db.Model):
             'user_id': self.user_id,
             'username': self.user.username if self.user else None,
             'is_public': self.is_public,
-            'songs_count': len(self.playlist_songs) if self.playlist_songs is not None else 0,
+            'songs_count': self.songs_count or 0,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -240,10 +292,13 @@ class PlaylistSong(db.Model):
     playlist_id = db.Column(db.Integer, db.ForeignKey('playlists.id'), nullable=False)
     song_id = db.Column(db.Integer, db.ForeignKey('songs.id'), nullable=False)
     order = db.Column(db.Integer, nullable=False)  # 歌曲在播放列表中的顺序
-    added_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    added_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     
-    # 确保播放列表和歌曲组合的唯一性
-    __table_args__ = (db.UniqueConstraint('playlist_id', 'song_id', name='unique_playlist_song'),)
+    # 确保播放列表和歌曲组合的唯一性；(playlist_id, order) 索引用于按顺序读取播放列表
+    __table_args__ = (
+        db.UniqueConstraint('playlist_id', 'song_id', name='unique_playlist_song'),
+        db.Index('ix_playlist_songs_playlist_order', 'playlist_id', 'order'),
+    )
     
     def to_dict(self):
         return {
@@ -253,5 +308,66 @@ class PlaylistSong(db.Model):
             'order': self.order,
             'song_name': self.song.name if self.song else None,
             'singer_name': self.song.singer.name if self.song and self.song.singer else None,
+            'album_name': self.song.album.name if self.song and self.song.album else None,
+            'duration': self.song.duration if self.song else None,
             'added_at': self.added_at.isoformat() if self.added_at else None
-        }
\ No newline at end of file
+        }
+
+class StatsRollup(db.Model):
+    """统计汇总表：按小时/天记录各类数据的新增数量，总数由天汇总求和"""
+    __tablename__ = 'stats_rollups'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    metric = db.Column(db.String(20), nullable=False)        # users/singers/albums/songs/favorites/playlists
+    granularity = db.Column(db.String(10), nullable=False)   # hour/day
+    bucket_start = db.Column(db.DateTime, nullable=False)    # 时间桶起点（UTC），没有创建时间的记录计入1970-01-01
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    # 唯一约束同时作为 (metric, granularity, bucket_start) 范围查询的索引
+    __table_args__ = (db.UniqueConstraint('metric', 'granularity', 'bucket_start', name='unique_rollup_bucket'),)
+    
+    def to_dict(self):
+        return {
+            'metric': self.metric,
+            'granularity': self.granularity,
+            'bucket_start': self.bucket_start.isoformat() if self.bucket_start else None,
+            'count': self.count
+        }
+
+class DataVersion(db.Model):
+    """数据版本表：每张业务表分散为若干行（见versions.VERSION_SHARDS），表中数据每次变化时其中一行加1，
+    各行之和用于生成HTTP缓存校验值"""
+    __tablename__ = 'data_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)       # 表名，或 表名#分片号
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False)     # 最近一次变化的时间（UTC）
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'version': self.version,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class ChangeLog(db.Model):
+    """变更日志：歌曲、专辑、歌手的新增、修改、删除记录，供客户端增量同步
+
+    删除的记录在这里保留一条delete（墓碑），客户端据此删除本地数据。
+    """
+    __tablename__ = 'change_log'
+    
+    id = db.Column(db.Integer, primary_key=True)                 # 单调递增，作为同步位置
+    table_name = db.Column(db.String(20), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)                # upsert/delete
+    created_at = db.Column(db.DateTime, nullable=False, index=True)  # 按时间清理过期日志
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'table_name': self.table_name,
+            'row_id': self.row_id,
+            'op': self.op,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
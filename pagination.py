@@ -0,0 +1,62 @@
+import base64
+import json
+from datetime import date, datetime
+from sqlalchemy import and_, or_
+
+# 分页参数
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+class InvalidCursor(ValueError):
+    """分页游标无法解析"""
+
+def encode_cursor(sort_value, last_id):
+    """把(排序键, id)编码为不透明的游标字符串"""
+    if isinstance(sort_value, (date, datetime)):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, last_id], ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, sort_column):
+    """解析游标，按排序列的类型还原排序键"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, last_id = json.loads(raw)
+        python_type = sort_column.type.python_type
+        if python_type is datetime:
+            sort_value = datetime.fromisoformat(sort_value)
+        elif python_type is date:
+            sort_value = date.fromisoformat(sort_value)
+        return sort_value, int(last_id)
+    except (ValueError, TypeError, NotImplementedError):
+        raise InvalidCursor(cursor)
+
+def keyset_page(query, sort_column, id_column, limit, cursor=None, descending=False):
+    """按(sort_column, id)做键集分页，返回(当前页对象列表, 下一页游标)
+
+    与OFFSET不同，翻到第几页都只需要从上一页最后一行在索引上继续扫描limit+1行。
+    """
+    same_column = sort_column is id_column
+    if cursor:
+        sort_value, last_id = decode_cursor(cursor, sort_column)
+        if same_column:
+            condition = id_column < last_id if descending else id_column > last_id
+        elif descending:
+            condition = or_(sort_column < sort_value,
+                            and_(sort_column == sort_value, id_column < last_id))
+        else:
+            condition = or_(sort_column > sort_value,
+                            and_(sort_column == sort_value, id_column > last_id))
+        query = query.filter(condition)
+
+    columns = (id_column,) if same_column else (sort_column, id_column)
+    query = query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+
+    # 多取一行用于判断是否还有下一页
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
@@ -0,0 +1,29 @@
+import time
+
+# 对比的列表接口：默认字段不含歌词、简介等延迟加载的大字段，fields=*时包括全部字段
+ROUTES = [
+    '/api/songs?limit={limit}',
+    '/api/singers?limit={limit}',
+    '/api/albums?limit={limit}',
+    '/api/favorites?limit={limit}',
+]
+
+def _measure(client, url, repeat):
+    """返回(响应字节数, 平均耗时毫秒)，先请求一次预热"""
+    client.get(url)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        response = client.get(url)
+    return len(response.get_data()), (time.perf_counter() - started) / repeat * 1000
+
+def run_payload_report(app, limit=200, repeat=5):
+    """逐个请求ROUTES，返回[(url, 默认字节数, 默认毫秒, 全部字段字节数, 全部字段毫秒), ...]"""
+    report = []
+    client = app.test_client()
+    with app.app_context():
+        for template in ROUTES:
+            url = template.format(limit=limit)
+            size, elapsed = _measure(client, url, repeat)
+            full_size, full_elapsed = _measure(client, url + '&fields=*', repeat)
+            report.append((url, size, elapsed, full_size, full_elapsed))
+    return report
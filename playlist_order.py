@@ -0,0 +1,126 @@
+import os
+from sqlalchemy import bindparam, func, select
+from models import db, PlaylistSong
+import versions
+
+# 播放列表排序配置：order列保存稀疏的排序值，相邻歌曲之间留有间隔，
+# 插入和移动只需给一条记录取相邻两值的中间值
+RANK_GAP = int(os.getenv('PLAYLIST_RANK_GAP', '1024'))          # 重新编号和追加时的间隔
+RANK_MIN_GAP = int(os.getenv('PLAYLIST_RANK_MIN_GAP', '8'))     # 后台重新编号的阈值，相邻间隔小于此值的播放列表
+REBALANCE_SCAN_BATCH_SIZE = 10000
+
+class InvalidPosition(ValueError):
+    """插入/移动位置参数不正确，或参照的歌曲不在播放列表中"""
+
+def parse_anchor(data):
+    """从请求体中取出位置参数：position（从0开始的序号）、after_song_id或before_song_id，至多一个
+
+    都没有时返回None，表示追加到末尾。
+    """
+    given = [key for key in ('position', 'after_song_id', 'before_song_id') if data.get(key) is not None]
+    if not given:
+        return None
+    if len(given) > 1:
+        raise InvalidPosition('position、after_song_id、before_song_id只能指定一个')
+    key = given[0]
+    value = data[key]
+    if isinstance(value, bool) or not isinstance(value, int) or (key == 'position' and value < 0):
+        raise InvalidPosition(f'{key}应为非负整数' if key == 'position' else f'{key}应为整数')
+    return key, value
+
+def _ordered(playlist_id, moving_song_id):
+    """播放列表中除正在移动的歌曲外的记录，按(order, id)排列，走(playlist_id, order)索引"""
+    query = db.session.query(PlaylistSong.order).filter(PlaylistSong.playlist_id == playlist_id)
+    if moving_song_id is not None:
+        query = query.filter(PlaylistSong.song_id != moving_song_id)
+    return query
+
+def _rank_of(playlist_id, song_id):
+    rank = db.session.query(PlaylistSong.order)\
+        .filter_by(playlist_id=playlist_id, song_id=song_id).scalar()
+    if rank is None:
+        raise InvalidPosition(f'歌曲不在播放列表中: {song_id}')
+    return rank
+
+def _bounds(playlist_id, anchor, moving_song_id):
+    """目标位置前后两首歌曲的排序值，没有时为None
+
+    after_song_id、before_song_id和追加各需一到两次索引查找，position需要在索引上跳过前面的记录。
+
+    排序值相同的记录按id区分先后，查找时把相同的值也算作相邻值，
+    这样遇到相同值时不会有空隙，会先重新编号。
+    """
+    ordered = _ordered(playlist_id, moving_song_id)
+    if anchor is None:
+        return ordered.with_entities(func.max(PlaylistSong.order)).scalar(), None
+    key, value = anchor
+    if key == 'after_song_id':
+        before = _rank_of(playlist_id, value)
+        after = ordered.filter(PlaylistSong.order >= before, PlaylistSong.song_id != value)\
+            .with_entities(func.min(PlaylistSong.order)).scalar()
+        return before, after
+    if key == 'before_song_id':
+        after = _rank_of(playlist_id, value)
+        before = ordered.filter(PlaylistSong.order <= after, PlaylistSong.song_id != value)\
+            .with_entities(func.max(PlaylistSong.order)).scalar()
+        return before, after
+    if value == 0:
+        return None, ordered.with_entities(func.min(PlaylistSong.order)).scalar()
+    ranks = [rank for rank, in ordered.order_by(PlaylistSong.order, PlaylistSong.id)
+             .offset(value - 1).limit(2)]
+    if not ranks:
+        return ordered.with_entities(func.max(PlaylistSong.order)).scalar(), None
+    return ranks[0], ranks[1] if len(ranks) > 1 else None
+
+def _between(before, after):
+    """两个排序值之间的新值，没有空隙时返回None"""
+    if before is None and after is None:
+        return RANK_GAP
+    if after is None:
+        return before + RANK_GAP
+    if before is None:
+        return after - RANK_GAP
+    if after - before >= 2:
+        return (before + after) // 2
+    return None
+
+def rebalance(playlist_id):
+    """按当前顺序把播放列表的排序值重新编号为RANK_GAP的倍数，返回记录数"""
+    table = PlaylistSong.__table__
+    connection = db.session.connection()
+    ids = connection.execute(
+        select(table.c.id).where(table.c.playlist_id == playlist_id).order_by(table.c.order, table.c.id)
+    ).scalars().all()
+    if ids:
+        connection.execute(
+            table.update().where(table.c.id == bindparam('b_id')).values(order=bindparam('v_order')),
+            [{'b_id': row_id, 'v_order': (i + 1) * RANK_GAP} for i, row_id in enumerate(ids)]
+        )
+        versions.defer_bump(db.session, {table.name})
+    return len(ids)
+
+def rank_for(playlist_id, anchor=None, moving_song_id=None):
+    """目标位置的新排序值；相邻值之间没有空隙时先把整个播放列表重新编号
+
+    moving_song_id为正在移动的歌曲，计算位置时不计入。
+    """
+    db.session.flush()
+    rank = _between(*_bounds(playlist_id, anchor, moving_song_id))
+    if rank is None:
+        rebalance(playlist_id)
+        db.session.expire_all()
+        rank = _between(*_bounds(playlist_id, anchor, moving_song_id))
+    return rank
+
+def crowded_playlists(min_gap=RANK_MIN_GAP):
+    """相邻排序值间隔小于min_gap（含相同值）的播放列表id，按(playlist_id, order)索引顺序扫描一遍"""
+    crowded = []
+    last_playlist, last_rank = None, None
+    rows = db.session.query(PlaylistSong.playlist_id, PlaylistSong.order)\
+        .order_by(PlaylistSong.playlist_id, PlaylistSong.order).yield_per(REBALANCE_SCAN_BATCH_SIZE)
+    for playlist_id, rank in rows:
+        if playlist_id == last_playlist and rank - last_rank < min_gap \
+                and (not crowded or crowded[-1] != playlist_id):
+            crowded.append(playlist_id)
+        last_playlist, last_rank = playlist_id, rank
+    return crowded
@@ -0,0 +1,73 @@
+from sqlalchemy import event
+from models import db, User, Singer, Album, Song, Playlist
+
+# 列表接口：{n}为返回的行数，分别以SMALL_LIMIT和LARGE_LIMIT请求，语句数应相同。
+# {user}/{singer}/... 替换为关联记录最多的id，使较大的limit确实能取到更多行。
+# 不分页的完整列表与分页列表使用同一套按列序列化代码，这里检查分页形式。
+ROUTES = [
+    '/api/singers?limit={n}',
+    '/api/singers?limit={n}&sort=name',
+    '/api/albums?limit={n}',
+    '/api/albums?singer_id={singer}&limit={n}',
+    '/api/songs?limit={n}',
+    '/api/songs?limit={n}&fields=id,name,singer_name,album_name,genres',
+    '/api/songs?limit={n}&sort=created_at&order=desc',
+    '/api/songs?singer_id={singer}&limit={n}',
+    '/api/songs?album_id={album}&limit={n}',
+    '/api/favorites?limit={n}',
+    '/api/favorites?user_id={user}&limit={n}',
+    '/api/playlists/{playlist}/songs?limit={n}',
+    '/api/songs/{song}/similar?limit={n}',
+]
+
+SMALL_LIMIT = 1
+LARGE_LIMIT = 50
+
+def _busiest_ids():
+    """各类记录中关联记录最多的id，按计数列选取"""
+    ids = {}
+    for name, model, column in (('user', User, User.favorites_count), ('singer', Singer, Singer.songs_count),
+                                ('album', Album, Album.songs_count), ('song', Song, Song.favorite_count),
+                                ('playlist', Playlist, Playlist.songs_count)):
+        ids[name] = db.session.query(model.id).order_by(column.desc(), model.id).limit(1).scalar() or 1
+    return ids
+
+def _items(data):
+    """响应中的记录数：列表本身或分页结果的items"""
+    if isinstance(data, dict):
+        data = data.get('items')
+    return len(data) if isinstance(data, list) else 0
+
+def _measure(client, url):
+    """请求url，返回(执行的SQL语句数, 返回的记录数)"""
+    count = 0
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        nonlocal count
+        count += 1
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return count, _items(response.get_json(silent=True))
+
+def run_query_count_check(app):
+    """逐个以较小和较大的limit请求ROUTES，返回[(url, 小请求(语句数, 行数), 大请求(语句数, 行数)), ...]
+
+    每个请求先预热一次（内存索引、排行榜的首次构建不计入）。调用方据此判断：
+    两次返回的行数不同而语句数增加，说明有按行发出的查询（N+1）。
+    """
+    results = []
+    client = app.test_client()
+    with app.app_context():
+        ids = _busiest_ids()
+        for template in ROUTES:
+            measured = []
+            for limit in (SMALL_LIMIT, LARGE_LIMIT):
+                url = template.format(n=limit, **ids)
+                client.get(url)
+                measured.append(_measure(client, url))
+            results.append((template.format(n='N', **ids), *measured))
+    return results
@@ -0,0 +1,272 @@
+import os
+import threading
+import time
+import numpy as np
+from models import db, Song, SongGenre, Favorite
+from similar import neighbor_table
+
+# 推荐配置
+RECOMMEND_COUNT = 10
+RECOMMEND_MAX_AGE = int(os.getenv('RECOMMEND_MAX_AGE', '300'))  # 秒，超过后后台重建
+RECOMMEND_MIN_REBUILD_INTERVAL = int(os.getenv('RECOMMEND_MIN_REBUILD_INTERVAL', '60'))  # 秒，标记过期后距上次构建至少间隔这么久才重建
+BUILD_BATCH_SIZE = 10000
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+def _gather(indptr, values, rows):
+    """按CSR结构取出多行的值并拼接：values[indptr[r]:indptr[r+1]] for r in rows"""
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    total = int(lengths.sum())
+    if not total:
+        return _EMPTY
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return values[offsets + np.arange(total)]
+
+def _rank(values):
+    """按出现次数降序、id升序排列去重后的值"""
+    unique, counts = np.unique(values, return_counts=True)
+    return unique[np.lexsort((unique, -counts))]
+
+def _take(pool, excluded, k):
+    """取候选池中前k个不在excluded（有序数组）里的歌曲
+
+    被排除的最多len(excluded)个，所以只需要检查池子的前k+len(excluded)项。
+    """
+    head = pool[:k + len(excluded)]
+    return head[~np.isin(head, excluded, assume_unique=True)][:k]
+
+def _similar_candidates(favs, k):
+    """把用户收藏的各首歌曲的相似歌曲按相似度求和，取得分最高的k首（排除已收藏）"""
+    song_ids, indptr, neighbors, scores = neighbor_table.data
+    rows = np.searchsorted(song_ids, np.intersect1d(favs, song_ids, assume_unique=True))
+    if not len(rows) or k <= 0:
+        return _EMPTY
+    candidates, inverse = np.unique(_gather(indptr, neighbors, rows), return_inverse=True)
+    totals = np.bincount(inverse, weights=_gather(indptr, scores, rows))
+    keep = ~np.isin(candidates, favs, assume_unique=True)
+    candidates, totals = candidates[keep], totals[keep]
+    return candidates[np.lexsort((candidates, -totals))][:k]
+
+def _csr(keys, values):
+    """把按keys排好序的(keys, values)对压缩为{key: values数组}"""
+    if not len(keys):
+        return {}
+    bounds = np.flatnonzero(np.diff(keys)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(keys)]))
+    return {int(keys[s]): values[s:e] for s, e in zip(starts, ends)}
+
+def _without(pools, keys, song_id):
+    """复制候选池字典，并从keys对应的池中去掉song_id（不修改原快照）"""
+    pools = dict(pools)
+    for key in keys:
+        if key in pools:
+            pools[key] = pools[key][pools[key] != song_id]
+    return pools
+
+class _Snapshot:
+    """一次全量构建得到的只读数据"""
+
+    def __init__(self):
+        self.song_ids = _EMPTY          # 全部歌曲id（升序）
+        self.song_singer = _EMPTY       # 与song_ids对齐的歌手id
+        self.genre_indptr = np.zeros(1, dtype=np.int64)  # 歌曲 -> 流派 的CSR
+        self.genre_values = _EMPTY
+        self.newest = _EMPTY            # 按创建时间倒序的歌曲id
+        self.genre_pool = {}            # 流派id -> 歌曲id（升序）
+        self.singer_pool = {}           # 歌手id -> 歌曲id（升序）
+
+class Recommender:
+    """预计算的个性化推荐引擎
+
+    启动时把歌曲、流派、歌手和收藏表加载为紧凑的NumPy数组：每个流派/歌手的
+    候选池、按时间倒序的最新歌曲，以及每个用户的收藏集合和由此算出的
+    用户×流派、用户×歌手偏好排名。请求时只做数组运算，不访问数据库。
+    推荐规则与原先逐条查询的实现一致：
+      1. 收藏最多的流派中取5首；
+      2. 收藏最多的3位歌手各取3首；
+      3. 不足10首时，从排名第2、3的流派各取2首；
+      4. 仍不足时，按相似歌曲表（见similar.py）给出"收藏了这些歌的人也收藏了"的歌曲；
+      5. 仍不足时用最新歌曲补齐。
+    各步骤都排除用户已收藏的歌曲，同分时按id升序。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._snapshot = _Snapshot()
+        self.user_favorites = {}   # 用户id -> 收藏的歌曲id（升序）
+        self.user_genres = {}      # 用户id -> 按偏好排序的流派id
+        self.user_singers = {}     # 用户id -> 偏好最高的3位歌手id
+        self.built_at = None
+        self._stale = False
+        self._rebuilding = False
+
+    # ---------- 构建 ----------
+    def build(self):
+        """从数据库全量构建"""
+        snap = _Snapshot()
+
+        songs = np.array(
+            [(song_id, singer_id, created_at.timestamp() if created_at else -np.inf)
+             for song_id, singer_id, created_at in db.session.query(Song.id, Song.singer_id, Song.created_at)
+             .order_by(Song.id).yield_per(BUILD_BATCH_SIZE)],
+            dtype=np.float64
+        ).reshape(-1, 3)
+        snap.song_ids = songs[:, 0].astype(np.int64)
+        snap.song_singer = songs[:, 1].astype(np.int64)
+        snap.newest = snap.song_ids[np.lexsort((-snap.song_ids, -songs[:, 2]))]
+        order = np.argsort(snap.song_singer, kind='stable')
+        snap.singer_pool = _csr(snap.song_singer[order], snap.song_ids[order])
+
+        pairs = np.array(
+            db.session.query(SongGenre.song_id, SongGenre.genre_id)
+            .order_by(SongGenre.song_id, SongGenre.genre_id).yield_per(BUILD_BATCH_SIZE).all(),
+            dtype=np.int64
+        ).reshape(-1, 2)
+        song_index = np.searchsorted(snap.song_ids, pairs[:, 0])
+        snap.genre_indptr = np.concatenate(([0], np.cumsum(np.bincount(song_index, minlength=len(snap.song_ids)))))
+        snap.genre_values = pairs[:, 1]
+        order = np.lexsort((pairs[:, 0], pairs[:, 1]))
+        snap.genre_pool = _csr(pairs[order, 1], pairs[order, 0])
+
+        favorites = np.array(
+            db.session.query(Favorite.user_id, Favorite.song_id)
+            .order_by(Favorite.user_id, Favorite.song_id).yield_per(BUILD_BATCH_SIZE).all(),
+            dtype=np.int64
+        ).reshape(-1, 2)
+        user_favorites = _csr(favorites[:, 0], favorites[:, 1])
+
+        user_genres, user_singers = {}, {}
+        for user_id, favs in user_favorites.items():
+            user_genres[user_id], user_singers[user_id] = self._affinity(snap, favs)
+
+        with self._lock:
+            self._snapshot = snap
+            self.user_favorites = user_favorites
+            self.user_genres = user_genres
+            self.user_singers = user_singers
+            self.built_at = time.time()
+            self._stale = False
+
+    @staticmethod
+    def _affinity(snap, favs):
+        """计算用户的流派偏好排名和前3位歌手"""
+        # 忽略快照中不存在的歌曲（构建之后新增的）
+        index = np.searchsorted(snap.song_ids, np.intersect1d(favs, snap.song_ids, assume_unique=True))
+        genres = _rank(_gather(snap.genre_indptr, snap.genre_values, index))
+        singers = _rank(snap.song_singer[index])[:3]
+        return genres, singers
+
+    # ---------- 增量维护 ----------
+    def add_favorite(self, user_id, song_id):
+        self._update_favorites(user_id, lambda favs: np.union1d(favs, [song_id]))
+
+    def add_favorites(self, user_id, song_ids):
+        """批量收藏后一次更新用户的收藏和偏好"""
+        self._update_favorites(user_id, lambda favs: np.union1d(favs, song_ids))
+
+    def remove_favorite(self, user_id, song_id):
+        self._update_favorites(user_id, lambda favs: favs[favs != song_id])
+
+    def remove_user(self, user_id):
+        with self._lock:
+            self.user_favorites.pop(user_id, None)
+            self.user_genres.pop(user_id, None)
+            self.user_singers.pop(user_id, None)
+
+    def _update_favorites(self, user_id, change):
+        if not self.ready:
+            return
+        with self._lock:
+            favs = change(self.user_favorites.get(user_id, _EMPTY)).astype(np.int64)
+            self.user_favorites[user_id] = favs
+            self.user_genres[user_id], self.user_singers[user_id] = self._affinity(self._snapshot, favs)
+
+    def remove_song(self, song_id):
+        """删除歌曲后立即从最新歌曲和所属歌手、流派的候选池中去掉，不必等待重建"""
+        if not self.ready:
+            return
+        with self._lock:
+            old = self._snapshot
+            snap = _Snapshot()
+            snap.__dict__.update(old.__dict__)
+            snap.newest = old.newest[old.newest != song_id]
+            row = np.searchsorted(old.song_ids, song_id)
+            if row < len(old.song_ids) and old.song_ids[row] == song_id:
+                snap.singer_pool = _without(old.singer_pool, [int(old.song_singer[row])], song_id)
+                genre_ids = old.genre_values[old.genre_indptr[row]:old.genre_indptr[row + 1]].tolist()
+                snap.genre_pool = _without(old.genre_pool, genre_ids, song_id)
+            self._snapshot = snap
+
+    def invalidate(self):
+        """歌曲目录（歌曲、流派关联）变化后标记为过期，距上次构建满RECOMMEND_MIN_REBUILD_INTERVAL秒后在后台重建
+
+        编辑连续保存多首歌曲时合并为一次重建，不会每次保存都全量加载收藏表。
+        """
+        self._stale = True
+
+    @property
+    def ready(self):
+        return self.built_at is not None
+
+    def ensure_built(self, app):
+        """首次使用时同步构建；过期后在后台线程重建，重建期间继续使用旧数据"""
+        if not self.ready:
+            with self._lock:
+                if not self.ready:
+                    self.build()
+        age = time.time() - self.built_at
+        expired = (self._stale and age >= RECOMMEND_MIN_REBUILD_INTERVAL) or age > RECOMMEND_MAX_AGE
+        if expired and not self._rebuilding:
+            self._rebuilding = True
+            threading.Thread(target=self._background_rebuild, args=(app,), daemon=True).start()
+
+    def _background_rebuild(self, app):
+        try:
+            with app.app_context():
+                self.build()
+                db.session.remove()
+        finally:
+            self._rebuilding = False
+
+    # ---------- 推荐 ----------
+    def recommend(self, user_id, count=RECOMMEND_COUNT):
+        """返回推荐歌曲id列表"""
+        with self._lock:
+            snap = self._snapshot
+            favs = self.user_favorites.get(user_id, _EMPTY)
+            genres = self.user_genres.get(user_id, _EMPTY)
+            singers = self.user_singers.get(user_id, _EMPTY)
+
+        if not len(favs):
+            # 没有收藏时返回最新歌曲
+            return snap.newest[:count].tolist()
+
+        recommended = []
+        seen = set()
+
+        def extend(song_ids, cap=None):
+            for song_id in song_ids.tolist():
+                if cap is not None and len(recommended) >= cap:
+                    break
+                if song_id not in seen:
+                    seen.add(song_id)
+                    recommended.append(song_id)
+
+        if len(genres):
+            extend(_take(snap.genre_pool.get(int(genres[0]), _EMPTY), favs, 5))
+        for singer_id in singers.tolist():
+            extend(_take(snap.singer_pool.get(singer_id, _EMPTY), favs, 3))
+        if len(recommended) < count:
+            for genre_id in genres[1:3].tolist():
+                extend(_take(snap.genre_pool.get(genre_id, _EMPTY), favs, 2), cap=count)
+        if len(recommended) < count:
+            extend(_similar_candidates(favs, count), cap=count)
+        if len(recommended) < count:
+            extend(_take(snap.newest, favs, count - len(recommended)))
+
+        return recommended[:count]
+
+# 进程内的全局推荐引擎
+recommender = Recommender()
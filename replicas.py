@@ -0,0 +1,131 @@
+import itertools
+import os
+import threading
+import time
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+
+# 只读副本配置
+READ_YOUR_WRITES_SECONDS = int(os.getenv('DB_READ_YOUR_WRITES_SECONDS', '5'))  # 写操作后同一客户端读主库的时长
+REPLICA_MAX_LAG_SECONDS = int(os.getenv('DB_REPLICA_MAX_LAG', '5'))        # 预计的最大复制延迟
+REPLICA_RETRY_SECONDS = int(os.getenv('DB_REPLICA_RETRY_SECONDS', '30'))   # 出错的副本多久后重新尝试
+REPLICA_CHECK_SECONDS = int(os.getenv('DB_REPLICA_CHECK_SECONDS', '10'))   # 健康检查间隔
+REPLICA_BIND_PREFIX = 'replica'
+PRIMARY_COOKIE = 'db_primary_until'
+
+def replica_binds(hosts, username, password, port, name):
+    """把逗号分隔的 host[:port] 列表转换为SQLALCHEMY_BINDS配置"""
+    binds = {}
+    for i, host in enumerate(h.strip() for h in hosts.split(',') if h.strip()):
+        host, _, host_port = host.partition(':')
+        binds[f'{REPLICA_BIND_PREFIX}{i}'] = f'mysql://{username}:{password}@{host}:{host_port or port}/{name}'
+    return binds
+
+class ReplicaSet:
+    """轮流选择健康的只读副本
+
+    副本连接出错（连不上、连接断开）后标记为不可用，REPLICA_RETRY_SECONDS秒内不再选用；
+    每个副本最多每REPLICA_CHECK_SECONDS秒执行一次SELECT 1检查。没有可用副本时读主库。
+    状态按进程保存。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rotation = itertools.count()
+        self._down_until = {}
+        self._checked_at = {}
+        self._listening = set()
+
+    def mark_down(self, key):
+        with self._lock:
+            self._down_until[key] = time.monotonic() + REPLICA_RETRY_SECONDS
+
+    def _listen(self, key, engine):
+        if key in self._listening:
+            return
+        self._listening.add(key)
+
+        @event.listens_for(engine, 'handle_error')
+        def replica_error(context):
+            if context.is_disconnect or context.connection is None:
+                self.mark_down(key)
+
+    def _healthy(self, key, engine):
+        now = time.monotonic()
+        if self._down_until.get(key, 0) > now:
+            return False
+        if now - self._checked_at.get(key, -REPLICA_CHECK_SECONDS) < REPLICA_CHECK_SECONDS:
+            return True
+        self._checked_at[key] = now
+        try:
+            with engine.connect() as connection:
+                connection.exec_driver_sql('SELECT 1')
+        except DBAPIError:
+            self.mark_down(key)
+            return False
+        return True
+
+    def choose(self, engines):
+        """返回一个可用副本的(bind key, engine)，都不可用时返回(None, None)"""
+        keys = sorted(key for key in engines if key and key.startswith(REPLICA_BIND_PREFIX))
+        if not keys:
+            return None, None
+        start = next(self._rotation)
+        for i in range(len(keys)):
+            key = keys[(start + i) % len(keys)]
+            self._listen(key, engines[key])
+            if self._healthy(key, engines[key]):
+                return key, engines[key]
+        return None, None
+
+    def status(self, engines):
+        now = time.monotonic()
+        keys = sorted(key for key in engines if key and key.startswith(REPLICA_BIND_PREFIX))
+        return {key: 'down' if self._down_until.get(key, 0) > now else 'up' for key in keys}
+
+replica_set = ReplicaSet()
+_last_write = 0.0  # 本进程最近一次写请求完成的时间
+
+class RoutingSession(Session):
+    """按请求选择数据库：标记为只读的请求读副本，写入、flush及请求之外的操作用主库
+
+    同一请求内固定使用一个副本，结果之间保持一致。
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and has_request_context() and g.get('read_replica')
+                and not self._flushing and not (self.new or self.dirty or self.deleted)):
+            if 'replica_engine' not in g:
+                g.replica_key, g.replica_engine = replica_set.choose(self._db.engines)
+            if g.replica_engine is not None:
+                return g.replica_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def route_reads():
+    """before_request：GET/HEAD请求读副本，除非客户端刚刚写过（读自己的写）"""
+    if request.method not in ('GET', 'HEAD'):
+        return
+    try:
+        primary_until = float(request.cookies.get(PRIMARY_COOKIE, 0))
+    except ValueError:
+        primary_until = 0
+    g.read_replica = primary_until < time.time()
+
+def remember_write(response):
+    """after_request：写请求成功后，让该客户端在READ_YOUR_WRITES_SECONDS秒内读主库"""
+    global _last_write
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+        _last_write = time.time()
+        if READ_YOUR_WRITES_SECONDS > 0:
+            response.set_cookie(PRIMARY_COOKIE, str(_last_write + READ_YOUR_WRITES_SECONDS),
+                                max_age=READ_YOUR_WRITES_SECONDS, httponly=True, samesite='Lax')
+    return response
+
+def served_by_replica():
+    return has_request_context() and g.get('replica_engine') is not None
+
+def may_be_stale():
+    """当前请求读的是副本，并且本进程刚有过写入、副本可能尚未同步"""
+    return served_by_replica() and time.time() - _last_write < REPLICA_MAX_LAG_SECONDS
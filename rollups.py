@@ -0,0 +1,126 @@
+from collections import Counter
+from datetime import datetime, timezone
+from sqlalchemy import case, event, func, select
+from sqlalchemy.orm import Session
+from models import db, User, Singer, Album, Song, Favorite, Playlist, StatsRollup
+
+# 需要汇总的数据：指标名 -> 模型
+METRICS = {
+    'users': User,
+    'singers': Singer,
+    'albums': Album,
+    'songs': Song,
+    'favorites': Favorite,
+    'playlists': Playlist,
+}
+GRANULARITIES = ('hour', 'day')
+UNKNOWN_BUCKET = datetime(1970, 1, 1)  # 没有created_at的记录计入的时间桶
+BACKFILL_BATCH_SIZE = 10000
+
+def bucket_start(moment, granularity):
+    """把时间截断到所在小时/天的起点，统一为不带时区的UTC时间"""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _upsert_statement(connection, rows):
+    """生成 INSERT ... ON DUPLICATE KEY UPDATE count = count + 增量 的语句"""
+    table = StatsRollup.__table__
+    if connection.dialect.name == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table).values(rows)
+        return statement.on_duplicate_key_update(count=table.c.count + statement.inserted['count'])
+    from sqlalchemy.dialects.sqlite import insert
+    statement = insert(table).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=['metric', 'granularity', 'bucket_start'],
+        set_={'count': table.c.count + statement.excluded['count']}
+    )
+
+@event.listens_for(Session, 'after_flush')
+def apply_rollup_deltas(session, flush_context):
+    """在同一事务中按本次flush新增、删除的记录更新小时/天汇总"""
+    deltas = Counter()  # (指标, 粒度, 时间桶) -> 增量
+    for objects, sign in ((session.new, 1), (session.deleted, -1)):
+        for obj in objects:
+            for metric, model in METRICS.items():
+                if isinstance(obj, model):
+                    add_delta(deltas, metric, obj.created_at, sign)
+    apply_deltas(session.connection(), deltas)
+
+def add_delta(deltas, metric, created_at, sign=1):
+    """把created_at为指定时间的记录计入deltas的小时/天时间桶，sign为增加（负数为减少）的条数
+
+    不维护单独的总数行：所有写入都更新同一行会在该行的锁上串行，总数由天汇总求和得到。
+    """
+    for granularity in GRANULARITIES:
+        deltas[metric, granularity, bucket_start(created_at or UNKNOWN_BUCKET, granularity)] += sign
+
+def apply_deltas(connection, deltas):
+    """按{(指标, 粒度, 时间桶): 增量}更新汇总表，批量导入等绕过ORM的写入也使用此函数"""
+    rows = [{'metric': metric, 'granularity': granularity, 'bucket_start': bucket, 'count': delta}
+            for (metric, granularity, bucket), delta in sorted(deltas.items()) if delta]
+    if rows:
+        connection.execute(_upsert_statement(connection, rows))
+
+def backfill_rollups():
+    """从业务表重新计算全部汇总数据，返回{指标: 行数}
+
+    逐个指标流式读取created_at并在内存中按小时/天计数，再整体替换该指标的汇总行。
+    """
+    report = {}
+    for metric, model in METRICS.items():
+        buckets = Counter()
+        total = 0
+        for (created_at,) in db.session.query(model.created_at).yield_per(BACKFILL_BATCH_SIZE):
+            total += 1
+            for granularity in GRANULARITIES:
+                buckets[granularity, bucket_start(created_at or UNKNOWN_BUCKET, granularity)] += 1
+
+        StatsRollup.query.filter_by(metric=metric).delete()
+        rows = [{'metric': metric, 'granularity': granularity, 'bucket_start': bucket, 'count': count}
+                 for (granularity, bucket), count in sorted(buckets.items())]
+        for start in range(0, len(rows), BACKFILL_BATCH_SIZE):
+            db.session.execute(StatsRollup.__table__.insert(), rows[start:start + BACKFILL_BATCH_SIZE])
+        db.session.commit()
+        report[metric] = total
+    return report
+
+def query_series(metrics, granularity, start, end):
+    """一次范围扫描取出[start, end)内各指标的时间序列
+
+    返回{指标: {时间桶: 数量}}，没有数据的时间桶不出现在结果中。
+    """
+    rows = db.session.execute(
+        select(StatsRollup.metric, StatsRollup.bucket_start, StatsRollup.count)
+        .where(StatsRollup.metric.in_(metrics))
+        .where(StatsRollup.granularity == granularity)
+        .where(StatsRollup.bucket_start >= start)
+        .where(StatsRollup.bucket_start < end)
+    ).all()
+    series = {metric: {} for metric in metrics}
+    for metric, bucket, count in rows:
+        series[metric][bucket] = count
+    return series
+
+def query_overview(day):
+    """一次查询取出各指标总数和指定日期的新增数，返回({指标: 总数}, {指标: 当日新增})
+
+    总数为该指标全部天汇总行之和，只扫描唯一索引中(指标, 'day')的范围，每个指标每天一行。
+    """
+    today = bucket_start(day, 'day')
+    rows = db.session.execute(
+        select(StatsRollup.metric, func.sum(StatsRollup.count),
+               func.sum(case((StatsRollup.bucket_start == today, StatsRollup.count), else_=0)))
+        .where(StatsRollup.metric.in_(list(METRICS)))  # 带上指标名才能命中唯一索引
+        .where(StatsRollup.granularity == 'day')
+        .group_by(StatsRollup.metric)
+    ).all()
+    totals = {metric: 0 for metric in METRICS}
+    daily = {metric: 0 for metric in METRICS}
+    for metric, total, count in rows:
+        totals[metric] = int(total or 0)
+        daily[metric] = int(count or 0)
+    return totals, daily
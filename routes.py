@@ -1,20 +1,119 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify, stream_with_context, url_for
 from models import db, User, Singer, Album, Song, Favorite, Genre, SongGenre, Playlist, PlaylistSong
+from serializers import ROW_SERIALIZERS, UnknownField, eager, field_names, serialize_by_ids, serialize_list, stream_list
+from pagination import DEFAULT_LIMIT, MAX_LIMIT, InvalidCursor, keyset_page
+from search import search_index
+from recommend import recommender
+from similar import neighbor_table
+from leaderboard import WINDOWS, rankings
+from rollups import query_overview, query_series
+from bulk_import import KINDS as IMPORT_KINDS, import_catalogue
+from cache import entity_tags, response_cache
+from versions import conditional
+from sync import TokenExpired, changes_since, head_token
+from db_pool import pool_stats
+from replicas import remember_write, replica_set, route_reads
+from fanout import fan_out
+from admission import admission
+from batch_writes import (MAX_BATCH_ITEMS, ConcurrentBatch, InvalidBatch, add_favorites, add_playlist_songs,
+                          parse_song_ids)
+from playlist_order import InvalidPosition, parse_anchor, rank_for
+from auth import AuthBusy, current_identity, hash_password, issue_token, verify_password
+from sqlalchemy import or_
 from datetime import datetime
-import hashlib
+import io
 
 # 创建蓝图
 api = Blueprint('api', __name__)
 
-# 密码加密函数
-def hash_password(password):
-    """使用MD5加密密码"""
-    return hashlib.md5(password.encode()).hexdigest()
+# 准入控制最先执行，超出限制的请求在访问数据库之前就被拒绝
+api.before_request(admission.admit)
+api.teardown_request(admission.release)
+
+# GET请求读只读副本，写请求之后同一客户端短时间内读主库
+api.before_request(route_reads)
+api.after_request(remember_write)
+
+# ========== HTTP缓存校验 ==========
+# 各接口结果所依赖的表（含嵌入名称、计数的关联表），任一表有写入时ETag随之变化。
+# 搜索、推荐、排行榜来自进程内定期重建的数据，与表版本不同步，不做校验。
+SONG_TABLES = (Song, Singer, Album, Genre, SongGenre)
+FAVORITE_TABLES = (Favorite, Song, Singer, Album, User)
+STATS_TABLES = (User, Singer, Album, Song, Favorite, Playlist)
+
+# ========== 列表分页与过滤 ==========
+def parse_date_arg(name):
+    """解析YYYY-MM-DD格式的查询参数，格式错误时抛出ValueError"""
+    value = request.args.get(name)
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+def filter_release_date(query, column):
+    """按release_from/release_to参数过滤发行日期（闭区间）"""
+    release_from = parse_date_arg('release_from')
+    release_to = parse_date_arg('release_to')
+    if release_from:
+        query = query.filter(column >= release_from)
+    if release_to:
+        query = query.filter(column <= release_to)
+    return query
+
+def collection_response(query, model, sortable, default_sort='id', summary=None):
+    """生成列表接口的响应
+
+    请求带有limit或cursor参数时，按(sort, id)键集分页返回
+    {'items': [...], 'next_cursor': ...}；否则保持原有行为返回完整列表。
+    带stream=1参数时按(default_sort, id)顺序流式输出完整列表（format=ndjson时每行一个对象），
+    用于导出大表。fields参数（如fields=id,name,singer_name）指定只返回哪些字段，
+    歌词等大文本字段不需要时可以不查询。sortable为允许排序的字段名到列的映射，
+    default_sort为未指定sort时的排序字段。summary返回附加在分页结果第一页中的汇总字段
+    （如总数），翻页时不再重复计算。
+    """
+    fields = request.args.get('fields')
+    try:
+        names = field_names(model, fields)
+    except UnknownField as e:
+        return jsonify({'error': f'不支持的字段: {e}'}), 400
+
+    if request.args.get('stream') in ('1', 'true'):
+        ndjson = request.args.get('format') == 'ndjson'
+        return current_app.response_class(
+            stream_with_context(stream_list(query, model, ndjson=ndjson, fields=fields,
+                                            sort_column=sortable.get(default_sort))),
+            mimetype='application/x-ndjson' if ndjson else current_app.json.mimetype
+        )
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        return jsonify(serialize_list(query, model, fields=fields))
+
+    sort = request.args.get('sort', default_sort)
+    if sort not in sortable:
+        return jsonify({'error': f'不支持的排序字段: {sort}'}), 400
+    limit = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    descending = request.args.get('order', 'asc') == 'desc'
+
+    serializer = ROW_SERIALIZERS[model]
+    try:
+        rows, next_cursor = keyset_page(serializer.select(query, names, extra=(sortable[sort], model.id)),
+                                        sortable[sort], model.id, limit,
+                                        cursor=request.args.get('cursor'), descending=descending)
+    except InvalidCursor:
+        return jsonify({'error': '无效的分页游标'}), 400
+
+    result = {
+        'items': serializer.serialize(rows, names),
+        'next_cursor': next_cursor
+    }
+    if summary and not request.args.get('cursor'):
+        result.update(summary())
+    return jsonify(result)
 
 # ========== 认证相关API ==========
 @api.route('/login', methods=['POST'])
 def login():
-    """用户登录，校验账号密码和角色，返回用户基本信息与角色"""
+    """用户登录，校验账号密码和角色，返回用户基本信息、角色和会话令牌
+
+    密码在有界线程池中用scrypt校验，旧的MD5哈希校验通过后改写为scrypt。
+    之后的请求带上 Authorization: Bearer <令牌> 即可识别用户，不需要再查询数据库或计算哈希。
+    """
     data = request.get_json() or {}
     username = data.get('username')
     password = data.get('password')
@@ -24,7 +123,14 @@ def login():
         return jsonify({'error': '用户名和密码是必需的'}), 400
 
     user = User.query.filter_by(username=username).first()
-    if not user or user.password != hash_password(password):
+    try:
+        ok, needs_rehash = verify_password(user.password if user else None, password)
+        if ok and needs_rehash:
+            user.password = hash_password(password)
+            db.session.commit()
+    except AuthBusy:
+        return jsonify({'error': '登录请求过多，请稍后重试'}), 503
+    if not ok:
         return jsonify({'error': '用户名或密码错误'}), 401
     
     # 验证用户角色是否匹配
@@ -36,15 +142,24 @@ def login():
     return jsonify({
         'id': user.id,
         'username': user.username,
-        'role': user_role
+        'role': user_role,
+        'token': issue_token(user)
     })
 
+@api.route('/session', methods=['GET'])
+def get_session():
+    """返回会话令牌中的用户信息，只校验签名，不查询数据库"""
+    identity = current_identity()
+    if identity is None:
+        return jsonify({'error': '未登录或登录已过期'}), 401
+    return jsonify(identity)
+
 # ========== 用户相关API ==========
 @api.route('/users', methods=['GET'])
+@conditional(User)
 def get_users():
     """获取所有用户（排除管理员用户）"""
-    users = User.query.filter(User.role != 'admin').all()
-    return jsonify([user.to_dict() for user in users])
+    return jsonify(serialize_list(User.query.filter(User.role != 'admin'), User))
 
 @api.route('/users', methods=['POST'])
 def create_user():
@@ -59,10 +174,14 @@ def create_user():
         return jsonify({'error': '邮箱已被使用'}), 400
     
     # 创建新用户
+    try:
+        password = hash_password(data['password'])
+    except AuthBusy:
+        return jsonify({'error': '请求过多，请稍后重试'}), 503
     user = User(
         username=data['username'],
         email=data['email'],
-        password=hash_password(data['password']),
+        password=password,
         avatar=data.get('avatar', '')
     )
     
@@ -72,9 +191,10 @@ def create_user():
     return jsonify(user.to_dict()), 201
 
 @api.route('/users/<int:user_id>', methods=['GET'])
+@conditional(User)
 def get_user(user_id):
     """获取特定用户"""
-    user = User.query.get_or_404(user_id)
+    user = eager(User.query, User).get_or_404(user_id)
     return jsonify(user.to_dict())
 
 @api.route('/users/<int:user_id>', methods=['PUT'])
@@ -87,7 +207,10 @@ def update_user(user_id):
     user.username = data.get('username', user.username)
     user.email = data.get('email', user.email)
     if 'password' in data:
-        user.password = hash_password(data['password'])
+        try:
+            user.password = hash_password(data['password'])
+        except AuthBusy:
+            return jsonify({'error': '请求过多，请稍后重试'}), 503
     user.avatar = data.get('avatar', user.avatar)
     user.updated_at = datetime.utcnow()
     
@@ -100,14 +223,27 @@ def delete_user(user_id):
     user = User.query.get_or_404(user_id)
     db.session.delete(user)
     db.session.commit()
+    recommender.remove_user(user_id)
+    rankings.invalidate()
     return jsonify({'message': '用户删除成功'})
 
 # ========== 歌手相关API ==========
 @api.route('/singers', methods=['GET'])
+@conditional(Singer)
 def get_singers():
-    """获取所有歌手"""
-    singers = Singer.query.all()
-    return jsonify([singer.to_dict() for singer in singers])
+    """获取歌手列表，支持keyword、nationality过滤与分页"""
+    query = Singer.query
+    keyword = request.args.get('keyword', '').strip()
+    if keyword:
+        query = query.filter(Singer.name.contains(keyword))
+    if request.args.get('nationality'):
+        query = query.filter(Singer.nationality == request.args['nationality'])
+
+    return collection_response(query, Singer, {
+        'id': Singer.id,
+        'name': Singer.name,
+        'created_at': Singer.created_at
+    })
 
 @api.route('/singers', methods=['POST'])
 def create_singer():
@@ -124,14 +260,18 @@ def create_singer():
     
     db.session.add(singer)
     db.session.commit()
+    search_index.index_singer(singer)
     
     return jsonify(singer.to_dict()), 201
 
 @api.route('/singers/<int:singer_id>', methods=['GET'])
+@conditional(Singer)
 def get_singer(singer_id):
     """获取特定歌手"""
-    singer = Singer.query.get_or_404(singer_id)
-    return jsonify(singer.to_dict())
+    def build():
+        singer = eager(Singer.query, Singer).get_or_404(singer_id)
+        return singer.to_dict(), entity_tags(singer)
+    return response_cache.response(f'singer:{singer_id}', build)
 
 @api.route('/singers/<int:singer_id>', methods=['PUT'])
 def update_singer(singer_id):
@@ -148,6 +288,8 @@ def update_singer(singer_id):
     singer.updated_at = datetime.utcnow()
     
     db.session.commit()
+    search_index.index_singer(singer)
+    rankings.invalidate()
     return jsonify(singer.to_dict())
 
 @api.route('/singers/<int:singer_id>', methods=['DELETE'])
@@ -156,14 +298,33 @@ def delete_singer(singer_id):
     singer = Singer.query.get_or_404(singer_id)
     db.session.delete(singer)
     db.session.commit()
+    search_index.remove_singer(singer_id)
+    recommender.invalidate()
+    rankings.invalidate()
     return jsonify({'message': '歌手删除成功'})
 
 # ========== 专辑相关API ==========
 @api.route('/albums', methods=['GET'])
+@conditional(Album, Singer)
 def get_albums():
-    """获取所有专辑"""
-    albums = Album.query.all()
-    return jsonify([album.to_dict() for album in albums])
+    """获取专辑列表，支持keyword、singer_id、发行日期过滤与分页"""
+    query = Album.query
+    keyword = request.args.get('keyword', '').strip()
+    if keyword:
+        query = query.filter(Album.name.contains(keyword))
+    singer_id = request.args.get('singer_id', type=int)
+    if singer_id:
+        query = query.filter(Album.singer_id == singer_id)
+    try:
+        query = filter_release_date(query, Album.release_date)
+    except ValueError:
+        return jsonify({'error': '日期格式应为YYYY-MM-DD'}), 400
+
+    return collection_response(query, Album, {
+        'id': Album.id,
+        'name': Album.name,
+        'created_at': Album.created_at
+    })
 
 @api.route('/albums', methods=['POST'])
 def create_album():
@@ -180,14 +341,18 @@ def create_album():
     
     db.session.add(album)
     db.session.commit()
+    search_index.index_album(album)
     
     return jsonify(album.to_dict()), 201
 
 @api.route('/albums/<int:album_id>', methods=['GET'])
+@conditional(Album, Singer)
 def get_album(album_id):
     """获取特定专辑"""
-    album = Album.query.get_or_404(album_id)
-    return jsonify(album.to_dict())
+    def build():
+        album = eager(Album.query, Album).get_or_404(album_id)
+        return album.to_dict(), entity_tags(album)
+    return response_cache.response(f'album:{album_id}', build)
 
 @api.route('/albums/<int:album_id>', methods=['PUT'])
 def update_album(album_id):
@@ -204,6 +369,8 @@ def update_album(album_id):
     album.updated_at = datetime.utcnow()
     
     db.session.commit()
+    search_index.index_album(album)
+    rankings.invalidate()
     return jsonify(album.to_dict())
 
 @api.route('/albums/<int:album_id>', methods=['DELETE'])
@@ -212,14 +379,43 @@ def delete_album(album_id):
     album = Album.query.get_or_404(album_id)
     db.session.delete(album)
     db.session.commit()
+    search_index.remove_album(album_id)
+    recommender.invalidate()
+    rankings.invalidate()
     return jsonify({'message': '专辑删除成功'})
 
 # ========== 歌曲相关API ==========
 @api.route('/songs', methods=['GET'])
+@conditional(*SONG_TABLES)
 def get_songs():
-    """获取所有歌曲"""
-    songs = Song.query.all()
-    return jsonify([song.to_dict() for song in songs])
+    """获取歌曲列表，支持keyword、singer_id、album_id、genre_id、发行日期过滤与分页"""
+    query = Song.query
+    keyword = request.args.get('keyword', '').strip()
+    if keyword:
+        # 与前端原有的关键词过滤一致：匹配歌曲名或歌手名
+        query = query.filter(or_(
+            Song.name.contains(keyword),
+            Song.singer.has(Singer.name.contains(keyword))
+        ))
+    singer_id = request.args.get('singer_id', type=int)
+    if singer_id:
+        query = query.filter(Song.singer_id == singer_id)
+    album_id = request.args.get('album_id', type=int)
+    if album_id:
+        query = query.filter(Song.album_id == album_id)
+    genre_id = request.args.get('genre_id', type=int)
+    if genre_id:
+        query = query.filter(Song.song_genres.any(SongGenre.genre_id == genre_id))
+    try:
+        query = filter_release_date(query, Song.release_date)
+    except ValueError:
+        return jsonify({'error': '日期格式应为YYYY-MM-DD'}), 400
+
+    return collection_response(query, Song, {
+        'id': Song.id,
+        'name': Song.name,
+        'created_at': Song.created_at
+    })
 
 @api.route('/songs', methods=['POST'])
 def create_song():
@@ -259,13 +455,29 @@ def create_song():
         
         db.session.commit()
     
+    search_index.index_song(song)
+    recommender.invalidate()
+    rankings.upsert_song(song)
     return jsonify(song.to_dict()), 201
 
 @api.route('/songs/<int:song_id>', methods=['GET'])
+@conditional(*SONG_TABLES)
 def get_song(song_id):
     """获取特定歌曲"""
-    song = Song.query.get_or_404(song_id)
-    return jsonify(song.to_dict())
+    def build():
+        song = eager(Song.query, Song).get_or_404(song_id)
+        # 流派名称也嵌入在结果中
+        return song.to_dict(), entity_tags(song) | {f'genres:{sg.genre_id}' for sg in song.song_genres}
+    return response_cache.response(f'song:{song_id}', build)
+
+@api.route('/songs/<int:song_id>/lyrics', methods=['GET'])
+@conditional(Song)
+def get_song_lyrics(song_id):
+    """获取歌曲歌词（歌曲列表默认不返回歌词）"""
+    def build():
+        row = Song.query.with_entities(Song.lyrics).filter(Song.id == song_id).first_or_404()
+        return {'id': song_id, 'lyrics': row.lyrics}, {f'songs:{song_id}'}
+    return response_cache.response(f'song-lyrics:{song_id}', build)
 
 @api.route('/songs/<int:song_id>', methods=['PUT'])
 def update_song(song_id):
@@ -284,8 +496,10 @@ def update_song(song_id):
     
     # 处理流派关联更新
     if 'genre_ids' in data:
-        # 删除现有的流派关联
-        SongGenre.query.filter_by(song_id=song_id).delete()
+        # 删除现有的流派关联（逐条删除，以便counters模块同步流派的歌曲数）
+        for song_genre in SongGenre.query.filter_by(song_id=song_id).all():
+            db.session.delete(song_genre)
+        db.session.flush()
         
         # 添加新的流派关联
         if data['genre_ids']:
@@ -295,9 +509,12 @@ def update_song(song_id):
                 if genre:
                     song_genre = SongGenre(song_id=song_id, genre_id=genre_id)
                     db.session.add(song_genre)
-            
-            db.session.commit()
+        
+        db.session.commit()
     
+    search_index.index_song(song)
+    recommender.invalidate()
+    rankings.upsert_song(song)
     return jsonify(song.to_dict())
 
 @api.route('/songs/<int:song_id>', methods=['DELETE'])
@@ -306,14 +523,29 @@ def delete_song(song_id):
     song = Song.query.get_or_404(song_id)
     db.session.delete(song)
     db.session.commit()
+    search_index.remove_song(song_id)
+    recommender.remove_song(song_id)
+    recommender.invalidate()
+    rankings.remove_song(song_id)
     return jsonify({'message': '歌曲删除成功'})
 
 # ========== 收藏相关API ==========
 @api.route('/favorites', methods=['GET'])
+@conditional(*FAVORITE_TABLES)
 def get_favorites():
-    """获取所有收藏记录"""
-    favorites = Favorite.query.all()
-    return jsonify([favorite.to_dict() for favorite in favorites])
+    """获取收藏记录，支持user_id、song_id过滤与分页"""
+    query = Favorite.query
+    user_id = request.args.get('user_id', type=int)
+    if user_id:
+        query = query.filter(Favorite.user_id == user_id)
+    song_id = request.args.get('song_id', type=int)
+    if song_id:
+        query = query.filter(Favorite.song_id == song_id)
+
+    return collection_response(query, Favorite, {
+        'id': Favorite.id,
+        'created_at': Favorite.created_at
+    })
 
 @api.route('/favorites', methods=['POST'])
 def create_favorite():
@@ -336,15 +568,47 @@ def create_favorite():
     
     db.session.add(favorite)
     db.session.commit()
+    recommender.add_favorite(favorite.user_id, favorite.song_id)
+    rankings.add_favorite(favorite.song, favorite.created_at)
     
     return jsonify(favorite.to_dict()), 201
 
+@api.route('/favorites/batch', methods=['POST'])
+def create_favorites_batch():
+    """批量添加收藏，请求体为{"user_id": 1, "song_ids": [...]}，返回每首歌曲的处理结果
+
+    结果状态：added新收藏，exists已收藏，not_found歌曲不存在，invalid id格式错误。
+    """
+    data = request.get_json(silent=True) or {}
+    user_id = data.get('user_id')
+    if not isinstance(user_id, int) or isinstance(user_id, bool):
+        return jsonify({'error': '缺少必要的参数: user_id'}), 400
+    try:
+        song_ids, invalid = parse_song_ids(data.get('song_ids'))
+    except InvalidBatch as e:
+        return jsonify({'error': str(e)}), 400
+    if not User.query.get(user_id):
+        return jsonify({'error': '用户不存在'}), 404
+
+    try:
+        results, added, created_at = add_favorites(user_id, song_ids, invalid)
+    except ConcurrentBatch:
+        db.session.rollback()
+        return jsonify({'error': '有同时进行的收藏操作，请重试'}), 409
+    if added:
+        recommender.add_favorites(user_id, added)
+        rankings.add_favorites(added, created_at)
+    return jsonify({'added': len(added), 'results': results})
+
 @api.route('/favorites/<int:favorite_id>', methods=['DELETE'])
 def delete_favorite(favorite_id):
     """删除收藏"""
     favorite = Favorite.query.get_or_404(favorite_id)
+    user_id, song_id, created_at = favorite.user_id, favorite.song_id, favorite.created_at
     db.session.delete(favorite)
     db.session.commit()
+    recommender.remove_favorite(user_id, song_id)
+    rankings.remove_favorite(song_id, created_at)
     return jsonify({'message': '收藏删除成功'})
 
 @api.route('/favorites/user/<int:user_id>/song/<int:song_id>', methods=['DELETE'])
@@ -354,186 +618,236 @@ def delete_favorite_by_user_song(user_id, song_id):
     if not favorite:
         return jsonify({'error': '收藏记录不存在'}), 404
     
+    created_at = favorite.created_at
     db.session.delete(favorite)
     db.session.commit()
+    recommender.remove_favorite(user_id, song_id)
+    rankings.remove_favorite(song_id, created_at)
     return jsonify({'message': '收藏删除成功'})
 
 @api.route('/users/<int:user_id>/favorites', methods=['GET'])
+@conditional(*FAVORITE_TABLES)
 def get_user_favorites(user_id):
     """获取用户的收藏列表"""
-    favorites = Favorite.query.filter_by(user_id=user_id).all()
-    return jsonify([favorite.to_dict() for favorite in favorites])
+    return jsonify(serialize_list(Favorite.query.filter_by(user_id=user_id), Favorite))
 
 # ========== 数据统计API ==========
+# 统计接口的缓存在这些表有写入时失效
+STATS_TAGS = {f'table:{model.__tablename__}' for model in STATS_TABLES}
+
 @api.route('/stats/overview', methods=['GET'])
+@conditional(*STATS_TABLES, daily=True)
 def get_stats_overview():
-    """获取系统概览统计"""
-    from sqlalchemy import func
-    
-    # 基础统计
-    user_count = User.query.count()
-    singer_count = Singer.query.count()
-    album_count = Album.query.count()
-    song_count = Song.query.count()
-    favorite_count = Favorite.query.count()
-    playlist_count = Playlist.query.count()
-    
-    # 今日新增统计
-    today = datetime.utcnow().date()
-    today_users = User.query.filter(func.date(User.created_at) == today).count()
-    today_songs = Song.query.filter(func.date(Song.created_at) == today).count()
-    today_favorites = Favorite.query.filter(func.date(Favorite.created_at) == today).count()
-    
-    return jsonify({
-        'basic_stats': {
-            'users': user_count,
-            'singers': singer_count,
-            'albums': album_count,
-            'songs': song_count,
-            'favorites': favorite_count,
-            'playlists': playlist_count
-        },
-        'today_stats': {
-            'users': today_users,
-            'songs': today_songs,
-            'favorites': today_favorites
-        }
-    })
+    """获取系统概览统计（一次查询读取汇总表）"""
+    today = datetime.utcnow()
+    
+    def build():
+        totals, today_counts = query_overview(today)
+        return {
+            'basic_stats': {
+                'users': totals['users'],
+                'singers': totals['singers'],
+                'albums': totals['albums'],
+                'songs': totals['songs'],
+                'favorites': totals['favorites'],
+                'playlists': totals['playlists']
+            },
+            'today_stats': {
+                'users': today_counts['users'],
+                'songs': today_counts['songs'],
+                'favorites': today_counts['favorites']
+            }
+        }, STATS_TAGS
+    return response_cache.response(f'stats:overview:{today.date()}', build)
 
 @api.route('/stats/top-singers', methods=['GET'])
 def get_top_singers():
-    """获取热门歌手排行榜（按收藏次数）"""
-    from sqlalchemy import func
-    
-    top_singers = db.session.query(
-        Singer.id,
-        Singer.name,
-        Singer.avatar,
-        func.count(Favorite.id).label('favorite_count')
-    ).outerjoin(Song, Singer.id == Song.singer_id)\
-     .outerjoin(Favorite, Song.id == Favorite.song_id)\
-     .group_by(Singer.id)\
-     .order_by(func.count(Favorite.id).desc())\
-     .limit(10)\
-     .all()
-    
-    result = []
-    for singer in top_singers:
-        result.append({
-            'id': singer.id,
-            'name': singer.name,
-            'avatar': singer.avatar,
-            'favorite_count': singer.favorite_count or 0
-        })
+    """获取热门歌手排行榜（按收藏次数），window=24h|7d 时只统计该时间段内的收藏"""
+    window = request.args.get('window')
+    if window and window not in WINDOWS:
+        return jsonify({'error': '时间窗口只能是24h或7d'}), 400
+    
+    rankings.ensure_built(current_app._get_current_object())
+    result = [{
+        'id': singer['id'],
+        'name': singer['name'],
+        'avatar': singer['avatar'],
+        'favorite_count': singer['favorite_count']
+    } for singer in rankings.top_singers(10, window)]
     
     return jsonify(result)
 
 @api.route('/stats/top-songs', methods=['GET'])
 def get_top_songs():
-    """获取热门歌曲排行榜（按收藏次数）"""
-    from sqlalchemy import func
-    
-    top_songs = db.session.query(
-        Song.id,
-        Song.name,
-        Song.duration,
-        Singer.name.label('singer_name'),
-        Album.name.label('album_name'),
-        func.count(Favorite.id).label('favorite_count')
-    ).join(Singer, Song.singer_id == Singer.id)\
-     .outerjoin(Album, Song.album_id == Album.id)\
-     .outerjoin(Favorite, Song.id == Favorite.song_id)\
-     .group_by(Song.id)\
-     .order_by(func.count(Favorite.id).desc())\
-     .limit(10)\
-     .all()
-    
-    result = []
-    for song in top_songs:
-        result.append({
-            'id': song.id,
-            'name': song.name,
-            'duration': song.duration,
-            'singer_name': song.singer_name,
-            'album_name': song.album_name,
-            'favorite_count': song.favorite_count or 0
-        })
+    """获取热门歌曲排行榜（按收藏次数），window=24h|7d 时只统计该时间段内的收藏"""
+    window = request.args.get('window')
+    if window and window not in WINDOWS:
+        return jsonify({'error': '时间窗口只能是24h或7d'}), 400
+    
+    rankings.ensure_built(current_app._get_current_object())
+    result = [{
+        'id': song['id'],
+        'name': song['name'],
+        'duration': song['duration'],
+        'singer_name': song['singer_name'],
+        'album_name': song['album_name'],
+        'favorite_count': song['favorite_count']
+    } for song in rankings.top_songs(10, window)]
     
     return jsonify(result)
 
 @api.route('/stats/genre-distribution', methods=['GET'])
+@conditional(Genre, SongGenre)
 def get_genre_distribution():
     """获取音乐流派分布统计"""
-    from sqlalchemy import func
-    
-    genre_stats = db.session.query(
-        Genre.name,
-        func.count(SongGenre.id).label('song_count')
-    ).outerjoin(SongGenre, Genre.id == SongGenre.genre_id)\
-     .group_by(Genre.id)\
-     .order_by(func.count(SongGenre.id).desc())\
-     .all()
-    
-    result = []
-    for genre in genre_stats:
-        result.append({
-            'name': genre.name,
-            'song_count': genre.song_count or 0
-        })
-    
-    return jsonify(result)
+    def build():
+        from sqlalchemy import func
+    
+        genre_stats = db.session.query(
+            Genre.name,
+            func.count(SongGenre.id).label('song_count')
+        ).outerjoin(SongGenre, Genre.id == SongGenre.genre_id)\
+         .group_by(Genre.id)\
+         .order_by(func.count(SongGenre.id).desc())\
+         .all()
+    
+        result = []
+        for genre in genre_stats:
+            result.append({
+                'name': genre.name,
+                'song_count': genre.song_count or 0
+            })
+    
+        return result, {'table:genres', 'table:song_genres'}
+    return response_cache.response('stats:genre-distribution', build)
 
 @api.route('/stats/user-activity', methods=['GET'])
+@conditional(*STATS_TABLES, daily=True)
 def get_user_activity():
-    """获取用户活跃度统计"""
-    from sqlalchemy import func
-    from datetime import datetime, timedelta
-    
-    # 获取最近7天的日期
-    dates = []
-    for i in range(6, -1, -1):
-        date = (datetime.utcnow() - timedelta(days=i)).date()
-        dates.append(date)
-    
-    # 查询每天的用户活跃度（收藏数量）
-    activity_data = []
-    for date in dates:
-        favorites_count = Favorite.query.filter(func.date(Favorite.created_at) == date).count()
-        activity_data.append({
-            'date': date.isoformat(),
-            'favorites': favorites_count
-        })
-    
-    return jsonify(activity_data)
+    """获取用户活跃度统计
+    
+    默认返回最近7天每天的收藏数。days指定天数，start/end（YYYY-MM-DD）指定任意日期范围，
+    granularity=hour按小时统计，metrics指定统计项（favorites、users、songs、playlists，逗号分隔）。
+    """
+    from datetime import timedelta
+    
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ('day', 'hour'):
+        return jsonify({'error': '统计粒度只能是day或hour'}), 400
+    metrics = request.args.get('metrics', 'favorites').split(',')
+    if any(metric not in ('favorites', 'users', 'songs', 'playlists') for metric in metrics):
+        return jsonify({'error': '统计项只能是favorites、users、songs、playlists'}), 400
+    
+    try:
+        start = parse_date_arg('start')
+        end = parse_date_arg('end')
+    except ValueError:
+        return jsonify({'error': '日期格式应为YYYY-MM-DD'}), 400
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=request.args.get('days', 7, type=int) - 1)
+    max_days = 31 if granularity == 'hour' else 3660
+    if start > end or (end - start).days >= max_days:
+        return jsonify({'error': f'时间范围无效，最多{max_days}天'}), 400
+    
+    def build():
+        # 从汇总表一次范围扫描取出所有时间桶，缺失的补0
+        range_start = datetime.combine(start, datetime.min.time())
+        range_end = datetime.combine(end + timedelta(days=1), datetime.min.time())
+        series = query_series(metrics, granularity, range_start, range_end)
+        step = timedelta(hours=1) if granularity == 'hour' else timedelta(days=1)
+    
+        activity_data = []
+        bucket = range_start
+        while bucket < range_end:
+            entry = {'date': bucket.isoformat() if granularity == 'hour' else bucket.date().isoformat()}
+            for metric in metrics:
+                entry[metric] = series[metric].get(bucket, 0)
+            activity_data.append(entry)
+            bucket += step
+    
+        return activity_data, STATS_TAGS
+    key = f'stats:user-activity:{granularity}:{",".join(metrics)}:{start}:{end}'
+    return response_cache.response(key, build)
 
 @api.route('/stats/singer-nationality', methods=['GET'])
+@conditional(Singer)
 def get_singer_nationality():
     """获取歌手国籍分布统计"""
-    from sqlalchemy import func
-    
-    nationality_stats = db.session.query(
-        Singer.nationality,
-        func.count(Singer.id).label('singer_count')
-    ).filter(Singer.nationality.isnot(None))\
-     .group_by(Singer.nationality)\
-     .order_by(func.count(Singer.id).desc())\
-     .all()
-    
-    result = []
-    for stat in nationality_stats:
-        result.append({
-            'nationality': stat.nationality,
-            'singer_count': stat.singer_count
-        })
-    
+    def build():
+        from sqlalchemy import func
+    
+        nationality_stats = db.session.query(
+            Singer.nationality,
+            func.count(Singer.id).label('singer_count')
+        ).filter(Singer.nationality.isnot(None))\
+         .group_by(Singer.nationality)\
+         .order_by(func.count(Singer.id).desc())\
+         .all()
+    
+        result = []
+        for stat in nationality_stats:
+            result.append({
+                'nationality': stat.nationality,
+                'singer_count': stat.singer_count
+            })
+    
+        return result, {'table:singers'}
+    return response_cache.response('stats:singer-nationality', build)
+
+# ========== 仪表盘组合API ==========
+# 组合接口包含的统计接口，以及转发给各接口的查询参数
+DASHBOARD_PARTS = {
+    'overview': ('api.get_stats_overview', ()),
+    'top_singers': ('api.get_top_singers', ('window',)),
+    'top_songs': ('api.get_top_songs', ('window',)),
+    'genre_distribution': ('api.get_genre_distribution', ()),
+    'user_activity': ('api.get_user_activity', ('days', 'start', 'end', 'granularity', 'metrics')),
+    'singer_nationality': ('api.get_singer_nationality', ()),
+}
+
+@api.route('/dashboard', methods=['GET'])
+def get_dashboard():
+    """一次返回仪表盘所需的全部统计数据
+
+    各统计接口作为子请求并发执行（各自的响应缓存照常生效），耗时取决于最慢的一项；
+    window参数转发给热门歌手、热门歌曲，days、start、end等参数转发给用户活跃度。
+    """
+    paths = {}
+    for name, (endpoint, params) in DASHBOARD_PARTS.items():
+        paths[name] = url_for(endpoint, **{param: request.args[param] for param in params if param in request.args})
+
+    result = {}
+    for name, response in fan_out(paths).items():
+        if response.status_code != 200:
+            return response  # 参数错误等，直接返回该子请求的错误
+        result[name] = response.get_json()
+    return jsonify(result)
+
+@api.route('/stats/cache', methods=['GET'])
+def get_cache_stats():
+    """获取响应缓存的命中率、条目数等指标"""
+    return jsonify(response_cache.stats())
+
+@api.route('/stats/admission', methods=['GET'])
+def get_admission_stats():
+    """获取本进程各路由类别的放行、限流（429）、拒绝（503）次数和当前并发、排队数"""
+    return jsonify(admission.stats())
+
+@api.route('/stats/pool', methods=['GET'])
+def get_pool_stats():
+    """获取本进程数据库连接池的占用率、借出等待时间和超时次数，以及各只读副本的状态"""
+    result = pool_stats(db.engine)
+    status = replica_set.status(db.engines)
+    if status:
+        result['replicas'] = {key: dict(pool_stats(db.engines[key]), status=state) for key, state in status.items()}
     return jsonify(result)
 
 # ========== 播放列表相关API ==========
 @api.route('/playlists', methods=['GET'])
+@conditional(Playlist, User)
 def get_playlists():
     """获取所有播放列表"""
-    playlists = Playlist.query.all()
-    return jsonify([playlist.to_dict() for playlist in playlists])
+    return jsonify(serialize_list(Playlist.query, Playlist))
 
 @api.route('/playlists', methods=['POST'])
 def create_playlist():
@@ -563,9 +877,10 @@ def create_playlist():
     return jsonify(playlist.to_dict()), 201
 
 @api.route('/playlists/<int:playlist_id>', methods=['GET'])
+@conditional(Playlist, User)
 def get_playlist(playlist_id):
     """获取特定播放列表"""
-    playlist = Playlist.query.get_or_404(playlist_id)
+    playlist = eager(Playlist.query, Playlist).get_or_404(playlist_id)
     return jsonify(playlist.to_dict())
 
 @api.route('/playlists/<int:playlist_id>', methods=['PUT'])
@@ -592,21 +907,40 @@ def delete_playlist(playlist_id):
     return jsonify({'message': '播放列表删除成功'})
 
 @api.route('/users/<int:user_id>/playlists', methods=['GET'])
+@conditional(Playlist, User)
 def get_user_playlists(user_id):
     """获取用户的播放列表"""
-    playlists = Playlist.query.filter_by(user_id=user_id).all()
-    return jsonify([playlist.to_dict() for playlist in playlists])
+    return jsonify(serialize_list(Playlist.query.filter_by(user_id=user_id), Playlist))
 
 # ========== 播放列表歌曲管理API ==========
 @api.route('/playlists/<int:playlist_id>/songs', methods=['GET'])
+@conditional(PlaylistSong, Song, Singer, Album)
 def get_playlist_songs(playlist_id):
-    """获取播放列表中的歌曲"""
-    playlist_songs = PlaylistSong.query.filter_by(playlist_id=playlist_id).order_by(PlaylistSong.order).all()
-    return jsonify([playlist_song.to_dict() for playlist_song in playlist_songs])
+    """获取播放列表中的歌曲，按(playlist_id, order)索引顺序读取
+
+    带limit或cursor参数时分段读取：每段是一条带LIMIT的查询，从上一段最后一行在索引上
+    继续扫描，不论播放列表多长每段的开销都相同；第一段附带歌曲数total和总时长total_duration。
+    不带分页参数时返回完整列表。
+    """
+    query = PlaylistSong.query.filter_by(playlist_id=playlist_id)
+    if 'limit' not in request.args and 'cursor' not in request.args:
+        query = query.order_by(PlaylistSong.order, PlaylistSong.id)
+    return collection_response(query, PlaylistSong, {'order': PlaylistSong.order}, default_sort='order',
+                               summary=lambda: _playlist_totals(playlist_id))
+
+def _playlist_totals(playlist_id):
+    """播放列表的歌曲数和总时长（秒），一条按playlist_id索引范围扫描、按主键关联歌曲的聚合查询"""
+    total, duration = db.session.query(db.func.count(PlaylistSong.id), db.func.sum(Song.duration))\
+        .join(Song, Song.id == PlaylistSong.song_id)\
+        .filter(PlaylistSong.playlist_id == playlist_id).one()
+    return {'total': total, 'total_duration': int(duration or 0)}
 
 @api.route('/playlists/<int:playlist_id>/songs', methods=['POST'])
 def add_song_to_playlist(playlist_id):
-    """添加歌曲到播放列表"""
+    """添加歌曲到播放列表，默认追加到末尾
+
+    可用position（从0开始的序号）、after_song_id或before_song_id指定插入位置。
+    """
     data = request.get_json()
     
     # 检查请求数据是否有效
@@ -632,13 +966,16 @@ def add_song_to_playlist(playlist_id):
     if existing:
         return jsonify({'error': '该歌曲已在播放列表中'}), 400
     
-    # 获取当前播放列表中的最大顺序值
-    max_order = db.session.query(db.func.max(PlaylistSong.order)).filter_by(playlist_id=playlist_id).scalar() or 0
+    # 取插入位置前后两首歌曲排序值的中间值，只写入一条记录
+    try:
+        order = rank_for(playlist_id, parse_anchor(data))
+    except InvalidPosition as e:
+        return jsonify({'error': str(e)}), 400
     
     playlist_song = PlaylistSong(
         playlist_id=playlist_id,
         song_id=data['song_id'],
-        order=max_order + 1
+        order=order
     )
     
     db.session.add(playlist_song)
@@ -646,6 +983,82 @@ def add_song_to_playlist(playlist_id):
     
     return jsonify(playlist_song.to_dict()), 201
 
+@api.route('/playlists/<int:playlist_id>/songs/batch', methods=['POST'])
+def add_songs_to_playlist(playlist_id):
+    """批量添加歌曲到播放列表末尾，请求体为{"song_ids": [...]}，按给出的顺序排列
+
+    结果状态：added已添加（附带order），exists已在播放列表中，not_found歌曲不存在，invalid id格式错误。
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        song_ids, invalid = parse_song_ids(data.get('song_ids'))
+    except InvalidBatch as e:
+        return jsonify({'error': str(e)}), 400
+    if not Playlist.query.get(playlist_id):
+        return jsonify({'error': '播放列表不存在'}), 404
+
+    try:
+        results = add_playlist_songs(playlist_id, song_ids, invalid)
+    except ConcurrentBatch:
+        db.session.rollback()
+        return jsonify({'error': '有同时进行的添加操作，请重试'}), 409
+    return jsonify({'added': sum(result['status'] == 'added' for result in results), 'results': results})
+
+@api.route('/playlists/<int:playlist_id>/songs/<int:song_id>', methods=['PATCH'])
+def move_playlist_song(playlist_id, song_id):
+    """移动播放列表中的歌曲，请求体为position、after_song_id或before_song_id之一
+
+    只更新被移动的一条记录；前后排序值之间没有空隙时先重新编号整个播放列表。
+    """
+    data = request.get_json(silent=True) or {}
+    playlist_song = PlaylistSong.query.filter_by(playlist_id=playlist_id, song_id=song_id).first()
+    if not playlist_song:
+        return jsonify({'error': '歌曲不在播放列表中'}), 404
+    try:
+        anchor = parse_anchor(data)
+        if anchor is None:
+            return jsonify({'error': '缺少必要的参数: position、after_song_id或before_song_id'}), 400
+        playlist_song.order = rank_for(playlist_id, anchor, moving_song_id=song_id)
+    except InvalidPosition as e:
+        return jsonify({'error': str(e)}), 400
+    db.session.commit()
+    return jsonify(playlist_song.to_dict())
+
+@api.route('/playlists/<int:playlist_id>/songs/reorder', methods=['POST'])
+def reorder_playlist_songs(playlist_id):
+    """批量移动，请求体为{"moves": [{"song_id": 1, "after_song_id": 2}, ...]}，按顺序执行并一次提交
+
+    每个移动的位置参数与单首移动相同，后面的移动以前面移动之后的顺序为准；
+    任一移动无效时全部不生效。
+    """
+    data = request.get_json(silent=True) or {}
+    moves = data.get('moves')
+    if not isinstance(moves, list) or not moves or not all(isinstance(move, dict) for move in moves):
+        return jsonify({'error': 'moves应为非空列表'}), 400
+    if len(moves) > MAX_BATCH_ITEMS:
+        return jsonify({'error': f'每次最多提交{MAX_BATCH_ITEMS}个移动'}), 400
+    if not Playlist.query.get(playlist_id):
+        return jsonify({'error': '播放列表不存在'}), 404
+
+    song_ids = {move.get('song_id') for move in moves if isinstance(move.get('song_id'), int)}
+    rows = {row.song_id: row for row in PlaylistSong.query.filter(
+        PlaylistSong.playlist_id == playlist_id, PlaylistSong.song_id.in_(song_ids))}
+    try:
+        for move in moves:
+            song_id = move.get('song_id')
+            playlist_song = rows.get(song_id) if isinstance(song_id, int) else None
+            if playlist_song is None:
+                raise InvalidPosition(f'歌曲不在播放列表中: {song_id}')
+            anchor = parse_anchor(move)
+            if anchor is None:
+                raise InvalidPosition('每个移动都需要position、after_song_id或before_song_id')
+            playlist_song.order = rank_for(playlist_id, anchor, moving_song_id=playlist_song.song_id)
+    except InvalidPosition as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    db.session.commit()
+    return jsonify({'moved': len(moves)})
+
 @api.route('/playlists/<int:playlist_id>/songs/<int:song_id>', methods=['DELETE'])
 def remove_song_from_playlist(playlist_id, song_id):
     """从播放列表中移除歌曲"""
@@ -660,40 +1073,27 @@ def remove_song_from_playlist(playlist_id, song_id):
 @api.route('/popular-singers', methods=['GET'])
 def get_popular_singers():
     """获取被收藏歌曲最多的前五名歌手"""
-    # 使用SQL查询统计每个歌手的歌曲被收藏次数
-    from sqlalchemy import func
-    
-    popular_singers = db.session.query(
-        Singer.id,
-        Singer.name,
-        Singer.avatar,
-        Singer.nationality,
-        func.count(Favorite.id).label('favorite_count')
-    ).join(Song, Singer.id == Song.singer_id)\
-     .join(Favorite, Song.id == Favorite.song_id)\
-     .group_by(Singer.id)\
-     .order_by(func.count(Favorite.id).desc())\
-     .limit(5)\
-     .all()
-    
-    result = []
-    for singer in popular_singers:
-        result.append({
-            'id': singer.id,
-            'name': singer.name,
-            'avatar': singer.avatar,
-            'nationality': singer.nationality,
-            'favorite_count': singer.favorite_count
-        })
+    # 排行榜在内存中增量维护，只返回有收藏的歌手
+    rankings.ensure_built(current_app._get_current_object())
+    result = [{
+        'id': singer['id'],
+        'name': singer['name'],
+        'avatar': singer['avatar'],
+        'nationality': singer['nationality'],
+        'favorite_count': singer['favorite_count']
+    } for singer in rankings.top_singers(5, min_count=1)]
     
     return jsonify(result)
 
+
 # ========== 音乐流派相关API ==========
 @api.route('/genres', methods=['GET'])
+@conditional(Genre)
 def get_genres():
     """获取所有音乐流派"""
-    genres = Genre.query.all()
-    return jsonify([genre.to_dict() for genre in genres])
+    return response_cache.response('genres', lambda: (
+        serialize_list(Genre.query, Genre), {'table:genres', 'table:song_genres'}
+    ))
 
 @api.route('/genres', methods=['POST'])
 def create_genre():
@@ -715,9 +1115,10 @@ def create_genre():
     return jsonify(genre.to_dict()), 201
 
 @api.route('/genres/<int:genre_id>', methods=['GET'])
+@conditional(Genre)
 def get_genre(genre_id):
     """获取特定音乐流派"""
-    genre = Genre.query.get_or_404(genre_id)
+    genre = eager(Genre.query, Genre).get_or_404(genre_id)
     return jsonify(genre.to_dict())
 
 @api.route('/genres/<int:genre_id>', methods=['PUT'])
@@ -738,6 +1139,7 @@ def delete_genre(genre_id):
     genre = Genre.query.get_or_404(genre_id)
     db.session.delete(genre)
     db.session.commit()
+    recommender.invalidate()
     return jsonify({'message': '流派删除成功'})
 
 @api.route('/songs/<int:song_id>/genres', methods=['POST'])
@@ -758,14 +1160,73 @@ def add_song_genre(song_id):
     song_genre = SongGenre(song_id=song_id, genre_id=genre_id)
     db.session.add(song_genre)
     db.session.commit()
+    recommender.invalidate()
     
     return jsonify(song_genre.to_dict()), 201
 
 @api.route('/songs/<int:song_id>/genres', methods=['GET'])
+@conditional(SongGenre, Song, Genre)
 def get_song_genres(song_id):
     """获取歌曲的所有流派"""
-    song_genres = SongGenre.query.filter_by(song_id=song_id).all()
-    return jsonify([sg.to_dict() for sg in song_genres])
+    return jsonify(serialize_list(SongGenre.query.filter_by(song_id=song_id), SongGenre))
+
+# ========== 批量导入API ==========
+@api.route('/import/<kind>', methods=['POST'])
+def bulk_import(kind):
+    """批量导入歌手、专辑、流派或歌曲
+
+    请求体为NDJSON（每行一个JSON对象）或带表头的CSV，format参数或Content-Type
+    为text/csv时按CSV解析。唯一键已存在的记录会被更新，返回导入报告。
+    """
+    if kind not in IMPORT_KINDS:
+        return jsonify({'error': f'不支持的导入类型，可选值: {", ".join(IMPORT_KINDS)}'}), 400
+    fmt = request.args.get('format') or ('csv' if 'csv' in (request.content_type or '') else 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': 'format参数应为ndjson或csv'}), 400
+
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+    report = import_catalogue(kind, stream, fmt)
+    if report['inserted'] or report['updated']:
+        response_cache.clear()
+        search_index.invalidate()
+        recommender.invalidate()
+        rankings.invalidate()
+    return jsonify(report)
+
+# ========== 增量同步API ==========
+@api.route('/sync', methods=['GET'])
+def sync_changes():
+    """增量同步歌手、专辑、歌曲
+
+    不带since参数时只返回当前的同步令牌，客户端全量加载前先取得；之后用上次返回的
+    next_token请求，得到期间新增或修改的记录和已删除记录的id，has_more为true时继续请求。
+    """
+    since = request.args.get('since')
+    if not since:
+        return jsonify({'next_token': head_token()})
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), 5000)
+    try:
+        return jsonify(changes_since(since, limit=limit))
+    except InvalidCursor:
+        return jsonify({'error': '无效的同步令牌'}), 400
+    except TokenExpired:
+        return jsonify({'error': '同步令牌已过期，请重新全量加载'}), 410
+
+# ========== 搜索API ==========
+@api.route('/search', methods=['GET'])
+def search():
+    """全文搜索歌曲、歌手、专辑，按相关度排序，支持输入联想（前缀匹配）"""
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'error': '搜索关键词不能为空'}), 400
+
+    doc_type = request.args.get('type')
+    if doc_type and doc_type not in ('song', 'singer', 'album'):
+        return jsonify({'error': '搜索类型只能是song、singer或album'}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+
+    search_index.ensure_built(current_app._get_current_object())
+    return jsonify(search_index.search(q, doc_type=doc_type, limit=limit))
 
 # ========== 推荐相关API ==========
 @api.route('/recommendations', methods=['GET'])
@@ -777,101 +1238,24 @@ def get_recommendations():
     if not user_id:
         return jsonify({'error': '需要提供用户ID'}), 400
     
-    # 获取用户收藏的歌曲
-    user_favorites = Favorite.query.filter_by(user_id=user_id).all()
-    
-    if not user_favorites:
-        # 如果用户没有收藏，返回最新歌曲作为推荐
-        popular_songs = Song.query.order_by(Song.created_at.desc()).limit(10).all()
-        return jsonify([song.to_dict() for song in popular_songs])
-    
-    # 基于用户收藏的歌曲流派和喜欢的歌手推荐歌曲
-    recommended_songs = []
-    
-    # 1. 统计用户收藏歌曲的流派分布
-    from sqlalchemy import func
-    
-    # 获取用户收藏歌曲的流派统计
-    genre_stats = db.session.query(
-        Genre.id,
-        Genre.name,
-        func.count(SongGenre.id).label('genre_count')
-    ).join(SongGenre, Genre.id == SongGenre.genre_id)\
-     .join(Song, SongGenre.song_id == Song.id)\
-     .join(Favorite, Song.id == Favorite.song_id)\
-     .filter(Favorite.user_id == user_id)\
-     .group_by(Genre.id)\
-     .order_by(func.count(SongGenre.id).desc())\
-     .all()
-    
-    # 2. 获取用户收藏歌曲最多的歌手
-    favorite_singers = db.session.query(
-        Singer.id,
-        Singer.name,
-        func.count(Favorite.id).label('favorite_count')
-    ).join(Song, Singer.id == Song.singer_id)\
-     .join(Favorite, Song.id == Favorite.song_id)\
-     .filter(Favorite.user_id == user_id)\
-     .group_by(Singer.id)\
-     .order_by(func.count(Favorite.id).desc())\
-     .limit(3)\
-     .all()
-    
-    # 3. 优先推荐：用户收藏最多的流派的歌曲
-    if genre_stats:
-        top_genre_id = genre_stats[0].id
-        # 获取该流派的所有歌曲
-        genre_songs = db.session.query(Song).join(SongGenre, Song.id == SongGenre.song_id)\
-            .filter(SongGenre.genre_id == top_genre_id)\
-            .filter(Song.id.notin_([fav.song_id for fav in user_favorites]))\
-            .limit(5).all()
-        
-        for song in genre_songs:
-            if song not in recommended_songs:
-                recommended_songs.append(song)
-    
-    # 4. 推荐用户喜欢的歌手的歌曲
-    if favorite_singers:
-        for singer in favorite_singers:
-            singer_songs = Song.query.filter_by(singer_id=singer.id)\
-                .filter(Song.id.notin_([fav.song_id for fav in user_favorites]))\
-                .limit(3).all()
-            
-            for song in singer_songs:
-                if song not in recommended_songs:
-                    recommended_songs.append(song)
-    
-    # 5. 如果推荐歌曲不足，补充其他流派的歌曲（基于用户收藏的流派）
-    if len(recommended_songs) < 10 and len(genre_stats) > 1:
-        for i in range(1, min(3, len(genre_stats))):  # 取前3个流派（除了第一个）
-            genre_id = genre_stats[i].id
-            genre_songs = db.session.query(Song).join(SongGenre, Song.id == SongGenre.song_id)\
-                .filter(SongGenre.genre_id == genre_id)\
-                .filter(Song.id.notin_([fav.song_id for fav in user_favorites]))\
-                .limit(2).all()
-            
-            for song in genre_songs:
-                if len(recommended_songs) < 10 and song not in recommended_songs:
-                    recommended_songs.append(song)
-    
-    # 6. 如果推荐歌曲仍然不足，补充最新歌曲
-    if len(recommended_songs) < 10:
-        remaining_count = 10 - len(recommended_songs)
-        popular_songs = Song.query.order_by(Song.created_at.desc())\
-            .filter(Song.id.notin_([fav.song_id for fav in user_favorites]))\
-            .limit(remaining_count).all()
-        
-        for song in popular_songs:
-            if song not in recommended_songs:
-                recommended_songs.append(song)
-    
-    # 限制返回数量为10首
-    recommended_songs = recommended_songs[:10]
-    
-    return jsonify([song.to_dict() for song in recommended_songs])
+    # 推荐结果由预计算的推荐引擎给出，这里只按id取回歌曲
+    recommender.ensure_built(current_app._get_current_object())
+    song_ids = recommender.recommend(user_id)
+    return jsonify(serialize_by_ids(Song, song_ids))
 
 @api.route('/recommendations/popular', methods=['GET'])
 def get_popular_recommendations():
     """获取热门推荐歌曲（不基于用户历史）"""
-    popular_songs = Song.query.order_by(Song.created_at.desc()).limit(10).all()
-    return jsonify([song.to_dict() for song in popular_songs])
\ No newline at end of file
+    popular_songs = Song.query.order_by(Song.created_at.desc()).limit(10)
+    return jsonify(serialize_list(popular_songs, Song))
+
+@api.route('/songs/<int:song_id>/similar', methods=['GET'])
+def get_similar_songs(song_id):
+    """获取相似歌曲（收藏了这首歌的用户也收藏了），数据由离线任务生成"""
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    neighbors = neighbor_table.similar(song_id, limit)
+    songs = serialize_by_ids(Song, [neighbor_id for neighbor_id, _ in neighbors])
+    scores = dict(neighbors)
+    for song in songs:
+        song['similarity'] = round(scores[song['id']], 4)
+    return jsonify(songs)
@@ -0,0 +1,331 @@
+import bisect
+import math
+import os
+import pickle
+import re
+import threading
+import time
+from collections import defaultdict
+from sqlalchemy.orm import undefer
+from models import db, Singer, Album, Song
+
+# 索引配置
+SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', 'search_index.pkl')
+SEARCH_INDEX_MAX_AGE = int(os.getenv('SEARCH_INDEX_MAX_AGE', '300'))  # 秒，超过后后台重建
+
+# 字段权重：名称命中比歌词/简介命中更相关
+NAME_WEIGHT = 3.0
+TEXT_WEIGHT = 1.0
+PREFIX_EXPANSIONS = 50  # 前缀查询最多展开的词项数
+BUILD_BATCH_SIZE = 1000
+
+_CJK = '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+_TOKEN_RE = re.compile(f'[{_CJK}]+|[0-9a-z]+')
+_CJK_RE = re.compile(f'[{_CJK}]')
+
+def tokenize(text):
+    """分词：拉丁字母/数字按单词切分，中日韩文本切成单字和相邻双字"""
+    tokens = []
+    for run in _TOKEN_RE.findall((text or '').lower()):
+        if _CJK_RE.match(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+def _query_terms(text):
+    """查询分词：中文只用双字（单字查询时用单字），减少无关命中"""
+    terms = []
+    for run in _TOKEN_RE.findall((text or '').lower()):
+        if _CJK_RE.match(run) and len(run) > 1:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run)
+    return terms
+
+def _weights(fields):
+    """[(文本, 权重), ...] -> {词项: 加权词频}，在加锁之前计算"""
+    weights = defaultdict(float)
+    for text, weight in fields:
+        for token in tokenize(text):
+            weights[token] += weight
+    return weights
+
+def _link(singer_docs, album_songs, key, info):
+    """把专辑、歌曲文档键登记到所属歌手（和专辑）下"""
+    if key[0] != 'singer' and info.get('singer_id') is not None:
+        singer_docs[info['singer_id']].add(key)
+    if key[0] == 'song' and info.get('album_id') is not None:
+        album_songs[info['album_id']].add(key)
+
+def _unlink(index, key, owner_id):
+    keys = index.get(owner_id)
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del index[owner_id]
+
+class SearchIndex:
+    """歌曲、歌手、专辑的内存倒排索引
+
+    文档键为(类型, id)，postings保存 词项 -> {文档键: 加权词频}。
+    词项另外维护一个有序列表用于前缀（输入联想）查询：增量写入时用insort维护，
+    全量构建和加载时在锁外整体排序后替换，查询路径上不再排序。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.postings = defaultdict(dict)
+        self.doc_terms = {}
+        self.docs = {}
+        self.singer_docs = defaultdict(set)  # 歌手id -> 该歌手的专辑、歌曲文档键
+        self.album_songs = defaultdict(set)  # 专辑id -> 该专辑的歌曲文档键
+        self._sorted_terms = []
+        self._journal = None  # 后台重建期间本进程的写操作，替换为新索引后重放
+        self.built_at = None
+        self._stale = False
+        self._rebuilding = False
+
+    # ---------- 文档维护 ----------
+    def _write(self, method, *args):
+        """执行一次写操作；重建进行中时同时记入日志。参数只包含普通数据，可在新索引上重放"""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((method, args))
+            getattr(self, method)(*args)
+
+    def _add(self, key, weights, info):
+        with self._lock:
+            self._remove(key)
+            for token, weight in weights.items():
+                # 构建中的新索引不逐个插入，构建完成后整体排序
+                if token not in self.postings and self.built_at is not None:
+                    bisect.insort(self._sorted_terms, token)
+                self.postings[token][key] = weight
+            self.doc_terms[key] = tuple(weights)
+            self.docs[key] = info
+            _link(self.singer_docs, self.album_songs, key, info)
+
+    def _remove(self, key):
+        with self._lock:
+            for token in self.doc_terms.pop(key, ()):
+                docs = self.postings.get(token)
+                if docs is not None:
+                    docs.pop(key, None)
+                    if not docs:
+                        del self.postings[token]
+                        self._discard_term(token)
+            info = self.docs.pop(key, None)
+            if info is not None:
+                _unlink(self.singer_docs, key, info.get('singer_id'))
+                if key[0] == 'song':
+                    _unlink(self.album_songs, key, info.get('album_id'))
+
+    def _discard_term(self, token):
+        i = bisect.bisect_left(self._sorted_terms, token)
+        if i < len(self._sorted_terms) and self._sorted_terms[i] == token:
+            del self._sorted_terms[i]
+
+    def _rename_singer(self, singer_id, name):
+        for key in self.singer_docs.get(singer_id, ()):
+            self.docs[key]['singer_name'] = name
+
+    def _remove_album(self, album_id):
+        self._remove(('album', album_id))
+        for key in list(self.album_songs.get(album_id, ())):
+            self._remove(key)
+
+    def _remove_singer(self, singer_id):
+        self._remove(('singer', singer_id))
+        for key in list(self.singer_docs.get(singer_id, ())):
+            self._remove(key)
+
+    def index_song(self, song, singer_name=None):
+        singer_name = singer_name if singer_name is not None else (song.singer.name if song.singer else None)
+        self._write('_add', ('song', song.id), _weights([(song.name, NAME_WEIGHT), (song.lyrics, TEXT_WEIGHT)]), {
+            'type': 'song',
+            'id': song.id,
+            'name': song.name,
+            'singer_id': song.singer_id,
+            'singer_name': singer_name,
+            'album_id': song.album_id
+        })
+
+    def index_singer(self, singer):
+        weights = _weights([(singer.name, NAME_WEIGHT), (singer.description, TEXT_WEIGHT)])
+        with self._lock:
+            self._write('_add', ('singer', singer.id), weights, {
+                'type': 'singer',
+                'id': singer.id,
+                'name': singer.name
+            })
+            # 歌曲、专辑结果中展示的歌手名随之更新
+            self._write('_rename_singer', singer.id, singer.name)
+
+    def index_album(self, album, singer_name=None):
+        singer_name = singer_name if singer_name is not None else (album.singer.name if album.singer else None)
+        self._write('_add', ('album', album.id), _weights([(album.name, NAME_WEIGHT)]), {
+            'type': 'album',
+            'id': album.id,
+            'name': album.name,
+            'singer_id': album.singer_id,
+            'singer_name': singer_name
+        })
+
+    def remove_song(self, song_id):
+        self._write('_remove', ('song', song_id))
+
+    def remove_album(self, album_id):
+        """删除专辑及级联删除的歌曲"""
+        self._write('_remove_album', album_id)
+
+    def remove_singer(self, singer_id):
+        """删除歌手及级联删除的专辑、歌曲"""
+        self._write('_remove_singer', singer_id)
+
+    # ---------- 查询 ----------
+    def _expand_prefix(self, prefix):
+        with self._lock:
+            start = bisect.bisect_left(self._sorted_terms, prefix)
+            terms = self._sorted_terms[start:start + PREFIX_EXPANSIONS]
+        expanded = []
+        for term in terms:
+            if not term.startswith(prefix):
+                break
+            expanded.append(term)
+        return expanded
+
+    def search(self, text, doc_type=None, limit=20, prefix=True):
+        """按相关度返回匹配全部查询词的文档
+
+        得分为各查询词 idf * 加权词频/(加权词频+1) 之和；prefix为True时
+        最后一个拉丁词按前缀展开，用于输入联想。
+        """
+        terms = _query_terms(text)
+        if not terms:
+            return []
+
+        with self._lock:
+            total = max(len(self.docs), 1)
+            scores = None
+            for i, term in enumerate(terms):
+                is_last_word = prefix and i == len(terms) - 1 and not _CJK_RE.match(term)
+                candidates = self._expand_prefix(term) if is_last_word else [term]
+                term_scores = {}
+                for candidate in candidates:
+                    docs = self.postings.get(candidate)
+                    if not docs:
+                        continue
+                    idf = math.log(1 + total / len(docs))
+                    for key, weight in docs.items():
+                        score = idf * weight / (weight + 1)
+                        if score > term_scores.get(key, 0):
+                            term_scores[key] = score
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {key: score + term_scores[key] for key, score in scores.items() if key in term_scores}
+                if not scores:
+                    return []
+
+            if doc_type:
+                scores = {key: score for key, score in scores.items() if key[0] == doc_type}
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+            return [dict(self.docs[key], score=round(score, 4)) for key, score in ranked]
+
+    # ---------- 构建与持久化 ----------
+    def build(self):
+        """从数据库全量构建索引，构建完成后整体替换当前内容
+
+        构建期间本进程对当前索引的写操作记入日志，替换后在新索引上按顺序重放，
+        避免构建开始后才提交的新增、删除被数据库快照覆盖。
+        """
+        with self._lock:
+            self._journal = []
+        try:
+            fresh = SearchIndex()
+            singer_names = {}
+            for singer in Singer.query.options(undefer(Singer.description)).yield_per(BUILD_BATCH_SIZE):
+                singer_names[singer.id] = singer.name
+                fresh.index_singer(singer)
+            for album in Album.query.yield_per(BUILD_BATCH_SIZE):
+                fresh.index_album(album, singer_names.get(album.singer_id))
+            for song in Song.query.options(undefer(Song.lyrics)).yield_per(BUILD_BATCH_SIZE):
+                fresh.index_song(song, singer_names.get(song.singer_id))
+            sorted_terms = sorted(fresh.postings)
+            with self._lock:
+                self.postings = fresh.postings
+                self.doc_terms = fresh.doc_terms
+                self.docs = fresh.docs
+                self.singer_docs = fresh.singer_docs
+                self.album_songs = fresh.album_songs
+                self._sorted_terms = sorted_terms
+                self.built_at = time.time()
+                self._stale = False
+                journal, self._journal = self._journal, None
+                for method, args in journal:
+                    getattr(self, method)(*args)
+        finally:
+            with self._lock:
+                self._journal = None
+
+    def save(self, path=SEARCH_INDEX_PATH):
+        with self._lock:
+            state = (dict(self.postings), self.doc_terms, self.docs, self.built_at)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def load(self, path=SEARCH_INDEX_PATH):
+        with open(path, 'rb') as f:
+            postings, doc_terms, docs, built_at = pickle.load(f)
+        sorted_terms = sorted(postings)
+        singer_docs, album_songs = defaultdict(set), defaultdict(set)
+        for key, info in docs.items():
+            _link(singer_docs, album_songs, key, info)
+        with self._lock:
+            self.postings = defaultdict(dict, postings)
+            self.doc_terms = doc_terms
+            self.docs = docs
+            self.singer_docs = singer_docs
+            self.album_songs = album_songs
+            self._sorted_terms = sorted_terms
+            self.built_at = built_at
+
+    def invalidate(self):
+        """大批量写入（如批量导入）后标记为过期，下次查询时后台重建，不逐条增量更新"""
+        self._stale = True
+
+    @property
+    def ready(self):
+        return self.built_at is not None
+
+    def ensure_built(self, app):
+        """首次使用时加载快照或全量构建；索引过期后在后台线程重建
+
+        每个进程各持有一份索引，本进程的写操作会增量更新索引，
+        其他进程的写操作在下一次后台重建后可见。
+        """
+        if not self.ready:
+            with self._lock:
+                if not self.ready:
+                    if os.path.exists(SEARCH_INDEX_PATH):
+                        self.load()
+                    else:
+                        self.build()
+        expired = self._stale or time.time() - self.built_at > SEARCH_INDEX_MAX_AGE
+        if expired and not self._rebuilding:
+            self._rebuilding = True
+            threading.Thread(target=self._background_rebuild, args=(app,), daemon=True).start()
+
+    def _background_rebuild(self, app):
+        try:
+            with app.app_context():
+                self.build()
+                db.session.remove()
+        finally:
+            self._rebuilding = False
+
+# 进程内的全局索引
+search_index = SearchIndex()
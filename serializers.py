@@ -0,0 +1,302 @@
+import os
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, undefer
+from metrics import serializing
+from pagination import keyset_page
+from models import db, User, Singer, Album, Song, Favorite, Genre, SongGenre, Playlist, PlaylistSong
+
+# 流式导出时每批读取的行数
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '1000'))
+IN_CHUNK_SIZE = 1000  # 按id批量加载关联数据时每条IN查询的id数
+
+class UnknownField(ValueError):
+    """fields参数中有不支持的字段"""
+
+# 按ORM对象序列化（详情接口、没有按列序列化器的模型）所需的加载选项
+# to_dict() 会访问的关联一律通过JOIN预加载，计数字段是表中的计数列，
+# 因此每个列表接口只发出一条查询，与返回的行数无关；延迟加载的大字段在详情中一并取回。
+# 使用函数而不是常量：backref属性（如Favorite.song）在映射配置完成后才存在。
+def _song_options():
+    return (
+        undefer(Song.lyrics),
+        joinedload(Song.singer),
+        joinedload(Song.album),
+        joinedload(Song.song_genres).joinedload(SongGenre.genre),
+    )
+
+def _favorite_options():
+    return (
+        joinedload(Favorite.song).joinedload(Song.singer),
+        joinedload(Favorite.song).joinedload(Song.album),
+        joinedload(Favorite.user),
+    )
+
+LIST_OPTIONS = {
+    User: lambda: (),
+    Singer: lambda: (undefer(Singer.description),),
+    Album: lambda: (joinedload(Album.singer),),
+    Song: _song_options,
+    Favorite: _favorite_options,
+    Genre: lambda: (),
+    SongGenre: lambda: (joinedload(SongGenre.song), joinedload(SongGenre.genre)),
+    Playlist: lambda: (joinedload(Playlist.user),),
+    PlaylistSong: lambda: (joinedload(PlaylistSong.song).joinedload(Song.singer),
+                           joinedload(PlaylistSong.song).joinedload(Song.album)),
+}
+
+def eager(query, model):
+    """为查询附加model列表序列化所需的预加载选项"""
+    return query.options(*LIST_OPTIONS[model]())
+
+# ========== 按列序列化 ==========
+# 列表接口不加载ORM对象：只查询需要的列，把结果行直接转换为与to_dict()相同的字典。
+# 关联记录的名称以关联子查询的形式嵌入主查询，不需要JOIN，也不受查询中已有的
+# LIMIT、JOIN影响；歌曲的流派按id批量加载。
+def _iso(value):
+    return value.isoformat() if value else None
+
+def _count(value):
+    return value or 0
+
+def _name_of(target, condition, correlate, *joins):
+    """condition指向的关联记录的名称，作为只与correlate表关联的子查询"""
+    statement = select(target.name)
+    for model, onclause in joins:
+        statement = statement.join(model, onclause)
+    return statement.where(condition).correlate(correlate).scalar_subquery()
+
+def _song_genres(song_ids):
+    """{歌曲id: [流派名称]}，顺序与to_dict()一致"""
+    genres = {}
+    for i in range(0, len(song_ids), IN_CHUNK_SIZE):
+        rows = db.session.execute(
+            select(SongGenre.song_id, Genre.name)
+            .join(Genre, Genre.id == SongGenre.genre_id)
+            .where(SongGenre.song_id.in_(song_ids[i:i + IN_CHUNK_SIZE]))
+            .order_by(SongGenre.id)
+        )
+        for song_id, name in rows:
+            genres.setdefault(song_id, []).append(name)
+    return genres
+
+class RowSerializer:
+    """model的按列序列化器
+
+    fields为[(字段名, 列表达式, 转换函数或None)]，collections为{字段名: 函数}，
+    函数接收id列表，返回{id: 字段值}，用于一对多的字段。
+    模型中声明为延迟加载的列（歌词等大字段）默认不输出，需要在fields中指定。
+    """
+
+    def __init__(self, model, fields, collections=None):
+        self.model = model
+        self.fields = {name: (column, convert) for name, column, convert in fields}
+        self.collections = collections or {}
+        self.all_names = [name for name, _, _ in fields] + list(self.collections)
+        deferred = {name for name, column, _ in fields
+                    if getattr(getattr(column, 'property', None), 'deferred', False)}
+        self.names = [name for name in self.all_names if name not in deferred]
+
+    def field_names(self, fields=None):
+        """解析逗号分隔的字段列表，未指定时返回默认字段，'*'表示包括大字段在内的全部字段"""
+        if not fields:
+            return self.names
+        if fields == '*':
+            return self.all_names
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields and name not in self.collections]
+        if unknown:
+            raise UnknownField(', '.join(unknown))
+        return names
+
+    def select(self, query, names, extra=()):
+        """把query改为只查询names所需的列；extra中的列（如键集分页的排序列）附加在后面"""
+        columns = {name: self.fields[name][0] for name in names if name in self.fields}
+        if 'id' not in columns and any(name in self.collections for name in names):
+            columns['id'] = self.model.id
+        for column in extra:
+            columns.setdefault(column.key, column)
+        return query.with_entities(*[column.label(name) for name, column in columns.items()])
+
+    def serialize(self, rows, names):
+        """把select()查询得到的结果行转换为字典列表"""
+        scalar = [name for name in names if name in self.fields]
+        converters = [(i, name, self.fields[name][1]) for i, name in enumerate(scalar) if self.fields[name][1]]
+        items = []
+        with serializing():
+            for row in rows:
+                item = dict(zip(scalar, row))
+                for i, name, convert in converters:
+                    item[name] = convert(row[i])
+                items.append(item)
+            for name in names:
+                if name in self.collections and rows:
+                    values = self.collections[name]([row.id for row in rows])
+                    for item, row in zip(items, rows):
+                        item[name] = values.get(row.id, [])
+        return items
+
+ROW_SERIALIZERS = {serializer.model: serializer for serializer in (
+    RowSerializer(User, [
+        ('id', User.id, None),
+        ('username', User.username, None),
+        ('email', User.email, None),
+        ('avatar', User.avatar, None),
+        ('role', User.role, None),
+        ('favorites_count', User.favorites_count, _count),
+        ('created_at', User.created_at, _iso),
+        ('updated_at', User.updated_at, _iso),
+    ]),
+    RowSerializer(Singer, [
+        ('id', Singer.id, None),
+        ('name', Singer.name, None),
+        ('avatar', Singer.avatar, None),
+        ('description', Singer.description, None),
+        ('birth_date', Singer.birth_date, _iso),
+        ('nationality', Singer.nationality, None),
+        ('albums_count', Singer.albums_count, _count),
+        ('songs_count', Singer.songs_count, _count),
+        ('created_at', Singer.created_at, _iso),
+        ('updated_at', Singer.updated_at, _iso),
+    ]),
+    RowSerializer(Album, [
+        ('id', Album.id, None),
+        ('name', Album.name, None),
+        ('cover', Album.cover, None),
+        ('description', Album.description, None),
+        ('release_date', Album.release_date, _iso),
+        ('singer_id', Album.singer_id, None),
+        ('singer_name', _name_of(Singer, Singer.id == Album.singer_id, Album), None),
+        ('songs_count', Album.songs_count, _count),
+        ('created_at', Album.created_at, _iso),
+        ('updated_at', Album.updated_at, _iso),
+    ]),
+    RowSerializer(Song, [
+        ('id', Song.id, None),
+        ('name', Song.name, None),
+        ('duration', Song.duration, None),
+        ('lyrics', Song.lyrics, None),
+        ('release_date', Song.release_date, _iso),
+        ('singer_id', Song.singer_id, None),
+        ('singer_name', _name_of(Singer, Singer.id == Song.singer_id, Song), None),
+        ('album_id', Song.album_id, None),
+        ('album_name', _name_of(Album, Album.id == Song.album_id, Song), None),
+        ('favorite_count', Song.favorite_count, _count),
+        ('created_at', Song.created_at, _iso),
+        ('updated_at', Song.updated_at, _iso),
+    ], collections={'genres': _song_genres}),
+    RowSerializer(Favorite, [
+        ('id', Favorite.id, None),
+        ('user_id', Favorite.user_id, None),
+        ('song_id', Favorite.song_id, None),
+        ('song_name', _name_of(Song, Song.id == Favorite.song_id, Favorite), None),
+        ('singer_name', _name_of(Singer, Song.id == Favorite.song_id, Favorite,
+                                 (Song, Song.singer_id == Singer.id)), None),
+        ('album_name', _name_of(Album, Song.id == Favorite.song_id, Favorite,
+                                (Song, Song.album_id == Album.id)), None),
+        ('username', select(User.username).where(User.id == Favorite.user_id)
+                     .correlate(Favorite).scalar_subquery(), None),
+        ('created_at', Favorite.created_at, _iso),
+    ]),
+    RowSerializer(Genre, [
+        ('id', Genre.id, None),
+        ('name', Genre.name, None),
+        ('description', Genre.description, None),
+        ('songs_count', Genre.songs_count, _count),
+        ('created_at', Genre.created_at, _iso),
+    ]),
+    RowSerializer(SongGenre, [
+        ('id', SongGenre.id, None),
+        ('song_id', SongGenre.song_id, None),
+        ('genre_id', SongGenre.genre_id, None),
+        ('song_name', _name_of(Song, Song.id == SongGenre.song_id, SongGenre), None),
+        ('genre_name', _name_of(Genre, Genre.id == SongGenre.genre_id, SongGenre), None),
+        ('created_at', SongGenre.created_at, _iso),
+    ]),
+    RowSerializer(Playlist, [
+        ('id', Playlist.id, None),
+        ('name', Playlist.name, None),
+        ('description', Playlist.description, None),
+        ('cover', Playlist.cover, None),
+        ('user_id', Playlist.user_id, None),
+        ('username', select(User.username).where(User.id == Playlist.user_id)
+                     .correlate(Playlist).scalar_subquery(), None),
+        ('is_public', Playlist.is_public, None),
+        ('songs_count', Playlist.songs_count, _count),
+        ('created_at', Playlist.created_at, _iso),
+        ('updated_at', Playlist.updated_at, _iso),
+    ]),
+    RowSerializer(PlaylistSong, [
+        ('id', PlaylistSong.id, None),
+        ('playlist_id', PlaylistSong.playlist_id, None),
+        ('song_id', PlaylistSong.song_id, None),
+        ('order', PlaylistSong.order, None),
+        ('song_name', _name_of(Song, Song.id == PlaylistSong.song_id, PlaylistSong), None),
+        ('singer_name', _name_of(Singer, Song.id == PlaylistSong.song_id, PlaylistSong,
+                                 (Song, Song.singer_id == Singer.id)), None),
+        ('album_name', _name_of(Album, Song.id == PlaylistSong.song_id, PlaylistSong,
+                                (Song, Song.album_id == Album.id)), None),
+        ('duration', select(Song.duration).where(Song.id == PlaylistSong.song_id)
+                     .correlate(PlaylistSong).scalar_subquery(), None),
+        ('added_at', PlaylistSong.added_at, _iso),
+    ]),
+)}
+
+def field_names(model, fields=None):
+    """解析fields参数，返回要输出的字段名列表；model没有按列序列化器时返回None（输出to_dict()全部字段）"""
+    serializer = ROW_SERIALIZERS.get(model)
+    if serializer is None:
+        if fields:
+            raise UnknownField(fields)
+        return None
+    return serializer.field_names(fields)
+
+def serialize_list(query, model, fields=None):
+    """执行查询并序列化为字典列表，fields为逗号分隔的字段列表"""
+    serializer = ROW_SERIALIZERS.get(model)
+    if serializer is None:
+        objects = eager(query, model).all()
+        with serializing():
+            return [obj.to_dict() for obj in objects]
+    names = serializer.field_names(fields)
+    return serializer.serialize(serializer.select(query, names).all(), names)
+
+def serialize_by_ids(model, ids, fields=None):
+    """按给定id顺序序列化对象，一条查询取回全部行，已不存在的id会被跳过"""
+    if not ids:
+        return []
+    query = model.query.filter(model.id.in_(ids))
+    items = {item['id']: item for item in serialize_list(query, model, fields=fields)}
+    return [items[obj_id] for obj_id in ids if obj_id in items]
+
+def stream_list(query, model, ndjson=False, fields=None, batch_size=STREAM_BATCH_SIZE, sort_column=None):
+    """逐批序列化查询结果，生成JSON数组（ndjson为True时为每行一个对象）的文本片段
+
+    按(sort_column, id)做键集分批（sort_column默认为id），query中原有的排序被忽略，
+    每批是一条带LIMIT的普通查询，序列化后即被丢弃，
+    内存占用只与batch_size有关；第一批查询完成后就开始输出。
+    不使用服务端游标（stream_results）：PyMySQL的无缓冲游标读完之前同一连接上
+    不能执行其他查询，而且会在客户端下载期间一直占着游标。
+    """
+    serializer = ROW_SERIALIZERS[model]
+    names = serializer.field_names(fields)
+    sort_column = model.id if sort_column is None else sort_column
+    query = serializer.select(query.order_by(None), names, extra=(sort_column, model.id))
+    dumps = current_app.json.dumps
+    cursor = None
+    separator = ''
+    if not ndjson:
+        yield '['
+    while True:
+        rows, cursor = keyset_page(query, sort_column, model.id, batch_size, cursor=cursor)
+        if rows:
+            items = [dumps(item) for item in serializer.serialize(rows, names)]
+            if ndjson:
+                yield '\n'.join(items) + '\n'
+            else:
+                yield separator + ','.join(items)
+                separator = ','
+        if cursor is None:
+            break
+    if not ndjson:
+        yield ']'
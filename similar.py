@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+import numpy as np
+from models import db, Favorite
+
+# 相似歌曲（物品协同过滤）配置
+SIMILAR_SONGS_PATH = os.getenv('SIMILAR_SONGS_PATH', 'similar_songs.npz')
+SIMILAR_TOP_K = 50          # 每首歌保留的相似歌曲数
+MAX_BASKET_SIZE = 200       # 单个用户参与计算的收藏数上限（取最近的收藏），避免重度用户产生平方级的歌曲对
+CHUNK_SIZE = 100000         # 每次从收藏表读取的行数
+COMPACT_PAIRS = 20000000    # 未合并的歌曲对达到该数量时合并一次
+RELOAD_INTERVAL = 60        # 秒，检查邻居表文件是否更新的间隔
+
+_EMPTY = np.empty(0, dtype=np.int64)
+
+class _PairCounter:
+    """稀疏的歌曲对共现计数，键为 i * base + j（i < j）"""
+
+    def __init__(self, base):
+        self.base = base
+        self.keys = _EMPTY
+        self.counts = _EMPTY
+        self._pending = []
+        self._pending_size = 0
+
+    def add_basket(self, songs):
+        if len(songs) < 2:
+            return
+        left, right = np.triu_indices(len(songs), 1)
+        self._pending.append(songs[left] * self.base + songs[right])
+        self._pending_size += len(left)
+        if self._pending_size >= COMPACT_PAIRS:
+            self.compact()
+
+    def compact(self):
+        """把待合并的歌曲对并入已排序的(keys, counts)
+
+        只对待合并的部分排序去重，再按位置归并进已有的键：已有的键累加计数，
+        新键插入到对应位置，不重新排序已合并的全部歌曲对。
+        """
+        if not self._pending:
+            return
+        keys, counts = np.unique(np.concatenate(self._pending), return_counts=True)
+        positions = np.searchsorted(self.keys, keys)
+        known = positions < len(self.keys)
+        known[known] = self.keys[positions[known]] == keys[known]
+        self.counts[positions[known]] += counts[known]
+        new = ~known
+        self.keys = np.insert(self.keys, positions[new], keys[new])
+        self.counts = np.insert(self.counts, positions[new], counts[new])
+        self._pending = []
+        self._pending_size = 0
+
+def build_neighbors(top_k=SIMILAR_TOP_K, chunk_size=CHUNK_SIZE, path=SIMILAR_SONGS_PATH):
+    """离线计算每首歌曲余弦相似度最高的top_k首歌曲，写入npz文件
+
+    按user_id顺序流式读取收藏表（走unique_user_song索引），逐个用户累计
+    歌曲收藏数和歌曲对共现数，内存中只保存非零的共现对，不构造稠密矩阵。
+    收藏数超过MAX_BASKET_SIZE的用户只取最近的收藏（按收藏id），收藏数与共现数取自同一批收藏。
+    相似度 = 共现数 / sqrt(收藏数_i * 收藏数_j)。
+    """
+    max_song_id = db.session.query(db.func.max(Favorite.song_id)).scalar() or 0
+    base = max_song_id + 1
+    item_counts = np.zeros(base, dtype=np.int64)
+    pairs = _PairCounter(base)
+
+    current_user, basket = None, []
+    query = db.session.query(Favorite.user_id, Favorite.song_id, Favorite.id)\
+        .order_by(Favorite.user_id, Favorite.song_id)\
+        .execution_options(stream_results=True)\
+        .yield_per(chunk_size)
+    for user_id, song_id, favorite_id in query:
+        if user_id != current_user:
+            _add_basket(basket, item_counts, pairs)
+            current_user, basket = user_id, []
+        basket.append((favorite_id, song_id))
+    _add_basket(basket, item_counts, pairs)
+    pairs.compact()
+
+    left, right = np.divmod(pairs.keys, base)
+    scores = pairs.counts / np.sqrt(item_counts[left] * item_counts[right])
+
+    # 相似关系是对称的，两个方向各保留一份后按(歌曲, 相似度降序, 邻居id)排序
+    source = np.concatenate([left, right])
+    target = np.concatenate([right, left])
+    scores = np.concatenate([scores, scores])
+    order = np.lexsort((target, -scores, source))
+    source, target, scores = source[order], target[order], scores[order]
+
+    song_ids, starts, counts = np.unique(source, return_index=True, return_counts=True)
+    rank = np.arange(len(source)) - np.repeat(starts, counts)
+    keep = rank < top_k
+    source, target, scores = source[keep], target[keep], scores[keep]
+
+    indptr = np.concatenate(([0], np.cumsum(np.minimum(counts, top_k))))
+    np.savez(path + '.tmp.npz', song_ids=song_ids, indptr=indptr,
+             neighbors=target.astype(np.int64), scores=scores.astype(np.float32))
+    os.replace(path + '.tmp.npz', path)
+    return len(song_ids), len(target)
+
+def _add_basket(basket, item_counts, pairs):
+    """basket为一个用户的[(收藏id, 歌曲id), ...]，按歌曲id排列"""
+    if not basket:
+        return
+    if len(basket) > MAX_BASKET_SIZE:
+        basket = sorted(basket)[-MAX_BASKET_SIZE:]
+    songs = np.sort(np.array([song_id for _, song_id in basket], dtype=np.int64))
+    item_counts[songs] += 1
+    pairs.add_basket(songs)
+
+class NeighborTable:
+    """以CSR数组保存的相似歌曲表，文件更新后自动重新加载
+
+    data为(song_ids, indptr, neighbors, scores)：song_ids[r]的相似歌曲是
+    neighbors[indptr[r]:indptr[r+1]]，按相似度降序排列。
+    """
+
+    def __init__(self, path=SIMILAR_SONGS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = (_EMPTY, np.zeros(1, dtype=np.int64), _EMPTY, np.empty(0, dtype=np.float32))
+        self._mtime = None
+        self._checked_at = 0
+
+    @property
+    def data(self):
+        self._refresh()
+        return self._data
+
+    def _refresh(self):
+        now = time.time()
+        if now - self._checked_at < RELOAD_INTERVAL:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                return
+            if mtime == self._mtime:
+                return
+            with np.load(self.path) as f:
+                self._data = (f['song_ids'], f['indptr'], f['neighbors'], f['scores'])
+            self._mtime = mtime
+
+    def similar(self, song_id, limit=10):
+        """返回[(歌曲id, 相似度), ...]"""
+        song_ids, indptr, neighbors, scores = self.data
+        row = np.searchsorted(song_ids, song_id)
+        if row >= len(song_ids) or song_ids[row] != song_id:
+            return []
+        start = indptr[row]
+        end = min(indptr[row + 1], start + limit)
+        return list(zip(neighbors[start:end].tolist(), scores[start:end].tolist()))
+
+# 进程内的全局相似歌曲表
+neighbor_table = NeighborTable()
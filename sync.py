@@ -0,0 +1,173 @@
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import event, func, inspect, literal, select
+from sqlalchemy.orm import Session
+from models import db, Singer, Album, Song, Genre, SongGenre, ChangeLog
+from pagination import decode_cursor, encode_cursor
+from serializers import serialize_by_ids
+
+# 增量同步配置
+SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', '1000'))             # 每次最多读取的变更日志条数
+SYNC_RETENTION_DAYS = int(os.getenv('SYNC_RETENTION_DAYS', '30'))     # 变更日志保留天数
+SYNC_SETTLE_SECONDS = int(os.getenv('SYNC_SETTLE_SECONDS', '5'))      # 新日志等待多久后才下发
+PRUNE_BATCH_SIZE = 10000
+
+# 参与同步的表
+SYNC_MODELS = {'singers': Singer, 'albums': Album, 'songs': Song}
+
+# 名称被嵌入到其他记录中的表：改名时这些记录的内容也随之变化
+EMBEDDED_NAMES = {
+    Singer: lambda singer_id: [
+        select(literal('songs'), Song.id).where(Song.singer_id == singer_id),
+        select(literal('albums'), Album.id).where(Album.singer_id == singer_id),
+    ],
+    Album: lambda album_id: [
+        select(literal('songs'), Song.id).where(Song.album_id == album_id),
+    ],
+    Genre: lambda genre_id: [
+        select(literal('songs'), SongGenre.song_id).where(SongGenre.genre_id == genre_id),
+    ],
+}
+
+class TokenExpired(Exception):
+    """同步令牌早于变更日志的保留期限，客户端需要重新全量加载"""
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def record(connection, table_name, ids, op='upsert', now=None):
+    """写入变更日志，批量导入等绕过ORM的写入也使用此函数"""
+    if table_name in SYNC_MODELS and ids:
+        now = now or _utcnow()
+        connection.execute(ChangeLog.__table__.insert(), [
+            {'table_name': table_name, 'row_id': row_id, 'op': op, 'created_at': now} for row_id in sorted(ids)
+        ])
+
+def record_renamed(connection, model, ids, now=None):
+    """为嵌入了被改名记录名称的记录写入upsert日志，ORM写入和批量导入共用"""
+    if model in EMBEDDED_NAMES and ids:
+        now = now or _utcnow()
+        for row_id in sorted(ids):
+            for dependents in EMBEDDED_NAMES[model](row_id):
+                connection.execute(ChangeLog.__table__.insert().from_select(
+                    ['table_name', 'row_id', 'op', 'created_at'],
+                    dependents.add_columns(literal('upsert'), literal(now))
+                ))
+
+@event.listens_for(Session, 'after_flush')
+def record_changes(session, flush_context):
+    """在同一事务中为本次flush写入的歌曲、专辑、歌手记录变更日志
+
+    除了记录本身，计数列随子记录变化的父记录（如被收藏的歌曲、新增歌曲所属的
+    歌手和专辑）以及嵌入了被改名记录名称的记录也记为upsert。
+    """
+    entries = {}  # (表名, id) -> upsert/delete
+    renamed = defaultdict(set)  # 模型 -> 被改名的id
+    for state, objects in (('new', session.new), ('dirty', session.dirty), ('deleted', session.deleted)):
+        for obj in objects:
+            if not hasattr(obj, '__table__'):
+                continue
+            if state == 'dirty' and not session.is_modified(obj):
+                continue
+            table = obj.__table__
+            attrs = inspect(obj).attrs
+            if table.name in SYNC_MODELS:
+                entries[table.name, obj.id] = 'delete' if state == 'deleted' else 'upsert'
+            if state == 'dirty' and type(obj) in EMBEDDED_NAMES and attrs.name.history.has_changes():
+                renamed[type(obj)].add(obj.id)
+            for column in table.columns:
+                for fk in column.foreign_keys:
+                    parent = fk.column.table.name
+                    if parent not in SYNC_MODELS:
+                        continue
+                    if state == 'dirty':
+                        history = attrs[column.key].history
+                        values = list(history.deleted) + list(history.added) if history.has_changes() else []
+                    else:
+                        values = [getattr(obj, column.key)]
+                    for value in values:
+                        if value is not None:
+                            entries.setdefault((parent, value), 'upsert')
+
+    if not entries and not renamed:
+        return
+    now = _utcnow()
+    connection = session.connection()
+    if entries:
+        connection.execute(ChangeLog.__table__.insert(), [
+            {'table_name': table_name, 'row_id': row_id, 'op': op, 'created_at': now}
+            for (table_name, row_id), op in sorted(entries.items())
+        ])
+    for model, ids in renamed.items():
+        record_renamed(connection, model, ids, now)
+
+def head_token():
+    """当前变更日志末尾的同步令牌，客户端全量加载之前先取得
+
+    令牌位置退回SYNC_SETTLE_SECONDS秒内的日志之前，尚未提交的变更不会被越过；
+    这些日志对应的记录可能已包含在全量数据中，再次下发也不影响结果。
+    """
+    cutoff = _utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    last_id = db.session.query(func.max(ChangeLog.id)).filter(ChangeLog.created_at <= cutoff).scalar() or 0
+    return encode_cursor(cutoff, last_id)
+
+def changes_since(token, limit=SYNC_PAGE_SIZE):
+    """返回令牌之后变化的记录
+
+    结果为{表名: {'upserted': [记录], 'deleted': [id]}, 'next_token': ..., 'has_more': ...}。
+    同一记录的多次变化合并为最终状态；upsert之后又被删除、或已不存在的记录归入deleted。
+    日志id在写入时分配、事务提交可能晚于后分配id的事务，因此只下发写入超过
+    SYNC_SETTLE_SECONDS秒的日志，避免客户端越过尚未提交的变更。
+    令牌无法解析时抛出pagination.InvalidCursor，过期时抛出TokenExpired。
+    """
+    issued_at, since_id = decode_cursor(token, ChangeLog.created_at)
+    now = _utcnow()
+    if issued_at < now - timedelta(days=SYNC_RETENTION_DAYS):
+        raise TokenExpired(token)
+
+    entries = db.session.execute(
+        select(ChangeLog.id, ChangeLog.table_name, ChangeLog.row_id, ChangeLog.op, ChangeLog.created_at)
+        .where(ChangeLog.id > since_id)
+        .order_by(ChangeLog.id)
+        .limit(limit)
+    ).all()
+    cutoff = now - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    latest = {table_name: {} for table_name in SYNC_MODELS}
+    last_id = since_id
+    settled = True
+    for entry in entries:
+        if entry.created_at > cutoff:
+            settled = False
+            break
+        latest[entry.table_name][entry.row_id] = entry.op
+        last_id, last_created_at = entry.id, entry.created_at
+    has_more = settled and len(entries) == limit
+
+    result = {}
+    for table_name, model in SYNC_MODELS.items():
+        ops = latest[table_name]
+        items = serialize_by_ids(model, sorted(row_id for row_id, op in ops.items() if op == 'upsert'), fields='*')
+        found = {item['id'] for item in items}
+        result[table_name] = {
+            'upserted': items,
+            'deleted': sorted(row_id for row_id in ops if row_id not in found)
+        }
+    # 令牌中的时间用于判断过期：之后的日志都不早于这个时间，保留期内不会被清理
+    result['next_token'] = encode_cursor(last_created_at if has_more else cutoff, last_id)
+    result['has_more'] = has_more
+    return result
+
+def prune_change_log():
+    """删除超过保留期限的变更日志，返回删除的条数"""
+    cutoff = _utcnow() - timedelta(days=SYNC_RETENTION_DAYS, seconds=SYNC_SETTLE_SECONDS)
+    deleted = 0
+    while True:
+        ids = db.session.execute(
+            select(ChangeLog.id).where(ChangeLog.created_at < cutoff).order_by(ChangeLog.id).limit(PRUNE_BATCH_SIZE)
+        ).scalars().all()
+        if not ids:
+            return deleted
+        db.session.execute(ChangeLog.__table__.delete().where(ChangeLog.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import random
+from datetime import datetime, timezone
+from functools import wraps
+from flask import g, make_response, request
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+from werkzeug.http import is_resource_modified
+from models import db, DataVersion
+
+# 每张表的版本号分散在多行中，写事务随机递增其中一行，避免所有写入在同一行的锁上排队；
+# 读取时各行求和，任何一行变化都会改变校验值。第0行沿用表名本身，兼容已有数据
+VERSION_SHARDS = int(os.getenv('VERSION_SHARDS', '8'))
+
+def _shard_names(name):
+    return [name] + [f'{name}#{shard}' for shard in range(1, VERSION_SHARDS)]
+
+def _upsert_statement(connection, names, now):
+    """生成 INSERT ... ON DUPLICATE KEY UPDATE version = version + 1 的语句"""
+    table = DataVersion.__table__
+    rows = [{'name': name, 'version': 1, 'updated_at': now} for name in names]
+    if connection.dialect.name == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+        statement = insert(table).values(rows)
+        return statement.on_duplicate_key_update(version=table.c.version + 1, updated_at=statement.inserted.updated_at)
+    from sqlalchemy.dialects.sqlite import insert
+    statement = insert(table).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=['name'],
+        set_={'version': table.c.version + 1, 'updated_at': statement.excluded.updated_at}
+    )
+
+def bump(connection, names):
+    """把names中各表的版本号加1（随机选一行递增），在事务提交前由bump_versions调用"""
+    if names:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        shard = random.randrange(VERSION_SHARDS)
+        connection.execute(_upsert_statement(connection, sorted(_shard_names(name)[shard] for name in names), now))
+
+def defer_bump(session, names):
+    """绕过ORM的写入登记版本号变化的表，与ORM写入一起在事务提交前递增、回滚时丢弃"""
+    session.info.setdefault('version_tables', set()).update(names)
+
+def changed_tables(obj, state):
+    """写入obj会改变其内容的表：自身所在的表，以及计数列随之变化的外键父表"""
+    table = obj.__table__
+    names = {table.name}
+    attrs = inspect(obj).attrs
+    for column in table.columns:
+        for fk in column.foreign_keys:
+            if state != 'dirty' or attrs[column.key].history.has_changes():
+                names.add(fk.column.table.name)
+    return names
+
+@event.listens_for(Session, 'after_flush')
+def collect_version_tables(session, flush_context):
+    """记录本次flush写入的表，提交前统一递增版本号"""
+    names = session.info.setdefault('version_tables', set())
+    for state, objects in (('new', session.new), ('dirty', session.dirty), ('deleted', session.deleted)):
+        for obj in objects:
+            if hasattr(obj, '__table__'):
+                names |= changed_tables(obj, state)
+
+@event.listens_for(Session, 'before_commit')
+def bump_versions(session):
+    """每个事务在提交前递增一次版本号，版本行的锁只在提交的这一刻持有
+
+    先flush剩余的改动（commit本身的flush在此事件之后），保证这些改动涉及的表也被记录。
+    """
+    session.flush()
+    bump(session.connection(), session.info.pop('version_tables', None))
+
+@event.listens_for(Session, 'after_rollback')
+def discard_version_tables(session):
+    session.info.pop('version_tables', None)
+
+def current_versions(names):
+    """一次主键查询读取各表的(版本号, 更新时间)：各行版本号之和与最近的更新时间，没有记录的表视为(0, None)"""
+    table_of = {shard: name for name in names for shard in _shard_names(name)}
+    rows = db.session.execute(
+        select(DataVersion.name, DataVersion.version, DataVersion.updated_at)
+        .where(DataVersion.name.in_(sorted(table_of)))
+    ).all()
+    versions = {name: (0, None) for name in names}
+    for shard, version, updated_at in rows:
+        total, latest = versions[table_of[shard]]
+        versions[table_of[shard]] = (total + version, max(latest, updated_at) if latest else updated_at)
+    return versions
+
+def conditional(*models, daily=False):
+    """为GET接口加上ETag/Last-Modified校验，客户端缓存仍然有效时直接返回304
+
+    校验值由请求路径、查询参数和models各表的版本号生成，在加载数据、序列化之前
+    计算，因此304响应只需要一次版本表查询。daily为True的接口（结果依赖当天日期）
+    在校验值中加入日期，并且Last-Modified不早于当天零点。
+    校验值同时保存在g.cache_validator中，响应缓存把它加入缓存键，
+    使缓存的响应体与ETag对应同一组版本号。
+    """
+    names = {model.__tablename__ for model in models}
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = current_versions(names)
+            parts = [request.full_path] + [f'{name}:{versions[name][0]}' for name in sorted(names)]
+            timestamps = [updated_at for _, updated_at in versions.values() if updated_at]
+            if daily:
+                today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+                parts.append(today.date().isoformat())
+                timestamps.append(today)
+            etag = hashlib.sha1('|'.join(parts).encode()).hexdigest()[:32]
+            last_modified = max(timestamps).replace(tzinfo=timezone.utc, microsecond=0) if timestamps else None
+
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = make_response('', 304)
+            else:
+                g.cache_validator = etag
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            if last_modified:
+                response.last_modified = last_modified
+            response.cache_control.no_cache = True  # 浏览器每次使用前都要带校验值重新验证
+            return response
+        return wrapper
+    return decorator